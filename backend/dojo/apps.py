@@ -1,6 +1,5 @@
 from django.apps import AppConfig
 import logging
-import threading
 import atexit  # 終了時の処理を登録するため
 import shutil
 import os
@@ -14,21 +13,10 @@ class DojoConfig(AppConfig):
 
     def ready(self):
         """
-        Django 起動時に呼ばれる。Playwright の初期化を別スレッドで行い、
-        イベントループのブロッキングを防止する。また、utils.py に shutdown 関数があれば
-        atexit を使って登録する。
+        Django 起動時に呼ばれる。utils.py に shutdown 関数があれば atexit を使って登録する。
+        (Playwright のブラウザの事前起動は gunicorn.conf.py の post_worker_init で、ワーカーごとに行う)
         """
-        logger.debug("DojoConfig ready() called. Initializing Playwright in separate thread.")
-
-        # utils から非同期初期化関数をインポートして別スレッドで実行
-        try:
-            from .utils import async_initialize
-            thread = threading.Thread(target=async_initialize)
-            thread.daemon = True  # Django 停止時にスレッドも停止
-            thread.start()
-            logger.debug("Playwright initialization thread started.")
-        except ImportError as e:
-            logger.error(f"Error importing async_initialize: {e}")
+        logger.debug("DojoConfig ready() called.")
 
         # オプション： shutdown 関数の登録
         try:
@@ -38,6 +26,11 @@ class DojoConfig(AppConfig):
         except ImportError:
             logger.warning("No shutdown function found in utils.py. Skipping.")
 
+        # migrate でテーブルが作り直されると SQLite の全文検索トリガーが消えるので張り直す
+        from django.db.models.signals import post_migrate
+        from .search import ensure_search_index_after_migrate
+        post_migrate.connect(ensure_search_index_after_migrate, sender=self)
+
 def cleanup_tmp():
     """
     アプリケーション専用の一時ディレクトリ（この例では、apps.py のあるディレクトリ内の 'tmp'）を
@@ -0,0 +1,250 @@
+"""
+browser.py – Instagram リンク抽出の Playwright フォールバック用ブラウザプール。
+
+以前はサイトごとに async_playwright() と chromium.launch() を行い、毎回数秒の CPU と
+数百 MB のメモリを使っていた。イベントループ (通常はワーカープロセスごとの outbound の
+バックグラウンドループ) ごとに Chromium を 1 つ起動したまま使い回し、BrowserContext も一定回数まで再利用する。
+
+- 同時に開くページ数は MAX_PAGES まで
+- PAGES_PER_BROWSER ページごと、または子プロセスの RSS が MAX_RSS_MB を超えたらブラウザを作り直す
+  (使用中のページが終わってから古いブラウザを閉じる)
+- 画像・動画・フォントは読み込まない
+"""
+import asyncio
+import logging
+import os
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+
+from playwright.async_api import Browser, BrowserContext, Page, async_playwright
+
+logger = logging.getLogger(__name__)
+
+MAX_PAGES = 4
+PAGES_PER_BROWSER = 200
+PAGES_PER_CONTEXT = 20
+MAX_RSS_MB = 1024
+RSS_CHECK_EVERY = 10        # ページ何枚ごとにメモリを測るか
+JS_HEAP_MB = 256
+BLOCKED_RESOURCES = {"image", "media", "font"}
+LAUNCH_ARGS = [
+    "--disable-dev-shm-usage",
+    "--disable-gpu",
+    "--disable-extensions",
+    "--no-first-run",
+    f"--js-flags=--max-old-space-size={JS_HEAP_MB}",
+]
+
+
+def descendants_rss_mb(root_pid: Optional[int] = None) -> float:
+    """
+    このプロセスの子孫 (Playwright ドライバと Chromium) の RSS 合計 (MB)。/proc が無ければ 0。
+    """
+    root_pid = root_pid or os.getpid()
+    try:
+        pids = [int(p) for p in os.listdir("/proc") if p.isdigit()]
+    except OSError:
+        return 0.0
+    children: Dict[int, List[int]] = {}
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(pid)
+
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    total, stack = 0, list(children.get(root_pid, []))
+    while stack:
+        pid = stack.pop()
+        stack.extend(children.get(pid, []))
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            continue
+    return total / (1024 * 1024)
+
+
+class _BrowserSlot:
+    def __init__(self, browser: Browser):
+        self.browser = browser
+        self.pages_served = 0
+        self.in_use = 0
+        self.retired = False
+        self.idle_contexts: List[BrowserContext] = []
+        self.context_uses: Dict[BrowserContext, int] = {}
+
+
+class BrowserPool:
+    def __init__(
+        self,
+        max_pages: int = MAX_PAGES,
+        pages_per_browser: int = PAGES_PER_BROWSER,
+        pages_per_context: int = PAGES_PER_CONTEXT,
+        max_rss_mb: float = MAX_RSS_MB,
+    ):
+        self.max_pages = max_pages
+        self.pages_per_browser = pages_per_browser
+        self.pages_per_context = pages_per_context
+        self.max_rss_mb = max_rss_mb
+        self._playwright = None
+        self._slot: Optional[_BrowserSlot] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._pages_since_rss_check = 0
+        self.stats = {"pages": 0, "browsers_launched": 0, "recycled_for_memory": 0}
+
+    def _primitives(self):
+        # プールを使うループ上で作る
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+            self._semaphore = asyncio.Semaphore(self.max_pages)
+        return self._lock, self._semaphore
+
+    async def start(self) -> None:
+        """Playwright とブラウザを起動しておく (DojoConfig.ready から)。"""
+        lock, _ = self._primitives()
+        async with lock:
+            await self._current_slot()
+
+    async def _current_slot(self) -> _BrowserSlot:
+        # lock を取った状態で呼ぶ
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+        slot = self._slot
+        if slot is not None and not slot.retired and slot.browser.is_connected():
+            return slot
+        if slot is not None:
+            slot.retired = True
+            await self._close_if_drained(slot)
+        browser = await self._playwright.chromium.launch(headless=True, args=LAUNCH_ARGS)
+        self._slot = _BrowserSlot(browser)
+        self.stats["browsers_launched"] += 1
+        logger.debug(f"[browser] launched chromium #{self.stats['browsers_launched']}")
+        return self._slot
+
+    async def _checkout(self) -> "tuple[_BrowserSlot, BrowserContext]":
+        lock, _ = self._primitives()
+        async with lock:
+            slot = await self._current_slot()
+            slot.in_use += 1
+            slot.pages_served += 1
+            if slot.pages_served >= self.pages_per_browser:
+                slot.retired = True  # このページを最後に新しいブラウザへ切り替える
+            context = slot.idle_contexts.pop() if slot.idle_contexts else None
+        if context is None:
+            context = await slot.browser.new_context(java_script_enabled=True)
+            await context.route("**/*", _block_heavy_resources)
+            slot.context_uses[context] = 0
+        slot.context_uses[context] += 1
+        return slot, context
+
+    async def _checkin(self, slot: _BrowserSlot, context: BrowserContext) -> None:
+        lock, _ = self._primitives()
+        reuse = (
+            not slot.retired
+            and slot.context_uses.get(context, 0) < self.pages_per_context
+            and slot.browser.is_connected()
+        )
+        if reuse:
+            try:
+                await context.clear_cookies()
+            except Exception:
+                reuse = False
+        if not reuse:
+            slot.context_uses.pop(context, None)
+            await _quietly(context.close())
+        async with lock:
+            slot.in_use -= 1
+            if reuse:
+                slot.idle_contexts.append(context)
+            self._pages_since_rss_check += 1
+            if self._pages_since_rss_check >= RSS_CHECK_EVERY and not slot.retired:
+                self._pages_since_rss_check = 0
+                rss = await asyncio.get_running_loop().run_in_executor(None, descendants_rss_mb)
+                if rss > self.max_rss_mb:
+                    logger.info(f"[browser] RSS {rss:.0f}MB > {self.max_rss_mb}MB, recycling browser")
+                    slot.retired = True
+                    self.stats["recycled_for_memory"] += 1
+            await self._close_if_drained(slot)
+
+    async def _close_if_drained(self, slot: _BrowserSlot) -> None:
+        if slot.retired and slot.in_use == 0 and slot.browser.is_connected():
+            for context in slot.idle_contexts:
+                await _quietly(context.close())
+            slot.idle_contexts.clear()
+            await _quietly(slot.browser.close())
+
+    @asynccontextmanager
+    async def page(self) -> AsyncIterator[Page]:
+        """
+        空きを待ってページを 1 枚貸し出す。
+            async with get_pool().page() as page:
+                await page.goto(url)
+        """
+        _, semaphore = self._primitives()
+        async with semaphore:
+            slot, context = await self._checkout()
+            page = None
+            try:
+                page = await context.new_page()
+                self.stats["pages"] += 1
+                yield page
+            finally:
+                if page is not None:
+                    await _quietly(page.close())
+                await self._checkin(slot, context)
+
+    async def close(self) -> None:
+        lock, _ = self._primitives()
+        async with lock:
+            if self._slot is not None:
+                self._slot.retired = True
+                self._slot.in_use = 0
+                await self._close_if_drained(self._slot)
+                self._slot = None
+            if self._playwright is not None:
+                await _quietly(self._playwright.stop())
+                self._playwright = None
+
+
+async def _block_heavy_resources(route) -> None:
+    if route.request.resource_type in BLOCKED_RESOURCES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def _quietly(coro) -> None:
+    try:
+        await coro
+    except Exception as e:
+        logger.debug(f"[browser] ignored error on close: {e}")
+
+
+_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, BrowserPool]" = weakref.WeakKeyDictionary()
+
+
+def get_pool() -> BrowserPool:
+    """
+    実行中のイベントループに紐づくブラウザプールを返す (通常は outbound のバックグラウンドループ)。
+    """
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = BrowserPool()
+        _pools[loop] = pool
+    return pool
+
+
+async def warm_pool() -> None:
+    await get_pool().start()
+
+
+async def close_pool() -> None:
+    pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.close()
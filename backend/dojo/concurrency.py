@@ -0,0 +1,157 @@
+"""
+concurrency.py – Place Details の同時実行数を AIMD で調整するリミッタ。
+
+成功が続けば同時実行数を 1 ずつ増やし (additive increase)、混雑のサイン (例外・タイムアウト・
+429 / 5xx / OVER_QUERY_LIMIT・遅延超過) があれば半分にする (multiplicative decrease)。
+検索ごとに 1 つ作り、前回の検索で落ち着いた上限から始める。
+
+遅延は observe_call() で囲んだ HTTP 呼び出しだけを測る。レート制限 (dojo.ratelimit) の待ちや
+キャッシュヒットは上流の混雑ではないので数えない。NOT_FOUND などの通常の API エラーも失敗にしない。
+"""
+import asyncio
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+INITIAL_LIMIT = 8
+MIN_LIMIT = 2
+MAX_LIMIT = 32
+TARGET_LATENCY_SEC = 2.0   # これより遅い応答は混雑とみなす
+OVERLOAD_API_STATUSES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR"}  # UNKNOWN_ERROR は Google 側のサーバーエラー
+
+_last_limit = INITIAL_LIMIT
+
+
+class UpstreamCall:
+    """
+    AdaptiveLimiter.run の中の 1 回の実行で観測した上流の呼び出し。
+    """
+
+    def __init__(self):
+        self.latency: Optional[float] = None  # observe_call で測った時間 (呼んでいなければ None)
+        self.overloaded = False
+
+    def record(self, http_status: int, api_status: Optional[str] = None) -> None:
+        if http_status == 429 or http_status >= 500 or api_status in OVERLOAD_API_STATUSES:
+            self.overloaded = True
+
+
+_current_call: contextvars.ContextVar[Optional[UpstreamCall]] = contextvars.ContextVar(
+    "dojo_upstream_call", default=None
+)
+
+
+@contextmanager
+def observe_call() -> Iterator[UpstreamCall]:
+    """
+    HTTP 呼び出しを囲んで所要時間を測る。yield した UpstreamCall.record() に応答のステータスを渡す。
+    例外は混雑として扱う。AdaptiveLimiter.run の外では何も記録しない。
+    """
+    call = _current_call.get() or UpstreamCall()
+    started = time.monotonic()
+    try:
+        yield call
+    except Exception:
+        call.overloaded = True
+        raise
+    finally:
+        call.latency = (call.latency or 0.0) + time.monotonic() - started
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        initial: Optional[int] = None,
+        minimum: int = MIN_LIMIT,
+        maximum: int = MAX_LIMIT,
+        target_latency: float = TARGET_LATENCY_SEC,
+    ):
+        self.limit = min(max(initial or _last_limit, minimum), maximum)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.in_flight = 0
+        self._successes_at_limit = 0
+        self._cond: Optional[asyncio.Condition] = None
+        self._stats = {
+            "requests": 0,
+            "calls": 0,            # 実際に上流を呼んだ回数
+            "errors": 0,
+            "timeouts": 0,
+            "max_in_flight": 0,
+            "total_latency": 0.0,
+            "initial_limit": self.limit,
+        }
+
+    def _condition(self) -> asyncio.Condition:
+        # 実行中のループで作る (生成したスレッドと実行するループが異なる場合がある)
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def run(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        空きができるまで待って fn() を実行する。上限の調整には fn() 内の observe_call() の結果と
+        fn() の例外だけを使い、上流を呼ばなかった実行 (キャッシュヒット等) では調整しない。
+        """
+        cond = self._condition()
+        async with cond:
+            await cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self.in_flight)
+
+        call = UpstreamCall()
+        token = _current_call.set(call)
+        try:
+            return await fn()
+        except asyncio.TimeoutError:
+            self._stats["timeouts"] += 1
+            call.overloaded = True
+            raise
+        except Exception:
+            call.overloaded = True
+            raise
+        finally:
+            _current_call.reset(token)
+            self._stats["requests"] += 1
+            if call.latency is not None:
+                self._stats["calls"] += 1
+                self._stats["total_latency"] += call.latency
+            if call.overloaded:
+                self._stats["errors"] += 1
+            async with cond:
+                self.in_flight -= 1
+                if call.overloaded:
+                    self._adjust(False)
+                elif call.latency is not None:
+                    self._adjust(call.latency <= self.target_latency)
+                cond.notify_all()
+
+    def _adjust(self, healthy: bool) -> None:
+        global _last_limit
+        if healthy:
+            self._successes_at_limit += 1
+            if self._successes_at_limit >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self._successes_at_limit = 0
+        else:
+            self.limit = max(self.minimum, self.limit // 2)
+            self._successes_at_limit = 0
+        _last_limit = self.limit
+
+    def stats(self) -> Dict[str, Any]:
+        calls = self._stats["calls"]
+        return {
+            "requests": self._stats["requests"],
+            "calls": calls,
+            "errors": self._stats["errors"],
+            "timeouts": self._stats["timeouts"],
+            "max_in_flight": self._stats["max_in_flight"],
+            "avg_latency_ms": round(1000 * self._stats["total_latency"] / calls) if calls else 0,
+            "initial_limit": self._stats["initial_limit"],
+            "final_limit": self.limit,
+        }
@@ -0,0 +1,55 @@
+"""
+crawlcache.py – 道場サイトの条件付き GET 用の記録 (WebsiteCrawl)。
+
+24h の抽出結果キャッシュが切れるたびにトップページを丸ごと取り直していたので、
+前回の ETag / Last-Modified を If-None-Match / If-Modified-Since で送り、
+304 なら前回の抽出結果を使う。200 でも本文のハッシュが前回と同じなら抽出 (と Playwright) を省く。
+"""
+import logging
+from typing import Dict, Mapping, Optional
+
+from django.utils.timezone import now
+
+from .models import WebsiteCrawl
+
+logger = logging.getLogger(__name__)
+
+
+def load(url: str) -> Optional[WebsiteCrawl]:
+    return WebsiteCrawl.objects.filter(url=url[:500]).first()
+
+
+def conditional_headers(crawl: Optional[WebsiteCrawl]) -> Dict[str, str]:
+    headers = {}
+    if crawl is not None:
+        if crawl.etag:
+            headers["If-None-Match"] = crawl.etag
+        if crawl.last_modified:
+            headers["If-Modified-Since"] = crawl.last_modified
+    return headers
+
+
+def validators(response_headers: Mapping[str, str]) -> Dict[str, str]:
+    return {
+        "etag": (response_headers.get("ETag") or "")[:255],
+        "last_modified": (response_headers.get("Last-Modified") or "")[:64],
+    }
+
+
+def touch(crawl: WebsiteCrawl) -> None:
+    """304 / 同一本文だったときは再検証時刻だけ更新する。"""
+    WebsiteCrawl.objects.filter(pk=crawl.pk).update(checked_at=now())
+
+
+def store(url: str, validators: Dict[str, str], content_hash: str, instagram: Optional[str]) -> None:
+    ts = now()
+    WebsiteCrawl.objects.update_or_create(
+        url=url[:500],
+        defaults={
+            **validators,
+            "content_hash": content_hash,
+            "instagram": (instagram or "")[:500],
+            "fetched_at": ts,
+            "checked_at": ts,
+        },
+    )
@@ -0,0 +1,167 @@
+"""
+enrichment.py – お気に入り追加時の道場情報 (評価・レビュー・営業時間・Instagram) の補完。
+
+以前は FavoriteViewSet.create のトランザクション内で Place Details と Instagram 取得
+(Playwright の起動を含む) を待っていた。お気に入りはすぐに作成し、補完は EnrichmentJob として
+バックグラウンドで実行する。ジョブは place_id (Dojo) ごとに 1 件で、実行中・待機中の重複依頼はまとめる。
+失敗したら間隔を倍にしながら MAX_ATTEMPTS 回まで再試行する。
+
+実行先は ENRICHMENT_USE_CELERY=True なら Celery (tasks.enrich_dojo_task)、
+それ以外はプロセス内のスレッドプール。再試行の予約はプロセスと一緒に消えるので、
+更新の止まった待機中・実行中のジョブは resume_stale_jobs (定期タスク) と次の依頼で実行し直す。
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils.timezone import now
+
+from .ingest import save_reviews
+from .models import Dojo, EnrichmentJob, PlaceReviews
+from .utils import fetch_instagram_link, fetch_place_details
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 4
+RETRY_BASE_SEC = 30        # 30s → 60s → 120s
+STALE_RUNNING_SEC = 600    # running のまま更新が無いジョブは落ちたものとみなす
+STALE_PENDING_SEC = RETRY_BASE_SEC * 2 ** (MAX_ATTEMPTS - 1) + 60  # 最長の再試行間隔を過ぎても pending
+WORKERS = 2
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def needs_enrichment(dojo: Dojo) -> bool:
+    # Place Details (レビュー) を一度も取得していない道場
+    return not PlaceReviews.objects.filter(dojo_id=dojo.pk).exists()
+
+
+def request_enrichment(dojo: Dojo) -> EnrichmentJob:
+    """
+    補完ジョブを登録し、トランザクション確定後に実行を依頼する。
+    同じ道場のジョブが待機中・実行中ならそれを返すだけ。
+    """
+    job, created = EnrichmentJob.objects.get_or_create(dojo=dojo)
+    if not created:
+        if job.status in (EnrichmentJob.PENDING, EnrichmentJob.RUNNING) and not _is_stale(job, now()):
+            return job
+        if job.status == EnrichmentJob.DONE and not needs_enrichment(dojo):
+            return job
+        # 失敗・停止したジョブはやり直す (同時に来た依頼とは status と updated_at で取り合う)
+        requeued = EnrichmentJob.objects.filter(pk=job.pk, status=job.status, updated_at=job.updated_at).update(
+            status=EnrichmentJob.PENDING, attempts=0, last_error="", updated_at=now()
+        )
+        job.refresh_from_db()
+        if not requeued:
+            return job
+    transaction.on_commit(lambda: dispatch(dojo.pk))
+    return job
+
+
+def _is_stale(job: EnrichmentJob, at) -> bool:
+    if job.status == EnrichmentJob.RUNNING:
+        return job.updated_at < at - timedelta(seconds=STALE_RUNNING_SEC)
+    if job.status == EnrichmentJob.PENDING:
+        return job.updated_at < at - timedelta(seconds=STALE_PENDING_SEC)
+    return False
+
+
+def resume_stale_jobs() -> int:
+    """
+    再試行の予約や実行中のワーカーが失われたジョブを実行し直し、その件数を返す。
+    """
+    at = now()
+    stale = EnrichmentJob.objects.filter(
+        Q(status=EnrichmentJob.PENDING, updated_at__lt=at - timedelta(seconds=STALE_PENDING_SEC))
+        | Q(status=EnrichmentJob.RUNNING, updated_at__lt=at - timedelta(seconds=STALE_RUNNING_SEC))
+    ).only("pk", "dojo_id", "status", "updated_at")
+    resumed = 0
+    for job in stale:
+        if EnrichmentJob.objects.filter(pk=job.pk, status=job.status, updated_at=job.updated_at).update(
+            status=EnrichmentJob.PENDING, updated_at=at
+        ):
+            dispatch(job.dojo_id)
+            resumed += 1
+    if resumed:
+        logger.info(f"[enrichment] resumed {resumed} stale job(s)")
+    return resumed
+
+
+def dispatch(dojo_id: int, countdown: float = 0) -> None:
+    if settings.ENRICHMENT_USE_CELERY:
+        from .tasks import enrich_dojo_task
+        enrich_dojo_task.apply_async((dojo_id,), countdown=countdown)
+        return
+    if countdown > 0:
+        timer = threading.Timer(countdown, dispatch, args=(dojo_id,))
+        timer.daemon = True
+        timer.start()
+        return
+    _get_executor().submit(_run_in_thread, dojo_id)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="dojo-enrichment")
+        return _executor
+
+
+def _run_in_thread(dojo_id: int) -> None:
+    try:
+        run_enrichment(dojo_id)
+    except Exception as e:
+        logger.error(f"[enrichment] dojo={dojo_id}: {e}", exc_info=True)
+    finally:
+        close_old_connections()
+
+
+def run_enrichment(dojo_id: int) -> Optional[str]:
+    """
+    待機中のジョブを 1 件実行し、終了後の status を返す。他で処理中・完了済みなら None。
+    ネットワーク待ちの間は DB トランザクションを開かない。
+    """
+    claimed = EnrichmentJob.objects.filter(dojo_id=dojo_id, status=EnrichmentJob.PENDING).update(
+        status=EnrichmentJob.RUNNING, attempts=F("attempts") + 1, updated_at=now()
+    )
+    if not claimed:
+        return None
+    job = EnrichmentJob.objects.select_related("dojo").get(dojo_id=dojo_id)
+    dojo = job.dojo
+    try:
+        detail = fetch_place_details(dojo.place_id, settings.GOOGLE_API_KEY)
+        if not detail:
+            raise RuntimeError("Place Details returned no result")
+        dojo.rating = detail.get("rating")
+        if detail.get("hours"):
+            dojo.hours = detail["hours"]
+        if detail.get("website"):
+            dojo.website = detail["website"]
+        dojo.save(update_fields=["rating", "hours", "website"])
+        save_reviews(dojo, detail.get("reviews", []))
+
+        if dojo.website:
+            dojo.instagram = fetch_instagram_link(dojo.website)
+            dojo.save(update_fields=["instagram"])
+
+        job.status = EnrichmentJob.DONE
+        job.last_error = ""
+        job.completed_at = now()
+        job.save(update_fields=["status", "last_error", "completed_at", "updated_at"])
+        logger.debug(f"[enrichment] {dojo.place_id}: done")
+    except Exception as e:
+        retry = job.attempts < MAX_ATTEMPTS
+        job.status = EnrichmentJob.PENDING if retry else EnrichmentJob.FAILED
+        job.last_error = str(e)[:1000]
+        job.save(update_fields=["status", "last_error", "updated_at"])
+        logger.warning(f"[enrichment] {dojo.place_id}: attempt {job.attempts} failed: {e}")
+        if retry:
+            dispatch(dojo_id, countdown=RETRY_BASE_SEC * 2 ** (job.attempts - 1))
+    return job.status
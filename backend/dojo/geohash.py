@@ -0,0 +1,191 @@
+"""
+geohash.py – 緯度経度 ↔ geohash 変換と、円を覆うセルの計算。
+Django に依存しない純粋な関数だけを置く（マイグレーションからも利用する）。
+"""
+import math
+from typing import Set, Tuple
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_DECODE = {c: i for i, c in enumerate(_BASE32)}
+
+EARTH_RADIUS_M = 6371000
+METERS_PER_DEGREE = 111320
+MAX_PRECISION = 9  # ~4.8m x 4.8m
+
+
+def encode(lat: float, lng: float, precision: int = MAX_PRECISION) -> str:
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True  # 偶数ビットは経度
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng >= mid:
+                bits = (bits << 1) | 1
+                lng_lo = mid
+            else:
+                bits <<= 1
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_lo = mid
+            else:
+                bits <<= 1
+                lat_hi = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def bbox(geohash: str) -> Tuple[float, float, float, float]:
+    """
+    geohash セルの範囲を (min_lat, min_lng, max_lat, max_lng) で返す。
+    """
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    even = True
+    for c in geohash:
+        value = _DECODE[c]
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                mid = (lng_lo + lng_hi) / 2
+                if bit:
+                    lng_lo = mid
+                else:
+                    lng_hi = mid
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                if bit:
+                    lat_lo = mid
+                else:
+                    lat_hi = mid
+            even = not even
+    return lat_lo, lng_lo, lat_hi, lng_hi
+
+
+def center(geohash: str) -> Tuple[float, float]:
+    min_lat, min_lng, max_lat, max_lng = bbox(geohash)
+    return (min_lat + max_lat) / 2, (min_lng + max_lng) / 2
+
+
+def cell_size_deg(precision: int) -> Tuple[float, float]:
+    """
+    精度 precision のセルの (高さ, 幅) を度で返す。
+    """
+    lng_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lng_bits)
+
+
+def _lng_scale(lat: float) -> float:
+    return max(math.cos(math.radians(lat)), 0.01)
+
+
+def precision_for_radius(lat: float, radius_m: float) -> int:
+    """
+    セルの高さ・幅がともに radius_m 以上になる最大の精度。
+    このセルと隣接 8 セルで半径 radius_m の円を必ず覆える。
+    """
+    for precision in range(MAX_PRECISION, 0, -1):
+        height, width = cell_size_deg(precision)
+        if (
+            height * METERS_PER_DEGREE >= radius_m
+            and width * METERS_PER_DEGREE * _lng_scale(lat) >= radius_m
+        ):
+            return precision
+    return 1
+
+
+def neighbors(geohash: str) -> Set[str]:
+    """
+    自分自身を含む周囲 3x3 のセル。極を越えるセルは含めない。
+    """
+    precision = len(geohash)
+    height, width = cell_size_deg(precision)
+    lat, lng = center(geohash)
+    cells = set()
+    for dlat in (-height, 0.0, height):
+        nlat = lat + dlat
+        if nlat <= -90 or nlat >= 90:
+            continue
+        for dlng in (-width, 0.0, width):
+            nlng = (lng + dlng + 180) % 360 - 180
+            cells.add(encode(nlat, nlng, precision))
+    return cells
+
+
+def covering_cells(lat: float, lng: float, radius_m: float) -> Set[str]:
+    return neighbors(encode(lat, lng, precision_for_radius(lat, radius_m)))
+
+
+def distance_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """
+    2 点間の大円距離 (haversine, メートル)
+    """
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _circle_intersects(geohash: str, lat: float, lng: float, radius_m: float) -> bool:
+    min_lat, min_lng, max_lat, max_lng = bbox(geohash)
+    if lng - min_lng > 180:
+        lng -= 360
+    elif max_lng - lng > 180:
+        lng += 360
+    near_lat = min(max(lat, min_lat), max_lat)
+    near_lng = min(max(lng, min_lng), max_lng)
+    return distance_m(lat, lng, near_lat, near_lng) <= radius_m
+
+
+def tiles_for_circle(
+    lat: float,
+    lng: float,
+    radius_m: float,
+    min_precision: int = 4,
+    max_precision: int = 7,
+) -> Set[str]:
+    """
+    円と交差する固定タイル (geohash セル) の集合。
+    タイルの大きさは直径以上になる精度を選ぶので、小さな円なら 4 枚以下に収まる。
+    精度は min_precision 以上に制限する (タイル全体を半径 50km 以内の NearbySearch で覆うため)。
+    """
+    precision = min(max(precision_for_radius(lat, 2 * radius_m), min_precision), max_precision)
+    height, width = cell_size_deg(precision)
+    dlat = radius_m / METERS_PER_DEGREE
+    dlng = radius_m / (METERS_PER_DEGREE * _lng_scale(lat))
+    start_lat, start_lng = center(encode(max(lat - dlat, -89.999999), (lng - dlng + 180) % 360 - 180, precision))
+    if start_lng > lng:  # 日付変更線をまたいだ場合は連続した経度に戻す
+        start_lng -= 360
+    tiles = set()
+    tile_lat = start_lat
+    while tile_lat - height / 2 <= min(lat + dlat, 90.0):
+        tile_lng = start_lng
+        while tile_lng - width / 2 <= lng + dlng:
+            tile = encode(tile_lat, (tile_lng + 180) % 360 - 180, precision)
+            if _circle_intersects(tile, lat, lng, radius_m):
+                tiles.add(tile)
+            tile_lng += width
+        tile_lat += height
+    return tiles
+
+
+def tile_radius_m(geohash: str) -> float:
+    """
+    タイル中心から角までの距離 (タイル全体を覆う NearbySearch の半径)
+    """
+    min_lat, min_lng, max_lat, max_lng = bbox(geohash)
+    lat, lng = center(geohash)
+    return distance_m(lat, lng, max_lat if lat >= 0 else min_lat, max_lng)
@@ -0,0 +1,148 @@
+"""
+htmlscan.py – 道場サイトの HTML から最初の Instagram リンクを探す。
+
+ページ全体をダウンロードして BeautifulSoup の木を作る代わりに、レスポンスをチャンクごとに読みながら
+<a ... href="...instagram.com..."> を正規表現 (bytes のまま) で探し、見つかった時点か
+MAX_SCAN_BYTES に達した時点で読むのをやめる。正規表現で見つからないのに "instagram.com" という
+文字列だけはあった場合に限り、読んだ分を BeautifulSoup で解析する (イベントループ外で)。
+"""
+import asyncio
+import hashlib
+import html
+import re
+from typing import Iterable, Optional
+
+from bs4 import BeautifulSoup
+
+CHUNK_SIZE = 16 * 1024
+MAX_SCAN_BYTES = 1024 * 1024
+OVERLAP_BYTES = 4096      # チャンクの境目をまたぐタグ用に前回の末尾を残す
+HINT = b"instagram.com"
+
+# JS で描画されるページの目印 (rendergate が Playwright を使うか判断するのに使う)
+_SPA_MARKER_RE = re.compile(
+    rb"""id=["'](?:root|app|__next|__nuxt|___gatsby)["']|__NEXT_DATA__|window\.__NUXT__|ng-version=|data-reactroot|data-server-rendered""",
+    re.IGNORECASE,
+)
+_ANCHOR_RE = re.compile(rb"<a\s", re.IGNORECASE)
+_SCRIPT_RE = re.compile(rb"<script\b", re.IGNORECASE)
+
+# 値の終端 (引用符・空白・>) まで届いたものだけ (チャンク末尾で切れた URL を返さない)
+_ANCHOR_HREF_RE = re.compile(
+    rb"""<a\s[^>]*?href\s*=\s*["']?([^"'\s>]*instagram\.com[^"'\s>]*)(?=["'\s>])""",
+    re.IGNORECASE,
+)
+
+
+class InstagramLinkScanner:
+    """
+    feed() にチャンクを渡し、リンクが見つかったらそれを返す。
+    最後に finish() (または finish_async()) で取りこぼしを確認する。
+    """
+
+    def __init__(self, max_bytes: int = MAX_SCAN_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+        self.saw_hint = False
+        self.anchors = 0
+        self.scripts = 0
+        self.spa_marker = False
+        self._chunks = []
+        self._tail = b""
+        self._sha1 = hashlib.sha1()
+
+    @property
+    def content_hash(self) -> str:
+        """読んだ分の本文の sha1 (crawlcache が前回と同じ本文か判定するのに使う)"""
+        return self._sha1.hexdigest()
+
+    @property
+    def exhausted(self) -> bool:
+        return self.bytes_read >= self.max_bytes
+
+    def feed(self, chunk: bytes) -> Optional[str]:
+        if not chunk:
+            return None
+        if self.bytes_read + len(chunk) > self.max_bytes:
+            chunk = chunk[: self.max_bytes - self.bytes_read]
+        self.bytes_read += len(chunk)
+        self._chunks.append(chunk)
+        self._sha1.update(chunk)
+        window = self._tail + chunk
+        self._tail = window[-OVERLAP_BYTES:]
+        self.anchors += len(_ANCHOR_RE.findall(chunk))
+        self.scripts += len(_SCRIPT_RE.findall(chunk))
+        if not self.spa_marker and _SPA_MARKER_RE.search(window):
+            self.spa_marker = True
+        if HINT not in window.lower():
+            return None
+        self.saw_hint = True
+        m = _ANCHOR_HREF_RE.search(window)
+        return _decode_href(m.group(1)) if m else None
+
+    def finish(self) -> Optional[str]:
+        """
+        正規表現で拾えなかった変則的なマークアップのために、ヒントがあったときだけ木を作る。
+        """
+        if not self.saw_hint:
+            return None
+        soup = BeautifulSoup(b"".join(self._chunks), "html.parser")
+        for a in soup.find_all("a", href=True):
+            if "instagram.com" in a["href"]:
+                return a["href"]
+        return None
+
+    async def finish_async(self) -> Optional[str]:
+        if not self.saw_hint:
+            return None
+        return await asyncio.get_running_loop().run_in_executor(None, self.finish)
+
+
+def _decode_href(raw: bytes) -> str:
+    return html.unescape(raw.decode("utf-8", errors="replace"))
+
+
+def scan_chunks(chunks: Iterable[bytes], max_bytes: int = MAX_SCAN_BYTES) -> Optional[str]:
+    """
+    同期版 (requests の iter_content など)。
+    """
+    scanner = InstagramLinkScanner(max_bytes)
+    for chunk in chunks:
+        link = scanner.feed(chunk)
+        if link:
+            return link
+        if scanner.exhausted:
+            break
+    return scanner.finish()
+
+
+async def scan_response(
+    resp, max_bytes: int = MAX_SCAN_BYTES, scanner: Optional[InstagramLinkScanner] = None
+) -> Optional[str]:
+    """
+    aiohttp のレスポンスを本文の途中まで読みながら探す。
+    scanner を渡すと、読んだ後のページの特徴 (anchors / scripts / spa_marker) を参照できる。
+    """
+    scanner = scanner or InstagramLinkScanner(max_bytes)
+    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+        link = scanner.feed(chunk)
+        if link:
+            return link
+        if scanner.exhausted:
+            break
+    return await scanner.finish_async()
+
+
+async def scan_text_async(text: str, max_bytes: int = MAX_SCAN_BYTES) -> Optional[str]:
+    """
+    Playwright の page.content() のように文字列で受け取った HTML 用。
+    """
+    scanner = InstagramLinkScanner(max_bytes)
+    data = text.encode("utf-8")
+    for start in range(0, len(data), CHUNK_SIZE):
+        link = scanner.feed(data[start:start + CHUNK_SIZE])
+        if link:
+            return link
+        if scanner.exhausted:
+            break
+    return await scanner.finish_async()
@@ -0,0 +1,139 @@
+"""
+ingest.py – 検索結果 (Place Details の dict) を Dojo テーブルへまとめて書き込む。
+
+1 件ずつの update_or_create (SELECT + UPDATE/INSERT) をやめ、
+既存行の取得 1 回 + bulk_create + bulk_update で済ませる。
+内容のハッシュが変わっていない行は hours_refreshed_at (取得時刻) だけを更新する。
+has_open_mat もここで計算して書き込む (シリアライザは列を読むだけ)。
+"""
+import hashlib
+import json
+import logging
+from typing import Dict, Iterable, List, Mapping
+
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from django.utils.timezone import now
+
+from .models import Dojo, PlaceReviews
+from .services import get_open_mat_info
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+INGEST_FIELDS = [
+    "name",
+    "address",
+    "latitude",
+    "longitude",
+    "website",
+    "hours",
+    "rating",
+    "user_ratings_total",
+]
+
+
+def _row_values(d: Dict) -> Dict:
+    return {
+        "name": d.get("name") or "Unknown",
+        "address": d.get("address") or "",
+        "latitude": d.get("latitude"),
+        "longitude": d.get("longitude"),
+        "website": d.get("website") or "",
+        "hours": d.get("hours") or [],
+        "rating": d.get("rating"),
+        "user_ratings_total": d.get("user_ratings_total"),
+    }
+
+
+def content_hash(values: Dict) -> str:
+    payload = json.dumps(values, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def upsert_dojos(dojos: Iterable[Dict], batch_size: int = BATCH_SIZE) -> Dict[str, int]:
+    """
+    place_id をキーにまとめて upsert し、{"inserted", "updated", "unchanged"} の件数を返す。
+    同時に別のワーカーが先に挿入して書き込まなかった行は unchanged に数える。
+    """
+    rows = {d["place_id"]: _row_values(d) for d in dojos if d.get("place_id")}
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    if not rows:
+        return counts
+
+    existing = {
+        obj.place_id: obj
+        for obj in Dojo.objects.filter(place_id__in=list(rows)).only("id", "place_id", "content_hash")
+    }
+    refreshed_at = now()
+    to_create, to_update, unchanged = [], [], []
+    for place_id, values in rows.items():
+        digest = content_hash(values)
+        geohash = Dojo.compute_geohash(values["latitude"], values["longitude"])
+        has_open_mat = get_open_mat_info(values["name"], values["website"])
+        obj = existing.get(place_id)
+        if obj is None:
+            to_create.append(Dojo(
+                place_id=place_id, geohash=geohash, content_hash=digest, hours_refreshed_at=refreshed_at,
+                has_open_mat=has_open_mat, open_mat_checked_at=refreshed_at, **values
+            ))
+        elif obj.content_hash == digest:
+            unchanged.append(obj.pk)
+        else:
+            for field, value in values.items():
+                setattr(obj, field, value)
+            obj.geohash = geohash
+            obj.content_hash = digest
+            obj.has_open_mat = has_open_mat
+            obj.open_mat_checked_at = refreshed_at
+            obj.hours_refreshed_at = refreshed_at
+            to_update.append(obj)
+
+    with transaction.atomic():
+        if to_create:
+            # 同時検索で先に挿入された行は無視する (次回の検索で更新される)
+            Dojo.objects.bulk_create(to_create, batch_size=batch_size, ignore_conflicts=True)
+            # ignore_conflicts で捨てられた行は数えない (この呼び出しで挿入した行は refreshed_at が一致する)
+            created = [obj.place_id for obj in to_create]
+            counts["inserted"] = sum(
+                Dojo.objects.filter(
+                    place_id__in=created[start:start + batch_size], hours_refreshed_at=refreshed_at
+                ).count()
+                for start in range(0, len(created), batch_size)
+            )
+        if to_update:
+            Dojo.objects.bulk_update(
+                to_update,
+                INGEST_FIELDS + ["geohash", "content_hash", "has_open_mat", "open_mat_checked_at", "hours_refreshed_at"],
+                batch_size=batch_size,
+            )
+        # 取り直して変わらなかった行も「取得済み」にする (定期更新が同じ行を選び続けないように)
+        for start in range(0, len(unchanged), batch_size):
+            Dojo.objects.filter(pk__in=unchanged[start:start + batch_size]).update(hours_refreshed_at=refreshed_at)
+    counts["unchanged"] = len(unchanged) + len(to_create) - counts["inserted"]
+    counts["updated"] = len(to_update)
+    logger.debug(f"[upsert_dojos] {counts}")
+    return counts
+
+
+def save_reviews(dojo: Dojo, reviews: List[Dict]) -> None:
+    """
+    Google レビューを Dojo 行とは別の PlaceReviews に保存する。空でも行を作る (取得済みの印)。
+    """
+    PlaceReviews.objects.update_or_create(dojo=dojo, defaults={"reviews": reviews or []})
+
+
+def add_search_hits(hits: Mapping[str, int]) -> None:
+    """
+    place_id ごとの検索ヒット数を加算する。同じ加算値の行は 1 回の UPDATE にまとめる。
+    """
+    by_count: Dict[int, List[str]] = defaultdict(list)
+    for place_id, n in hits.items():
+        by_count[n].append(place_id)
+    for n, place_ids in by_count.items():
+        for start in range(0, len(place_ids), BATCH_SIZE):
+            Dojo.objects.filter(place_id__in=place_ids[start:start + BATCH_SIZE]).update(
+                search_hits=F("search_hits") + n
+            )
@@ -0,0 +1,87 @@
+# dojo/management/commands/bench_instagram_scan.py
+
+import random
+import time
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+from django.core.management.base import BaseCommand
+
+from dojo.htmlscan import CHUNK_SIZE, scan_chunks
+
+
+def _bs4_first_link(data: bytes):
+    soup = BeautifulSoup(data, 'html.parser')
+    for a in soup.find_all('a', href=True):
+        if 'instagram.com' in a['href']:
+            return a['href']
+    return None
+
+
+def _synthetic_page(rng: random.Random) -> bytes:
+    """
+    保存済みページが無いとき用。ナビ + 本文 + フッターの典型的な道場サイト (約 150〜400KB)。
+    Instagram リンクはヘッダー / フッター / 無し のいずれか。
+    """
+    block = (
+        '<div class="section"><h2>Brazilian Jiu-Jitsu Classes</h2>'
+        '<p>Fundamentals, advanced, no-gi and kids programs. <a href="/schedule">Schedule</a> '
+        '<a href="/contact">Contact</a></p><img src="/img/mat.jpg" alt="mat"></div>\n'
+    )
+    insta = '<a class="social" href="https://www.instagram.com/example_bjj/">Instagram</a>'
+    where = rng.choice(["header", "footer", "none"])
+    parts = ['<!doctype html><html><head><title>Dojo</title>', '<script>' + 'var x=1;' * 2000 + '</script></head><body>']
+    parts.append('<nav>' + (insta if where == "header" else '') + '<a href="/">Home</a></nav>')
+    parts.append(block * rng.randint(600, 1600))
+    parts.append('<footer>' + (insta if where == "footer" else '') + '</footer></body></html>')
+    return ''.join(parts).encode('utf-8')
+
+
+class Command(BaseCommand):
+    help = 'Benchmark Instagram link extraction: full BeautifulSoup parse vs. streaming scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', help='Directory of saved dojo homepages (*.html)')
+        parser.add_argument('--synthetic', type=int, default=50, help='Generated pages when --corpus is not given')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        if options['corpus']:
+            pages = [p.read_bytes() for p in sorted(Path(options['corpus']).glob('*.htm*'))]
+        else:
+            rng = random.Random(0)
+            pages = [_synthetic_page(rng) for _ in range(options['synthetic'])]
+        if not pages:
+            self.stdout.write(self.style.ERROR('No pages found.'))
+            return
+
+        total_mb = sum(len(p) for p in pages) / (1024 * 1024)
+        self.stdout.write(f'{len(pages)} pages, {total_mb:.1f} MB, repeat={options["repeat"]}')
+
+        mismatches = sum(
+            1 for p in pages
+            if _bs4_first_link(p) != scan_chunks(p[i:i + CHUNK_SIZE] for i in range(0, len(p), CHUNK_SIZE))
+        )
+
+        def bench(fn):
+            started = time.perf_counter()
+            for _ in range(options['repeat']):
+                for p in pages:
+                    fn(p)
+            return (time.perf_counter() - started) / (options['repeat'] * len(pages)) * 1000
+
+        read = {'bytes': 0}
+
+        def stream(p):
+            def chunks():
+                for i in range(0, len(p), CHUNK_SIZE):
+                    read['bytes'] += min(CHUNK_SIZE, len(p) - i)
+                    yield p[i:i + CHUNK_SIZE]
+            return scan_chunks(chunks())
+
+        bs4_ms = bench(_bs4_first_link)
+        stream_ms = bench(stream)
+        read_ratio = read['bytes'] / (options['repeat'] * sum(len(p) for p in pages))
+        self.stdout.write(f'BeautifulSoup : {bs4_ms:8.2f} ms/page')
+        self.stdout.write(f'streaming scan: {stream_ms:8.2f} ms/page ({read_ratio:.0%} of bytes read)')
+        self.stdout.write(self.style.SUCCESS(f'speedup x{bs4_ms / stream_ms:.1f}, mismatches: {mismatches}'))
@@ -1,12 +1,42 @@
 # dojo/management/commands/update_dojo_hours.py
 
+import asyncio
+import json
+import os
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+
+from dojo.concurrency import AdaptiveLimiter
 from dojo.models import Dojo
-from dojo.utils import fetch_place_details
-from django.conf import settings
+from dojo.outbound import run_async
+from dojo.utils import fetch_place_details_async
+
+NO_HOURS = ["No hours available"]
+BATCH_SIZE = 200
+DEFAULT_CONCURRENCY = 8
+
 
 class Command(BaseCommand):
-    help = 'Update hours for all Dojo objects'
+    help = 'Update hours for Dojo objects (concurrent, rate-limited, resumable)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stale-after', type=float, default=None, metavar='DAYS',
+            help='Only dojos whose hours were refreshed more than DAYS ago (or never)',
+        )
+        parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument(
+            '--checkpoint', default=str(Path(settings.BASE_DIR) / 'var' / 'update_dojo_hours.json'),
+            help='Progress file; an interrupted run resumes from it',
+        )
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint of an unfinished run')
 
     def handle(self, *args, **options):
         api_key = settings.GOOGLE_API_KEY
@@ -14,14 +44,93 @@ class Command(BaseCommand):
             self.stdout.write(self.style.ERROR('Google API key is missing in settings.'))
             return
 
-        dojos = Dojo.objects.all()
-        for dojo in dojos:
-            detail_data = fetch_place_details("https://maps.googleapis.com/maps/api/place/details/json", dojo.place_id, api_key)
-            if detail_data and 'hours' in detail_data:
-                dojo.hours = detail_data['hours']
-                dojo.save()
-                self.stdout.write(self.style.SUCCESS(f'Updated hours for {dojo.name}'))
-            else:
-                dojo.hours = ["No hours available"]
-                dojo.save()
-                self.stdout.write(self.style.WARNING(f'No hours found for {dojo.name}, set to default'))
+        checkpoint = Path(options['checkpoint'])
+        stale_after = options['stale_after']
+        state = None if options['restart'] else self._load_checkpoint(checkpoint)
+        if state and state.get('stale_after') == stale_after:
+            started_at = parse_datetime(state['started_at'])
+            last_id = state['last_id']
+            failed_ids = set(state.get('failed_ids', []))
+            self.stdout.write(
+                f'Resuming run started at {started_at} after dojo id {last_id} '
+                f'(retrying {len(failed_ids)} failed)'
+            )
+        else:
+            started_at, last_id, failed_ids = now(), 0, set()
+
+        # 同じ run の中では started_at を基準にするので、再開しても対象は変わらない。
+        # last_id 以前で Details の取得に失敗した行 (failed_ids) も取り直す
+        qs = Dojo.objects.filter(Q(id__gt=last_id) | Q(id__in=failed_ids))
+        if stale_after is not None:
+            cutoff = started_at - timedelta(days=stale_after)
+            qs = qs.filter(Q(hours_refreshed_at__isnull=True) | Q(hours_refreshed_at__lt=cutoff))
+        ids = list(qs.order_by('id').values_list('id', flat=True))
+        self.stdout.write(f'{len(ids)} dojos to refresh')
+
+        limiter = AdaptiveLimiter(initial=options['concurrency'], maximum=options['concurrency'])
+        totals = {'updated': 0, 'no_hours': 0, 'failed': 0}
+        batch_size = options['batch_size']
+        for start in range(0, len(ids), batch_size):
+            dojos = list(
+                Dojo.objects.filter(id__in=ids[start:start + batch_size]).only('id', 'name', 'place_id', 'hours')
+            )
+            results = run_async(self._fetch_batch(dojos, api_key, limiter))
+
+            refreshed_at = now()
+            changed = []
+            for dojo, detail in results:
+                if detail is None:  # API エラーは既存の値を残し、再開時と次回の対象にする
+                    totals['failed'] += 1
+                    failed_ids.add(dojo.id)
+                    continue
+                failed_ids.discard(dojo.id)
+                hours = detail.get('hours') or NO_HOURS
+                totals['updated' if detail.get('hours') else 'no_hours'] += 1
+                dojo.hours = hours
+                dojo.hours_refreshed_at = refreshed_at
+                changed.append(dojo)
+            Dojo.objects.bulk_update(changed, ['hours', 'hours_refreshed_at'])
+
+            last_id = max([last_id] + [d.id for d in dojos])
+            self._save_checkpoint(checkpoint, {
+                'started_at': started_at.isoformat(),
+                'stale_after': stale_after,
+                'last_id': last_id,
+                'failed_ids': sorted(failed_ids),
+            })
+            done = min(start + batch_size, len(ids))
+            self.stdout.write(f'{done}/{len(ids)} {totals} limit={limiter.limit}')
+
+        if checkpoint.exists():
+            checkpoint.unlink()
+        self.stdout.write(self.style.SUCCESS(f'Done: {totals}'))
+
+    async def _fetch_batch(self, dojos, api_key, limiter):
+        # 同時実行数は limiter、QPS は fetch_place_details_async 内のトークンバケットで制限される
+        # (更新が目的なので Place Details のキャッシュは使わない)
+        async def one(dojo):
+            try:
+                return dojo, await limiter.run(
+                    lambda: fetch_place_details_async(dojo.place_id, api_key, use_cache=False)
+                )
+            except Exception as e:
+                self.stderr.write(f'{dojo.name}: {e}')
+                return dojo, None
+
+        return await asyncio.gather(*(one(d) for d in dojos))
+
+    @staticmethod
+    def _load_checkpoint(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _save_checkpoint(path, state):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
@@ -0,0 +1,42 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:29
+
+from django.db import migrations, models
+import django.utils.timezone
+
+from dojo import geohash
+
+
+def backfill_geohash(apps, schema_editor):
+    Dojo = apps.get_model('dojo', 'Dojo')
+    rows = Dojo.objects.exclude(latitude=None).exclude(longitude=None).only('id', 'latitude', 'longitude')
+    for dojo in rows.iterator():
+        dojo.geohash = geohash.encode(dojo.latitude, dojo.longitude)
+        dojo.save(update_fields=['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dojo', '0010_stripecustomer_subscription'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchArea',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query', models.CharField(max_length=255, unique=True)),
+                ('center_latitude', models.FloatField()),
+                ('center_longitude', models.FloatField()),
+                ('radius_m', models.FloatField()),
+                ('place_count', models.IntegerField(default=0)),
+                ('crawled_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='dojo',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=12),
+        ),
+        migrations.RunPython(backfill_geohash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:30
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dojo', '0011_dojo_geohash_searcharea'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CrawledTile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('geohash', models.CharField(max_length=12, unique=True)),
+                ('places', models.JSONField(blank=True, default=dict)),
+                ('crawled_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
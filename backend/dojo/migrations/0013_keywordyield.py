@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dojo', '0012_crawledtile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KeywordYield',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('region', models.CharField(max_length=255)),
+                ('keyword', models.CharField(max_length=255)),
+                ('runs', models.IntegerField(default=0)),
+                ('avg_new_ids', models.FloatField(default=0)),
+                ('skips', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('region', 'keyword')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dojo', '0013_keywordyield'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dojo',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+    ]
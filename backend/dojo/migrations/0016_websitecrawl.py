@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:47
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dojo', '0015_enrichmentjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebsiteCrawl',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=500, unique=True)),
+                ('etag', models.CharField(blank=True, default='', max_length=255)),
+                ('last_modified', models.CharField(blank=True, default='', max_length=64)),
+                ('content_hash', models.CharField(blank=True, default='', max_length=40)),
+                ('instagram', models.URLField(blank=True, default='', max_length=500)),
+                ('fetched_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('checked_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dojo', '0016_websitecrawl'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dojo',
+            name='has_open_mat',
+            field=models.BooleanField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='dojo',
+            name='open_mat_checked_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
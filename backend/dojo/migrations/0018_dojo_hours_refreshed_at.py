@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dojo', '0017_dojo_has_open_mat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dojo',
+            name='hours_refreshed_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dojo', '0018_dojo_hours_refreshed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dojo',
+            name='search_hits',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_reviews(apps, schema_editor):
+    Dojo = apps.get_model('dojo', 'Dojo')
+    PlaceReviews = apps.get_model('dojo', 'PlaceReviews')
+    rows = [
+        PlaceReviews(dojo_id=pk, reviews=reviews)
+        for pk, reviews in Dojo.objects.exclude(reviews=None).values_list('id', 'reviews').iterator()
+        if reviews
+    ]
+    PlaceReviews.objects.bulk_create(rows, batch_size=500)
+
+
+def restore_reviews(apps, schema_editor):
+    Dojo = apps.get_model('dojo', 'Dojo')
+    PlaceReviews = apps.get_model('dojo', 'PlaceReviews')
+    for row in PlaceReviews.objects.iterator():
+        Dojo.objects.filter(pk=row.dojo_id).update(reviews=row.reviews)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dojo', '0020_dojo_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaceReviews',
+            fields=[
+                ('dojo', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='place_reviews', serialize=False, to='dojo.dojo')),
+                ('reviews', models.JSONField(blank=True, default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(copy_reviews, restore_reviews),
+        migrations.RemoveField(
+            model_name='dojo',
+            name='reviews',
+        ),
+    ]
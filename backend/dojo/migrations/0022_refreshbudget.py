@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 01:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dojo', '0021_placereviews'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefreshBudget',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(unique=True)),
+                ('spent', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
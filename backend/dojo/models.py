@@ -4,7 +4,8 @@ from django.db import models
 from django.utils.timezone import now, localtime
 from django.contrib.auth import get_user_model
 from django.conf import settings
-from django.db.models import JSONField
+
+from . import geohash as gh
 
 User = get_user_model()
 
@@ -39,12 +40,142 @@ class Dojo(models.Model):
     is_visitor_friendly= models.BooleanField(default=False)
     open_mats          = models.ManyToManyField(OpenMat, blank=True)
     rating             = models.FloatField(null=True, blank=True)
-    reviews            = JSONField(default=list, blank=True)
     user_ratings_total = models.IntegerField(blank=True, null=True)
+    geohash            = models.CharField(max_length=12, blank=True, default="", db_index=True)
+    content_hash       = models.CharField(max_length=40, blank=True, default="")  # ingest.upsert_dojos の変更検知用
+    has_open_mat       = models.BooleanField(null=True, blank=True)  # ingest.upsert_dojos / tasks.update_open_mat_info_task が計算
+    open_mat_checked_at= models.DateTimeField(null=True, blank=True, db_index=True)  # None = 未計算 / 内容が変わった
+    hours_refreshed_at = models.DateTimeField(null=True, blank=True, db_index=True)  # 最後に Place Details (営業時間・評価) を取得した時刻
+    search_hits        = models.IntegerField(default=0)  # 検索結果に出た回数 (scheduler の人気度)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # 緯度経度から空間インデックス用の geohash を常に同期させる
+        self.geohash = self.compute_geohash(self.latitude, self.longitude)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"latitude", "longitude"} & set(update_fields):
+            kwargs["update_fields"] = set(update_fields) | {"geohash"}
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def compute_geohash(latitude, longitude) -> str:
+        if latitude is None or longitude is None:
+            return ""
+        return gh.encode(latitude, longitude)
+
+
+class SearchArea(models.Model):
+    """
+    Google から取得済みの検索範囲（円）。crawled_at が新しければローカル検索で応答できる。
+    """
+    query            = models.CharField(max_length=255, unique=True)  # 正規化済みクエリ
+    center_latitude  = models.FloatField()
+    center_longitude = models.FloatField()
+    radius_m         = models.FloatField()
+    place_count      = models.IntegerField(default=0)
+    crawled_at       = models.DateTimeField(default=now, db_index=True)
+
+    def __str__(self):
+        return f"{self.query} ({self.radius_m:.0f}m @ {self.crawled_at})"
+
+
+class CrawledTile(models.Model):
+    """
+    NearbySearch をタイル (geohash セル) 単位で取得した記録。
+    places は {place_id: [lat, lng]}。どの地域を取得済みかの台帳も兼ねる。
+    """
+    geohash    = models.CharField(max_length=12, unique=True)
+    places     = models.JSONField(default=dict, blank=True)
+    crawled_at = models.DateTimeField(default=now, db_index=True)
+
+    def __str__(self):
+        return f"{self.geohash} ({len(self.places)} places @ {self.crawled_at})"
+
+
+class KeywordYield(models.Model):
+    """
+    地域 × 検索キーワードごとの「他のキーワードで見つからなかった place_id 数」の統計。
+    dojo.planner が低収穫のキーワードを省くのに使う。
+    """
+    region      = models.CharField(max_length=255)  # "q:<正規化クエリ>" / "gh:<geohash 3 桁>"
+    keyword     = models.CharField(max_length=255)
+    runs        = models.IntegerField(default=0)
+    avg_new_ids = models.FloatField(default=0)      # 新規 place_id 数の指数移動平均
+    skips       = models.IntegerField(default=0)    # 前回の実行以降に省いた回数
+    updated_at  = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("region", "keyword")
+
+    def __str__(self):
+        return f"{self.region} / {self.keyword}: {self.avg_new_ids:.1f} new ({self.runs} runs)"
+
+
+class EnrichmentJob(models.Model):
+    """
+    お気に入り追加時の道場情報の補完 (Place Details / Instagram)。place_id ごとに 1 件。
+    """
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE    = "done"
+    FAILED  = "failed"
+    STATUS_CHOICES = [(PENDING, "Pending"), (RUNNING, "Running"), (DONE, "Done"), (FAILED, "Failed")]
+
+    dojo         = models.OneToOneField(Dojo, on_delete=models.CASCADE, related_name="enrichment")
+    status       = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    attempts     = models.IntegerField(default=0)
+    last_error   = models.TextField(blank=True, default="")
+    created_at   = models.DateTimeField(auto_now_add=True)
+    updated_at   = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.dojo.place_id}: {self.status} ({self.attempts} attempts)"
+
+
+class WebsiteCrawl(models.Model):
+    """
+    道場サイトの前回取得時の検証子 (ETag / Last-Modified) と本文ハッシュ、抽出結果。
+    再取得時は条件付き GET し、304 か本文が同じなら instagram をそのまま使う。
+    """
+    url           = models.URLField(max_length=500, unique=True)
+    etag          = models.CharField(max_length=255, blank=True, default="")
+    last_modified = models.CharField(max_length=64, blank=True, default="")
+    content_hash  = models.CharField(max_length=40, blank=True, default="")
+    instagram     = models.URLField(max_length=500, blank=True, default="")  # "" = 見つからなかった
+    fetched_at    = models.DateTimeField(default=now)   # 本文を最後にダウンロードした時刻
+    checked_at    = models.DateTimeField(default=now)   # 最後に再検証した時刻
+
+    def __str__(self):
+        return f"{self.url} ({self.instagram or 'no instagram'})"
+
+
+class RefreshBudget(models.Model):
+    """
+    定期更新 (dojo.scheduler) が使った Place Details 呼び出し数。1 時間に 1 行。
+    キャッシュはプロセスごと (LocMemCache) なので、全ワーカー共通の上限は DB で数える。
+    """
+    hour  = models.DateTimeField(unique=True)  # 時刻を時単位に切り捨てたもの
+    spent = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.hour:%Y-%m-%d %H}:00 spent={self.spent}"
+
+
+class PlaceReviews(models.Model):
+    """
+    Google のレビュー (Place Details の reviews、最大 5 件)。本文が大きいので Dojo 行から分けて持ち、
+    詳細表示 (DojoViewSet.reviews) でだけ読む。
+    """
+    dojo       = models.OneToOneField(Dojo, on_delete=models.CASCADE, primary_key=True, related_name="place_reviews")
+    reviews    = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.dojo_id}: {len(self.reviews)} reviews"
+
 
 # ------------------------------------------------------------------
 # フィードバック & レビュー
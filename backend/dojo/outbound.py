@@ -0,0 +1,174 @@
+"""
+outbound.py – 外部 HTTP 通信の共通クライアント。
+
+async_to_sync はリクエストごとに新しいイベントループを作るため、そこで ClientSession を
+作っても毎回 TLS ハンドシェイクからやり直しになる。ワーカープロセスごとに 1 本の
+バックグラウンドイベントループを持ち、そのループ上の ClientSession (keep-alive, DNS キャッシュ,
+ホストごとの接続上限付き) を使い回す。同期コードからは run_async() で投げる。
+
+このループには外側の async_to_sync が無いので、sync_to_async (thread_sensitive=True) の DB 呼び出しは
+プロセス共通の 1 スレッドに集まり、接続も close_old_connections されない。ループ上の ORM 呼び出しは
+run_db() で DB 用のスレッドプールに投げ、呼び出しの前後で古い接続を閉じる。
+"""
+import asyncio
+import functools
+import logging
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, Optional
+
+import requests
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT = ClientTimeout(total=15)
+CONNECTION_LIMIT = 100
+CONNECTION_LIMIT_PER_HOST = 20
+DNS_CACHE_SEC = 300
+KEEPALIVE_SEC = 30
+SHUTDOWN_TIMEOUT_SEC = 5
+DB_WORKERS = 4
+
+_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, ClientSession]" = weakref.WeakKeyDictionary()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_pid: Optional[int] = None
+_loop_lock = threading.Lock()
+_sync_session: Optional[requests.Session] = None
+_db_executor: Optional[ThreadPoolExecutor] = None
+_db_executor_pid: Optional[int] = None
+
+
+def get_session() -> ClientSession:
+    """
+    実行中のイベントループに紐づくプール済み ClientSession を返す。
+    """
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = TCPConnector(
+            limit=CONNECTION_LIMIT,
+            limit_per_host=CONNECTION_LIMIT_PER_HOST,
+            ttl_dns_cache=DNS_CACHE_SEC,
+            keepalive_timeout=KEEPALIVE_SEC,
+        )
+        session = ClientSession(connector=connector, timeout=TIMEOUT)
+        _sessions[loop] = session
+    return session
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    ワーカープロセス専用のバックグラウンドループ (fork 後は作り直す)。
+    """
+    global _loop, _loop_pid
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid() or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            thread = threading.Thread(target=_loop.run_forever, name="dojo-outbound-loop", daemon=True)
+            thread.start()
+            logger.debug(f"[outbound] started event loop thread (pid={_loop_pid})")
+        return _loop
+
+
+def loop_running() -> bool:
+    return _loop is not None and _loop_pid == os.getpid() and _loop.is_running()
+
+
+def run_async(coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+    """
+    同期コードからバックグラウンドループでコルーチンを実行し、結果を待つ。
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result(timeout)
+
+
+def iterate_async(agen: AsyncIterator[Any], timeout: Optional[float] = None) -> Iterator[Any]:
+    """
+    非同期ジェネレータをバックグラウンドループで回し、同期イテレータとして返す
+    (StreamingHttpResponse 用)。途中で止まっても aclose() で後始末する。
+    """
+    loop = get_loop()
+    try:
+        while True:
+            try:
+                item = asyncio.run_coroutine_threadsafe(agen.__anext__(), loop).result(timeout)
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        asyncio.run_coroutine_threadsafe(agen.aclose(), loop).result(SHUTDOWN_TIMEOUT_SEC)
+
+
+def _get_db_executor() -> ThreadPoolExecutor:
+    global _db_executor, _db_executor_pid
+    with _loop_lock:
+        if _db_executor is None or _db_executor_pid != os.getpid():
+            _db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="dojo-outbound-db")
+            _db_executor_pid = os.getpid()
+        return _db_executor
+
+
+def _call_with_fresh_connection(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_db(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    同期の DB 処理をコルーチンから呼ぶ。バックグラウンドループ上なら DB 用スレッドプールで、
+    それ以外 (async_to_sync の内側) なら従来どおり呼び出し元のスレッドで実行する。
+    """
+    loop = asyncio.get_running_loop()
+    if loop is not _loop:
+        return await sync_to_async(func)(*args, **kwargs)
+    call = functools.partial(_call_with_fresh_connection, func, *args, **kwargs)
+    return await loop.run_in_executor(_get_db_executor(), call)
+
+
+def get_sync_session() -> requests.Session:
+    """
+    requests 用のプロセス共通セッション (コネクションプール付き)。
+    """
+    global _sync_session
+    if _sync_session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=CONNECTION_LIMIT_PER_HOST, pool_maxsize=CONNECTION_LIMIT_PER_HOST)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _sync_session = session
+    return _sync_session
+
+
+async def _close_session() -> None:
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+
+def shutdown() -> None:
+    """
+    プロセス終了時にセッションを閉じ、バックグラウンドループを止める。
+    """
+    global _loop, _sync_session
+    loop = _loop
+    if loop_running():
+        try:
+            asyncio.run_coroutine_threadsafe(_close_session(), loop).result(SHUTDOWN_TIMEOUT_SEC)
+        except Exception as e:
+            logger.warning(f"[outbound] failed to close session: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+    _loop = None
+    if _db_executor is not None and _db_executor_pid == os.getpid():
+        _db_executor.shutdown(wait=False)
+    if _sync_session is not None:
+        _sync_session.close()
+        _sync_session = None
@@ -0,0 +1,109 @@
+"""
+pagination.py – DojoViewSet の一覧用のキーセット (カーソル) ページネーション。
+
+- 通常は id 順 (DRF の CursorPagination)。OFFSET を使わないので深いページでも速い。
+- ?lat=&lng= があれば距離順。半径 (?radius=, 既定 RADIUS_M) 内を geohash インデックスで絞り、
+  (距離, id) をカーソルにして続きを返す。
+- ?search= では関連度 (search_rank, id) 順 (dojo.search)。
+"""
+import base64
+import json
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from . import geohash as gh
+from .spatial import geohash_prefix_q
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+RADIUS_M = 50_000
+MAX_RADIUS_M = 200_000
+
+
+class DojoCursorPagination(CursorPagination):
+    ordering = "id"
+    page_size = PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = MAX_PAGE_SIZE
+
+    def get_ordering(self, request, queryset, view):
+        # ?search= では DojoSearchFilter が付けた関連度順
+        if "search_rank" in queryset.query.annotations:
+            return ("search_rank", "id")
+        return super().get_ordering(request, queryset, view)
+
+
+class DistanceCursorPagination(BasePagination):
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        lat, lng, radius = self._point(request)
+        page_size = self._page_size(request)
+        after = self._decode_cursor(request.query_params.get(self.cursor_query_param))
+
+        # 順位付けは (id, 緯度, 経度) だけで行い、モデルの読み込みと prefetch はそのページの行だけ
+        cells = gh.covering_cells(lat, lng, radius)
+        candidates = queryset.filter(geohash_prefix_q(cells)).values_list("pk", "latitude", "longitude")
+        keys = []
+        for pk, plat, plng in candidates.iterator():
+            dist = gh.distance_m(lat, lng, plat, plng)
+            if dist <= radius:
+                keys.append((round(dist, 3), pk))
+        keys.sort()
+        if after is not None:
+            keys = [k for k in keys if k > after]
+
+        page = keys[:page_size]
+        self.next_key = page[-1] if len(keys) > page_size else None
+        objs = queryset.in_bulk([pk for _, pk in page])
+        return [objs[pk] for _, pk in page if pk in objs]
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("next", self._next_link()),
+            ("previous", None),
+            ("results", data),
+        ]))
+
+    def _next_link(self) -> Optional[str]:
+        if self.next_key is None:
+            return None
+        raw = json.dumps(list(self.next_key)).encode("ascii")
+        cursor = base64.urlsafe_b64encode(raw).decode("ascii")
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def _decode_cursor(self, value: Optional[str]) -> Optional[Tuple[float, int]]:
+        if not value:
+            return None
+        try:
+            dist, pk = json.loads(base64.urlsafe_b64decode(value.encode("ascii")))
+            return float(dist), int(pk)
+        except (TypeError, ValueError):
+            raise NotFound("Invalid cursor")
+
+    def _point(self, request) -> Tuple[float, float, float]:
+        try:
+            lat = float(request.query_params["lat"])
+            lng = float(request.query_params["lng"])
+            radius = float(request.query_params.get("radius", RADIUS_M))
+        except (KeyError, ValueError):
+            raise ValidationError({"error": "lat, lng and radius must be numbers."})
+        return lat, lng, min(max(radius, 1), MAX_RADIUS_M)
+
+    def _page_size(self, request) -> int:
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, PAGE_SIZE))
+        except ValueError:
+            size = PAGE_SIZE
+        return min(max(size, 1), MAX_PAGE_SIZE)
+
+
+def wants_distance_order(request) -> bool:
+    return "lat" in request.query_params and "lng" in request.query_params
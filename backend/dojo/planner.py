@@ -0,0 +1,80 @@
+"""
+planner.py – TextSearch / NearbySearch のキーワード選択。
+
+地域ごとに各キーワードが「他のキーワードで見つからなかった place_id」を何件もたらしたかを
+KeywordYield に記録し、収穫の少ないキーワードは省く。省いたキーワードも
+EXPLORE_EVERY 回に 1 回は実行して統計を更新する。
+"""
+import logging
+from typing import Dict, Iterable, List, Set
+
+from django.db.models import F
+
+from .models import KeywordYield
+
+logger = logging.getLogger(__name__)
+
+MIN_RUNS = 3          # 統計が揃うまでは必ず実行する
+MIN_NEW_IDS = 0.5     # 新規 place_id の平均がこれ未満なら省く
+EXPLORE_EVERY = 10    # 省いたキーワードも 10 回に 1 回は再評価
+YIELD_ALPHA = 0.3     # 指数移動平均の重み
+
+
+def query_region(normalized_query: str) -> str:
+    return f"q:{normalized_query}"
+
+
+def tile_region(tile: str) -> str:
+    return f"gh:{tile[:3]}"
+
+
+def plan_keywords(region: str, keywords: Iterable[str]) -> List[str]:
+    """
+    実行するキーワードを収穫の多い順に返す。統計の無いキーワードは先頭。
+    """
+    keywords = list(dict.fromkeys(keywords))
+    stats = {
+        s.keyword: s
+        for s in KeywordYield.objects.filter(region=region, keyword__in=keywords)
+    }
+
+    def is_known(kw):
+        return kw in stats and stats[kw].runs >= MIN_RUNS
+
+    ordered = sorted(keywords, key=lambda kw: (is_known(kw), -stats[kw].avg_new_ids if is_known(kw) else 0))
+    planned, skipped = [], []
+    for kw in ordered:
+        st = stats.get(kw)
+        if is_known(kw) and st.avg_new_ids < MIN_NEW_IDS and st.skips < EXPLORE_EVERY:
+            skipped.append(kw)
+        else:
+            planned.append(kw)
+    if not planned:
+        planned, skipped = ordered[:1], ordered[1:]
+
+    if skipped:
+        KeywordYield.objects.filter(region=region, keyword__in=skipped).update(skips=F("skips") + 1)
+        logger.debug(f"[planner] {region}: skip {skipped}")
+    return planned
+
+
+def record_yields(region: str, planned: List[str], found: Dict[str, Set[str]]) -> None:
+    """
+    planned の順に各キーワードの新規 place_id 数を数えて統計を更新する。
+    エラーで結果が無いキーワード (found に無いもの) は記録しない。
+    """
+    seen: Set[str] = set()
+    for kw in planned:
+        ids = found.get(kw)
+        if ids is None:
+            continue
+        new_ids = len(ids - seen)
+        seen |= ids
+        st, _ = KeywordYield.objects.get_or_create(region=region, keyword=kw)
+        if st.runs == 0:
+            st.avg_new_ids = new_ids
+        else:
+            st.avg_new_ids = (1 - YIELD_ALPHA) * st.avg_new_ids + YIELD_ALPHA * new_ids
+        st.runs += 1
+        st.skips = 0
+        st.save(update_fields=["avg_new_ids", "runs", "skips", "updated_at"])
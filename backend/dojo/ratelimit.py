@@ -0,0 +1,105 @@
+"""
+ratelimit.py – Google Places 呼び出し用のトークンバケット。
+
+エンドポイント (textsearch / nearbysearch / details) ごとにバケットを分ける。
+通常はプロセス内で共有し、PLACES_RATE_LIMIT_SHARED=True のときは
+Django キャッシュの atomic な incr を使った 1 秒単位のカウンタで全ワーカー共通に制限する。
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Dict, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    rate 個/秒で補充され、最大 capacity 個まで貯まるバケット。
+    トークンが足りないときは先に予約してから不足分だけ待つので、待ち順は到着順になる。
+    """
+
+    def __init__(self, name: str, rate: float, capacity: int, shared: bool = False):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self.shared = shared
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()  # async_to_sync で複数スレッドから使われる
+
+    def _reserve(self) -> float:
+        """トークンを 1 つ予約し、使えるまでの待ち時間 (秒) を返す。"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    async def acquire(self) -> None:
+        if self.shared:
+            await self._acquire_shared()
+            return
+        wait = self._reserve()
+        if wait > 0:
+            logger.debug(f"[ratelimit] {self.name}: wait {wait:.2f}s")
+            await asyncio.sleep(wait)
+
+    async def _acquire_shared(self) -> None:
+        per_second = max(1, int(self.rate))
+        while True:
+            now = time.time()
+            slot = int(now)
+            key = f"ratelimit_{self.name}_{slot}"
+            cache.add(key, 0, 2)
+            try:
+                count = cache.incr(key)
+            except ValueError:  # add と incr の間に期限切れ
+                continue
+            if count <= per_second:
+                return
+            await asyncio.sleep(slot + 1 - now)
+
+
+BURST_SEC = 2  # バースト = 2 秒分
+
+
+def places_rate_limits() -> Dict[str, Tuple[float, int]]:
+    """
+    エンドポイントごとの (1 秒あたりのリクエスト数, バースト)。値はプロジェクトの Places の割り当てに
+    合わせて settings.PLACES_*_QPS で決める。同期の検索リクエストは gunicorn のタイムアウト (30 秒) 内に
+    終わる必要があるので、待ちの最悪値 (件数 - バースト) / QPS が数秒に収まるようにしておくこと。
+    """
+    limits = {
+        "textsearch": settings.PLACES_TEXTSEARCH_QPS,
+        "nearbysearch": settings.PLACES_NEARBYSEARCH_QPS,
+        "details": settings.PLACES_DETAILS_QPS,
+    }
+    return {name: (qps, max(1, int(qps * BURST_SEC))) for name, qps in limits.items()}
+
+_buckets: Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(endpoint: str) -> TokenBucket:
+    with _buckets_lock:
+        bucket = _buckets.get(endpoint)
+        if bucket is None:
+            rate, capacity = places_rate_limits()[endpoint]
+            bucket = TokenBucket(endpoint, rate, capacity, shared=settings.PLACES_RATE_LIMIT_SHARED)
+            _buckets[endpoint] = bucket
+        return bucket
+
+
+async def rate_limit(endpoint: str) -> None:
+    """
+    Google Places の各呼び出しの直前に await する。
+    """
+    await get_bucket(endpoint).acquire()
@@ -0,0 +1,74 @@
+"""
+rendergate.py – Instagram リンク抽出で Playwright (JS 描画) に進むかどうかの判断。
+
+静的取得でリンクが見つからなかったサイトの多くは、そもそも Instagram が無いだけで、
+描画しても結果は変わらない。ページの特徴 (SPA の目印・極端に小さい本文・スクリプトだけの本文、
+ボット対策のステータス) から描画が必要そうなときだけ Playwright を使う。
+加えてドメインごとに「描画で見つかったことがあるか / 何回空振りしたか」を覚えておく。
+"""
+import logging
+from typing import Optional
+from urllib.parse import urlparse
+
+from django.core.cache import cache
+
+from .htmlscan import InstagramLinkScanner
+
+logger = logging.getLogger(__name__)
+
+DOMAIN_MEMO_SEC = 60 * 60 * 24 * 30
+GIVE_UP_AFTER = 2          # 描画しても見つからなかった回数がこれに達したドメインは描画しない
+TINY_BODY_BYTES = 2048
+FEW_ANCHORS = 3
+RENDER_STATUSES = {403, 429, 503}  # ボット対策で静的取得が弾かれた可能性
+
+
+def domain_of(url: str) -> str:
+    host = (urlparse(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def _memo_key(domain: str) -> str:
+    return f"render_memo_{domain}"
+
+
+def page_needs_rendering(scanner: Optional[InstagramLinkScanner], status: Optional[int]) -> Optional[str]:
+    """
+    描画が必要そうな理由を返す (不要なら None)。status=None は接続エラー等で、描画しても同じなので不要。
+    """
+    if status is None:
+        return None
+    if status in RENDER_STATUSES:
+        return f"status {status}"
+    if status != 200 or scanner is None or scanner.exhausted:
+        return None
+    if scanner.spa_marker:
+        return "spa marker"
+    if scanner.bytes_read < TINY_BODY_BYTES:
+        return "tiny body"
+    if scanner.anchors < FEW_ANCHORS and scanner.scripts > 0:
+        return "script-only body"
+    return None
+
+
+def should_render(url: str, scanner: Optional[InstagramLinkScanner], status: Optional[int]) -> bool:
+    domain = domain_of(url)
+    memo = cache.get(_memo_key(domain)) or {}
+    if memo.get("helped"):
+        return True
+    if memo.get("misses", 0) >= GIVE_UP_AFTER:
+        return False
+    reason = page_needs_rendering(scanner, status)
+    if reason:
+        logger.debug(f"[rendergate] {domain}: render ({reason})")
+    return reason is not None
+
+
+def record_render(url: str, helped: bool) -> None:
+    key = _memo_key(domain_of(url))
+    memo = cache.get(key) or {"helped": False, "misses": 0}
+    if helped:
+        memo["helped"] = True
+    else:
+        memo["misses"] = memo.get("misses", 0) + 1
+    cache.set(key, memo, DOMAIN_MEMO_SEC)
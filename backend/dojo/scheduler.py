@@ -0,0 +1,166 @@
+"""
+scheduler.py – 人気度に応じた道場データのバックグラウンド更新。
+
+各道場の優先度を、保存済みのシグナル (お気に入り数・検索ヒット数・レビュー数) から求めた人気度と、
+最後に Place Details を取得してからの経過時間の積で決める (並べ替えと LIMIT は SQL で行う)。
+1 時間あたり PLACES_REFRESH_BUDGET_PER_HOUR 回の Place Details 呼び出しを優先度の高い順に使う。
+refresh_popular_dojos_task は PLACES_REFRESH_INTERVAL_SEC ごとに実行され、1 回あたり
+予算 × 間隔 / 1 時間 だけ使うので更新が 1 時間の中に分散される。何回実行しても 1 時間の予算は超えない。
+使った回数は RefreshBudget (DB) で数えるので、Celery のワーカーが複数プロセスでも上限は全体で共通。
+"""
+import asyncio
+import logging
+import math
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Count, DateTimeField, ExpressionWrapper, F, FloatField, Func, Value
+from django.db.models.functions import Coalesce, Ln
+from django.utils.timezone import now
+
+from .concurrency import AdaptiveLimiter
+from .ingest import upsert_dojos
+from .models import Dojo, RefreshBudget
+from .outbound import run_async
+from .utils import fetch_place_details_async
+
+logger = logging.getLogger(__name__)
+
+MIN_REFRESH_AGE = timedelta(days=1)   # これより新しい行は更新しない
+NEVER_REFRESHED_AGE_DAYS = 30         # 一度も取得していない行の経過日数の扱い
+FAVORITE_WEIGHT = 3.0
+SEARCH_HIT_WEIGHT = 1.0
+RATINGS_WEIGHT = 0.5
+REFRESH_CONCURRENCY = 4
+
+
+class AgeDays(Func):
+    """
+    at から datetime 列までの経過日数 (float)。列が NULL なら NULL。
+    """
+    output_field = FloatField()
+    template = "(EXTRACT(EPOCH FROM (%(expressions)s)) / 86400.0)"
+    arg_joiner = " - "
+
+    def __init__(self, expression, at: datetime):
+        super().__init__(Value(at, output_field=DateTimeField()), expression)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection, template="(julianday(%(expressions)s))", arg_joiner=") - julianday(",
+            **extra_context
+        )
+
+
+def priority_expression(at: datetime):
+    """
+    人気度 (お気に入り数・検索ヒット数・レビュー数) × 最後に取得してからの経過日数。
+    """
+    popularity = (
+        Value(1.0)
+        + FAVORITE_WEIGHT * Count("favorited_by")
+        + SEARCH_HIT_WEIGHT * Ln(F("search_hits") + 1)
+        + RATINGS_WEIGHT * Ln(Coalesce("user_ratings_total", 0) + 1)
+    )
+    age_days = Coalesce(AgeDays("hours_refreshed_at", at), Value(float(NEVER_REFRESHED_AGE_DAYS)))
+    return ExpressionWrapper(popularity * age_days, output_field=FloatField())
+
+
+def pick_refresh_batch(limit: int, at: Optional[datetime] = None) -> List[Tuple[float, int, str]]:
+    """
+    優先度の高い順に (priority, id, place_id) を limit 件返す。
+    """
+    at = at or now()
+    if limit <= 0:
+        return []
+    rows = (
+        Dojo.objects.exclude(hours_refreshed_at__gte=at - MIN_REFRESH_AGE)
+        .annotate(priority=priority_expression(at))
+        .order_by("-priority", "id")
+        .values_list("priority", "id", "place_id")[:limit]
+    )
+    return list(rows)
+
+
+def _budget_hour(at: datetime) -> datetime:
+    return at.replace(minute=0, second=0, microsecond=0)
+
+
+def remaining_budget(at: Optional[datetime] = None) -> int:
+    at = at or now()
+    row = RefreshBudget.objects.filter(hour=_budget_hour(at)).values_list("spent", flat=True).first()
+    return max(0, settings.PLACES_REFRESH_BUDGET_PER_HOUR - (row or 0))
+
+
+def run_budget(at: Optional[datetime] = None) -> int:
+    """
+    1 回の実行で使う呼び出し数 (1 時間の予算を実行間隔で割った分、残り予算まで)。
+    """
+    per_run = math.ceil(settings.PLACES_REFRESH_BUDGET_PER_HOUR * settings.PLACES_REFRESH_INTERVAL_SEC / 3600)
+    return min(per_run, remaining_budget(at))
+
+
+def reserve_budget(n: int, at: datetime) -> int:
+    """
+    その時間の予算から最大 n 回分を確保し、確保できた数を返す。
+    spent の比較つき UPDATE で確保するので、同時に実行しても合計が予算を超えない。
+    """
+    hour = _budget_hour(at)
+    RefreshBudget.objects.get_or_create(hour=hour)
+    while n > 0:
+        spent = RefreshBudget.objects.filter(hour=hour).values_list("spent", flat=True).get()
+        take = min(n, settings.PLACES_REFRESH_BUDGET_PER_HOUR - spent)
+        if take <= 0:
+            return 0
+        if RefreshBudget.objects.filter(hour=hour, spent=spent).update(spent=F("spent") + take):
+            RefreshBudget.objects.filter(hour__lt=hour - timedelta(days=1)).delete()
+            return take
+    return 0
+
+
+def release_budget(n: int, at: datetime) -> None:
+    """
+    確保したが使わなかった分を戻す。
+    """
+    if n > 0:
+        RefreshBudget.objects.filter(hour=_budget_hour(at)).update(spent=F("spent") - n)
+
+
+async def _fetch_all(place_ids: List[str], api_key: str) -> List[Optional[Dict]]:
+    limiter = AdaptiveLimiter(initial=REFRESH_CONCURRENCY, maximum=REFRESH_CONCURRENCY)
+
+    async def one(place_id):
+        try:
+            return await limiter.run(lambda: fetch_place_details_async(place_id, api_key, use_cache=False))
+        except Exception as e:
+            logger.warning(f"[scheduler] details failed for {place_id}: {e}")
+            return None
+
+    return await asyncio.gather(*(one(pid) for pid in place_ids))
+
+
+def refresh_popular_dojos(budget: Optional[int] = None) -> Dict[str, int]:
+    """
+    残り予算の範囲で優先度の高い道場の Place Details を取り直す。
+    """
+    api_key = settings.GOOGLE_API_KEY
+    at = now()
+    empty = {"picked": 0, "refreshed": 0, "failed": 0}
+    if not api_key:
+        return empty
+    granted = reserve_budget(run_budget(at) if budget is None else budget, at)
+    batch = pick_refresh_batch(granted, at)
+    # 候補が足りなかった分だけ戻す (失敗した呼び出しも API の呼び出し回数には数える)
+    release_budget(granted - len(batch), at)
+    if not batch:
+        return empty
+
+    place_ids = [place_id for _, _, place_id in batch]
+    details = run_async(_fetch_all(place_ids, api_key))
+
+    fetched = [d for d in details if d]
+    upsert_dojos(fetched)  # 内容が変わらなかった行も hours_refreshed_at は更新される
+    result = {"picked": len(batch), "refreshed": len(fetched), "failed": len(batch) - len(fetched)}
+    logger.info(f"[scheduler] {result}, top priority={batch[0][0]:.1f}")
+    return result
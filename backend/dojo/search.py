@@ -0,0 +1,177 @@
+"""
+search.py – DojoViewSet の name / address 検索 (?search=)。
+
+SearchFilter の icontains は LIKE '%q%' の全件走査になるので、
+- SQLite: FTS5 (trigram トークナイザ) の外部コンテンツテーブル dojo_dojo_fts をトリガーで同期し、
+  MATCH で部分一致 (前方一致を含む) を引いて bm25 の順位で並べる。件数の上限は設けず、
+  (search_rank, id) をカーソルにして一致した全件をページングできる
+- PostgreSQL: pg_trgm の GIN インデックス (UPPER(col) に張るので Django の icontains がそのまま使える) と
+  trigram 類似度の順位
+を使う。どちらも使えないとき (2 文字以下の語、他の DB) は従来の SearchFilter に戻る。
+
+SQLite ではスキーマ変更のたびに Django がテーブルを作り直してトリガーが消えるので、
+post_migrate で ensure_search_index() を呼び直す (dojo.apps)。
+"""
+import logging
+from typing import List, Optional
+
+from django.db import connection as default_connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+logger = logging.getLogger(__name__)
+
+MIN_TRIGRAM_LEN = 3      # trigram はこれより短い語に一致しない
+FTS_TABLE = "dojo_dojo_fts"
+
+_SQLITE_FTS = (
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+    "name, address, content='dojo_dojo', content_rowid='id', tokenize='{tokenize}')"
+)
+_SQLITE_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON dojo_dojo BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, address) VALUES (new.id, new.name, new.address);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON dojo_dojo BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, address) VALUES ('delete', old.id, old.name, old.address);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, address ON dojo_dojo BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, address) VALUES ('delete', old.id, old.name, old.address);
+        INSERT INTO {FTS_TABLE}(rowid, name, address) VALUES (new.id, new.name, new.address);
+    END
+    """,
+]
+_POSTGRES_INDEXES = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS dojo_dojo_name_trgm ON dojo_dojo USING gin (UPPER(name::text) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS dojo_dojo_address_trgm ON dojo_dojo USING gin (UPPER(address::text) gin_trgm_ops)",
+]
+
+
+# ----------------------------------------------------------------------------
+# Index maintenance
+# ----------------------------------------------------------------------------
+def _sqlite_objects(cursor, kind: str) -> set:
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = %s AND name LIKE %s", [kind, f"{FTS_TABLE}%"])
+    return {row[0] for row in cursor.fetchall()}
+
+
+def ensure_search_index(connection=None) -> None:
+    """
+    検索インデックスを作る (作成済みなら何もしない)。トリガーが消えていたら作り直して再構築する。
+    """
+    connection = connection or default_connection
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            if "dojo_dojo" not in connection.introspection.table_names(cursor):
+                return
+            rebuild = False
+            if FTS_TABLE not in _sqlite_objects(cursor, "table"):
+                try:
+                    cursor.execute(_SQLITE_FTS.format(tokenize="trigram"))
+                except Exception:
+                    # trigram は SQLite 3.34 以降。古い場合は単語単位の前方一致にする
+                    cursor.execute(_SQLITE_FTS.format(tokenize="unicode61"))
+                rebuild = True
+            if len(_sqlite_objects(cursor, "trigger")) < len(_SQLITE_TRIGGERS):
+                for sql in _SQLITE_TRIGGERS:
+                    cursor.execute(sql)
+                rebuild = True
+            if rebuild:
+                cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+                logger.info(f"[search] rebuilt {FTS_TABLE}")
+    elif connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            for sql in _POSTGRES_INDEXES:
+                cursor.execute(sql)
+
+
+def drop_search_index(connection=None) -> None:
+    connection = connection or default_connection
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            for name in ("ai", "ad", "au"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{name}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        elif connection.vendor == "postgresql":
+            cursor.execute("DROP INDEX IF EXISTS dojo_dojo_name_trgm")
+            cursor.execute("DROP INDEX IF EXISTS dojo_dojo_address_trgm")
+
+
+def ensure_search_index_after_migrate(sender, using="default", **kwargs) -> None:
+    from django.db import connections
+    ensure_search_index(connections[using])
+
+
+# ----------------------------------------------------------------------------
+# Querying
+# ----------------------------------------------------------------------------
+def _sqlite_tokenizer(cursor) -> Optional[str]:
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return "trigram" if "trigram" in row[0] else "unicode61"
+
+
+def fts_query(terms: List[str], trigram: bool) -> str:
+    """
+    各語をフレーズとして AND で結ぶ。trigram は部分一致、unicode61 は前方一致 (*)。
+    """
+    quoted = ['"' + t.replace('"', '""') + '"' + ("" if trigram else "*") for t in terms]
+    return " AND ".join(quoted)
+
+
+def sqlite_match(terms: List[str]) -> Optional[str]:
+    """
+    FTS5 の MATCH 式。FTS が使えない条件 (テーブルが無い・trigram で短い語) なら None。
+    """
+    with default_connection.cursor() as cursor:
+        tokenizer = _sqlite_tokenizer(cursor)
+    if tokenizer is None:
+        return None
+    trigram = tokenizer == "trigram"
+    if trigram and any(len(t) < MIN_TRIGRAM_LEN for t in terms):
+        return None
+    return fts_query(terms, trigram)
+
+
+class DojoSearchFilter(filters.SearchFilter):
+    """
+    SearchFilter と同じ ?search= を受け、関連度を search_rank (小さいほど上位) として付ける。
+    DojoCursorPagination は search_rank があればその順に並べる。
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        vendor = default_connection.vendor
+        if vendor == "sqlite":
+            match = sqlite_match(terms)
+            if match is not None:
+                table = queryset.model._meta.db_table
+                matched = RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match])
+                # bm25 の値 (小さいほど上位)。一致した行だけに付く
+                rank = RawSQL(
+                    f"(SELECT rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND rowid = {table}.id)",
+                    [match], output_field=FloatField(),
+                )
+                return queryset.filter(pk__in=matched).annotate(search_rank=rank)
+        elif vendor == "postgresql":
+            from django.contrib.postgres.search import TrigramSimilarity
+            from django.db.models.functions import Greatest
+
+            match = Q()
+            for term in terms:
+                match &= Q(name__icontains=term) | Q(address__icontains=term)
+            text = " ".join(terms)
+            similarity = Greatest(TrigramSimilarity("name", text), TrigramSimilarity("address", text))
+            return queryset.filter(match).annotate(search_rank=-similarity)
+        return super().filter_queryset(request, queryset, view)
@@ -0,0 +1,44 @@
+"""
+seen.py – 最近 Place Details を取得した place_id の記録。
+
+以前は cache の "fetched_pids" に Python の set を丸ごと読み書きしていたため、
+サイズが無制限に増え、ワーカー間で競合し、既出の道場が検索結果から消えていた。
+ここでは place_id ごとに期限付きキーを持ち、既出の道場は DB の行から結果に含める。
+"""
+import logging
+from typing import Iterable, Set
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+SEEN_PLACE_SEC = 60 * 60 * 24  # DETAIL_CACHE_SEC と同じ 24h
+
+
+class SeenPlaceStore:
+    """
+    place_id → 期限付きキャッシュキー。判定・登録とも get_many / set_many の 1 往復。
+    件数の上限はキャッシュバックエンドの追い出しに任せる。
+    """
+
+    def __init__(self, prefix: str = "seen_place", timeout: int = SEEN_PLACE_SEC):
+        self.prefix = prefix
+        self.timeout = timeout
+
+    def _key(self, place_id: str) -> str:
+        return f"{self.prefix}_{place_id}"
+
+    def seen(self, place_ids: Iterable[str]) -> Set[str]:
+        keys = {self._key(pid): pid for pid in place_ids}
+        if not keys:
+            return set()
+        return {keys[k] for k in cache.get_many(list(keys))}
+
+    def mark(self, place_ids: Iterable[str]) -> None:
+        values = {self._key(pid): 1 for pid in place_ids}
+        if values:
+            cache.set_many(values, self.timeout)
+
+
+seen_places = SeenPlaceStore()
+
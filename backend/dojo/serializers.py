@@ -1,7 +1,6 @@
 # dojo/serializers.py
 
 from rest_framework import serializers
-from django.core.cache import cache
 from django.contrib.auth import get_user_model, authenticate
 
 from .models import Dojo, OpenMat, Feedback, Review, Favorite, PracticeDay
@@ -23,7 +22,32 @@ class OpenMatSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class DojoSerializer(serializers.ModelSerializer):
+def requested_fields(request):
+    """
+    ?fields=id,name,lat,lng の集合 (lat / lng は latitude / longitude の別名)。指定が無ければ None
+    """
+    if request is None:
+        return None
+    raw = request.query_params.get('fields', '')
+    names = {SparseFieldsMixin.FIELD_ALIASES.get(f.strip(), f.strip()) for f in raw.split(',') if f.strip()}
+    return names or None
+
+
+class SparseFieldsMixin:
+    """
+    ?fields= で返すフィールドを絞る (地図表示の一覧など)。未知の名前は無視する。
+    """
+    FIELD_ALIASES = {'lat': 'latitude', 'lng': 'longitude'}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = requested_fields(self.context.get('request'))
+        if fields:
+            for name in set(self.fields) - fields:
+                self.fields.pop(name)
+
+
+class DojoSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     open_mats = OpenMatSerializer(many=True, read_only=True)
     has_open_mat = serializers.SerializerMethodField()
 
@@ -43,21 +67,16 @@ class DojoSerializer(serializers.ModelSerializer):
             'open_mats',
             'has_open_mat',
             'rating',
-            'reviews',
         ]
 
     def get_has_open_mat(self, obj):
         """
-        Open Mat の有無を取得するメソッド
+        Open Mat の有無。書き込み時に計算済みの Dojo.has_open_mat を返し、
+        未計算 (NULL) の行だけその場で判定する (キャッシュは使わない)
         """
-        cache_key = f"open_mat_info_{obj.name.lower() if obj.name else obj.website.lower()}"
-        cached_result = cache.get(cache_key)
-        if cached_result is not None:
-            return cached_result
-
-        has_open_mat = get_open_mat_info(obj.name, obj.website)
-        cache.set(cache_key, has_open_mat, timeout=86400)  # 24時間キャッシュ
-        return has_open_mat
+        if obj.has_open_mat is not None:
+            return obj.has_open_mat
+        return get_open_mat_info(obj.name, obj.website)
 
 
 class FavoriteSerializer(serializers.ModelSerializer):
@@ -67,12 +86,20 @@ class FavoriteSerializer(serializers.ModelSerializer):
         write_only=True
     )
     dojo = DojoSerializer(read_only=True)
+    enrichment_status = serializers.SerializerMethodField()
 
     class Meta:
         model = Favorite
-        fields = ['id', 'user', 'dojo_id', 'dojo']
+        fields = ['id', 'user', 'dojo_id', 'dojo', 'enrichment_status']
         read_only_fields = ['user', 'dojo']
 
+    def get_enrichment_status(self, obj):
+        """
+        詳細情報の補完状況 (pending / running / done / failed)。補完不要だった場合は None
+        """
+        job = getattr(obj.dojo, "enrichment", None)
+        return job.status if job else None
+
 
 class ReviewSerializer(serializers.ModelSerializer):
     user = serializers.StringRelatedField(read_only=True)  # ユーザー名を表示
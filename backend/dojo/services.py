@@ -3,7 +3,8 @@
 import requests
 from django.conf import settings
 import logging
-from bs4 import BeautifulSoup  # HTML解析のためにBeautifulSoupを使用
+from .htmlscan import CHUNK_SIZE, scan_chunks  # 本文を読みながら最初のリンクで打ち切る
+from .outbound import get_sync_session  # プロセス共通のコネクションプール
 
 logger = logging.getLogger(__name__)
 
@@ -48,7 +49,7 @@ def fetch_dojo_data(query):
             'query': f"{query} dojo",  # 検索クエリに "dojo" を追加
             'key': api_key,
         }
-        response = requests.get(url, params=params)
+        response = get_sync_session().get(url, params=params, timeout=15)
         response.raise_for_status()
         data = response.json()
         
@@ -87,7 +88,7 @@ def fetch_dojo_data(query):
 def fetch_instagram_link(website):
     """
     道場のウェブサイトからInstagramリンクを取得します。
-    BeautifulSoupを使用して正確にリンクを抽出します。
+    本文をストリーミングで読み、最初の Instagram リンクが見つかった時点で打ち切ります。
     
     Args:
         website (str): 道場のウェブサイトURL
@@ -100,19 +101,14 @@ def fetch_instagram_link(website):
         return None
 
     try:
-        response = requests.get(website, timeout=10)
-        response.raise_for_status()
-        html = response.text
-        soup = BeautifulSoup(html, 'html.parser')
-        
-        # 全てのリンクを検索してInstagramリンクを探す
-        for link in soup.find_all('a', href=True):
-            href = link['href']
-            if 'instagram.com' in href:
-                # URLが相対パスの場合は絶対パスに変換
-                if not href.startswith('http'):
-                    href = f"https://{href.lstrip('/')}"
-                return href
+        with get_sync_session().get(website, timeout=10, stream=True) as response:
+            response.raise_for_status()
+            href = scan_chunks(response.iter_content(CHUNK_SIZE))
+        if href:
+            # URLが相対パスの場合は絶対パスに変換
+            if not href.startswith('http'):
+                href = f"https://{href.lstrip('/')}"
+            return href
         return None
     except requests.RequestException as e:
         logger.error(f"Error fetching Instagram link from {website}: {e}")
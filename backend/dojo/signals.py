@@ -1,3 +1,5 @@
+from django.core.cache import cache
+from django.db import transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from .models import Dojo
@@ -6,9 +8,19 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+OPEN_MAT_DEBOUNCE_SEC = 30
+
+
+def _schedule_open_mat_task():
+    # コミット後に debounce のキーを立てる (ロールバックされた作成でキーが残り、後の作成を取りこぼさないように)
+    if cache.add("open_mat_task_scheduled", True, OPEN_MAT_DEBOUNCE_SEC):
+        update_open_mat_info_task.apply_async(countdown=OPEN_MAT_DEBOUNCE_SEC)
+
+
 @receiver(post_save, sender=Dojo)
 def update_open_mat_info(sender, instance, created, **kwargs):
     if created:
         logger.info(f"新しい Dojo インスタンスが作成されました: {instance.name}")
-        # タスクを非同期で実行
-        update_open_mat_info_task.delay(instance.id)
+        # 作成ごとにタスクを投げず、OPEN_MAT_DEBOUNCE_SEC 内の作成分を 1 回のタスクでまとめて処理する
+        # (タスクは open_mat_checked_at が NULL の道場をすべて拾う)
+        transaction.on_commit(_schedule_open_mat_task)
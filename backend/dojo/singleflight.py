@@ -0,0 +1,96 @@
+"""
+singleflight.py – 同一キーの同時リクエストを 1 回の上流呼び出しにまとめる。
+
+async_to_sync はリクエストごとに別スレッド・別イベントループで動くため、
+プロセス内の登録簿は concurrent.futures.Future で持ち、各ループからは wrap_future で待つ。
+shared=True の場合は Django キャッシュのロックでプロセス間でもまとめる
+（Redis 等の共有キャッシュが前提。LocMem ではプロセス内と同じ効果しかない）。
+"""
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+LOCK_SEC = 60              # 共有ロックの最大保持時間（リーダーが落ちても解放される）
+SHARED_RESULT_SEC = 30     # 共有結果をフォロワーが拾えるようにしておく時間
+SHARED_POLL_SEC = 0.2
+
+_lock = threading.Lock()
+_inflight: Dict[str, Future] = {}
+
+
+async def single_flight(
+    key: str,
+    fn: Callable[[], Awaitable[Any]],
+    shared: bool = False,
+) -> Any:
+    """
+    key が同じ呼び出しが実行中なら、その結果を待って返す。無ければ自分で fn() を実行する。
+    """
+    with _lock:
+        fut = _inflight.get(key)
+        leader = fut is None
+        if leader:
+            fut = Future()
+            _inflight[key] = fut
+
+    if not leader:
+        logger.debug(f"[single_flight] join in-flight {key}")
+        return await asyncio.wrap_future(fut)
+
+    try:
+        if shared:
+            result = await _shared_flight(key, fn)
+        else:
+            result = await fn()
+    except BaseException as e:
+        # リーダーがキャンセルされてもフォロワーまでキャンセル扱いにはしない
+        if not isinstance(e, Exception):
+            e = RuntimeError(f"single_flight leader for {key} was cancelled")
+        fut.set_exception(e)
+        raise
+    else:
+        fut.set_result(result)
+        return result
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+
+
+async def _shared_flight(key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+    hashed = hashlib.md5(key.encode("utf-8")).hexdigest()
+    lock_key = f"sf_lock_{hashed}"
+    result_key = f"sf_result_{hashed}"
+
+    deadline = time.monotonic() + LOCK_SEC
+    waited = False
+    while not cache.add(lock_key, 1, LOCK_SEC):
+        # 別プロセスが実行中: 結果が置かれるかロックが消えるまで待つ
+        waited = True
+        shared = cache.get(result_key)
+        if shared is not None:
+            logger.debug(f"[single_flight] shared result for {key}")
+            return shared["value"]
+        if time.monotonic() >= deadline:
+            logger.warning(f"[single_flight] shared lock timeout for {key}, running locally")
+            return await fn()
+        await asyncio.sleep(SHARED_POLL_SEC)
+
+    try:
+        if waited:
+            # 結果の保存とロック解放の間に割り込んだ場合
+            shared = cache.get(result_key)
+            if shared is not None:
+                return shared["value"]
+        result = await fn()
+        cache.set(result_key, {"value": result}, SHARED_RESULT_SEC)
+        return result
+    finally:
+        cache.delete(lock_key)
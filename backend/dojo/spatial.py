@@ -0,0 +1,198 @@
+"""
+spatial.py – Dojo テーブルの geohash インデックスを使ったローカル検索。
+Google 取得済みの範囲 (テキスト検索は SearchArea、周辺検索は CrawledTile) が新しければ、
+Places API を呼ばずに DB から応答する。
+"""
+import logging
+import statistics
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from django.db.models import Q
+from django.utils.timezone import now
+
+from . import geohash as gh
+from .models import CrawledTile, Dojo, SearchArea
+
+logger = logging.getLogger(__name__)
+
+LOCAL_SEARCH_FRESH_SEC = 60 * 60 * 24 * 7  # 取得から 7 日間はローカルで応答
+LOCAL_REVALIDATE_SEC = LOCAL_SEARCH_FRESH_SEC - 60 * 60 * 24  # 期限切れ前の最後の 1 日は裏で取り直す
+MIN_AREA_RADIUS_M = 2000
+MAX_AREA_RADIUS_M = 50000                  # NearbySearch の最大半径と揃える
+AREA_RADIUS_PERCENTILE = 0.9               # 外れ値 (FORCE_KEYWORDS の遠方ヒット等) を除外
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def dojo_to_detail(dojo: Dojo) -> Dict:
+    """
+    fetch_place_details_async と同じ形の dict に変換する。
+    reviews は含めない (PlaceReviews に分けてあり、詳細表示で別に取る)。
+    """
+    return {
+        "name": dojo.name,
+        "address": dojo.address,
+        "latitude": dojo.latitude,
+        "longitude": dojo.longitude,
+        "hours": dojo.hours or [],
+        "website": dojo.website,
+        "place_id": dojo.place_id,
+        "rating": dojo.rating,
+        "user_ratings_total": dojo.user_ratings_total,
+    }
+
+
+def known_details(place_ids: Iterable[str]) -> Dict[str, Dict]:
+    """
+    DB に保存済みの道場を Place Details と同じ形で返す。
+    """
+    return {
+        dojo.place_id: dojo_to_detail(dojo)
+        for dojo in Dojo.objects.filter(place_id__in=list(place_ids))
+    }
+
+
+# ----------------------------------------------------------------------------
+# Spatial queries
+# ----------------------------------------------------------------------------
+def geohash_prefix_q(cells: Iterable[str]) -> Q:
+    """
+    geohash の前方一致を範囲条件で表す (LIKE と違い B-tree インデックスが効く)。
+    """
+    q = Q()
+    for cell in cells:
+        q |= Q(geohash__gte=cell, geohash__lt=cell + "~")
+    return q
+
+
+def dojos_near(lat: float, lng: float, radius_m: float) -> List[Dojo]:
+    """
+    半径 radius_m 以内の Dojo を距離順で返す。
+    """
+    cells = gh.covering_cells(lat, lng, radius_m)
+    hits = []
+    for dojo in Dojo.objects.filter(geohash_prefix_q(cells)):
+        dist = gh.distance_m(lat, lng, dojo.latitude, dojo.longitude)
+        if dist <= radius_m:
+            hits.append((dist, dojo))
+    hits.sort(key=lambda h: h[0])
+    return [dojo for _, dojo in hits]
+
+
+def places_in_circle(tiles: Iterable[Dict], lat: float, lng: float, radius_m: float) -> Set[str]:
+    """
+    タイルの {place_id: [lat, lng]} の和集合から、円の内側 (座標不明を含む) の place_id を返す。
+    """
+    place_ids: Set[str] = set()
+    for places in tiles:
+        for pid, (plat, plng) in places.items():
+            if plat is None or plng is None or gh.distance_m(lat, lng, plat, plng) <= radius_m:
+                place_ids.add(pid)
+    return place_ids
+
+
+# ----------------------------------------------------------------------------
+# Coverage bookkeeping
+# ----------------------------------------------------------------------------
+def _fresh_cutoff():
+    return now() - timedelta(seconds=LOCAL_SEARCH_FRESH_SEC)
+
+
+def _points(dojos: Iterable[Dict]) -> List[Tuple[float, float]]:
+    return [
+        (d["latitude"], d["longitude"])
+        for d in dojos
+        if d.get("latitude") is not None and d.get("longitude") is not None
+    ]
+
+
+def median_center(dojos: Iterable[Dict]) -> Optional[Tuple[float, float]]:
+    """
+    結果の緯度経度の中央値 (外れ値に強い)。座標のある結果が無ければ None。
+    """
+    points = _points(dojos)
+    if not points:
+        return None
+    return statistics.median(p[0] for p in points), statistics.median(p[1] for p in points)
+
+
+def record_search_area(key: str, dojos: List[Dict]) -> Optional[SearchArea]:
+    """
+    Google から取得した結果の分布から検索範囲を推定して保存する。
+    中心は緯度経度の中央値、半径は中心からの距離の 90 パーセンタイル。
+    """
+    points = _points(dojos)
+    if not points:
+        return None
+    center_lat, center_lng = median_center(dojos)
+    dists = sorted(gh.distance_m(center_lat, center_lng, lat, lng) for lat, lng in points)
+    radius = dists[int(AREA_RADIUS_PERCENTILE * (len(dists) - 1))]
+    radius = min(max(radius, MIN_AREA_RADIUS_M), MAX_AREA_RADIUS_M)
+    area, _ = SearchArea.objects.update_or_create(
+        query=key,
+        defaults={
+            "center_latitude": center_lat,
+            "center_longitude": center_lng,
+            "radius_m": radius,
+            "place_count": len(points),
+            "crawled_at": now(),
+        },
+    )
+    return area
+
+
+def fresh_tiles(tiles: Iterable[str]) -> Dict[str, Dict]:
+    """
+    取得済みで新しいタイルの {geohash: places} を返す。
+    """
+    rows = CrawledTile.objects.filter(geohash__in=list(tiles), crawled_at__gte=_fresh_cutoff())
+    return {row.geohash: row.places for row in rows}
+
+
+def record_tile(tile: str, places: Dict) -> None:
+    CrawledTile.objects.update_or_create(
+        geohash=tile, defaults={"places": places, "crawled_at": now()}
+    )
+
+
+def local_search_by_query(query: str) -> Optional[Dict[str, List[Dict]]]:
+    """
+    クエリの検索範囲が新しければ DB から応答する。無ければ None (Google へ)。
+    crawled_at は範囲を取得した時刻 (古ければ呼び出し側が裏で取り直す)。
+    """
+    area = SearchArea.objects.filter(
+        query=normalize_query(query), crawled_at__gte=_fresh_cutoff()
+    ).first()
+    if area is None:
+        return None
+    dojos = dojos_near(area.center_latitude, area.center_longitude, area.radius_m)
+    logger.debug(f"[local_search] query={query!r} → {len(dojos)} dojos (area={area})")
+    return {"dojos": [dojo_to_detail(d) for d in dojos], "source": "local", "crawled_at": area.crawled_at}
+
+
+def local_search_nearby(lat: float, lng: float, radius: int) -> Optional[Dict[str, List]]:
+    """
+    円を覆うタイルがすべて取得済みで新しければ、タイルに記録した place_id から応答する。
+    DB にまだ行が無い place_id (Details 未取得・write-behind の書き込み待ち) は missing に入れて返すので、
+    呼び出し側が Details を取って補う。
+    """
+    tiles = gh.tiles_for_circle(lat, lng, radius)
+    stored = fresh_tiles(tiles)
+    if len(stored) < len(tiles):
+        return None
+    place_ids = places_in_circle(stored.values(), lat, lng, radius)
+    known = known_details(place_ids)
+    dojos = sorted(
+        known.values(),
+        key=lambda d: gh.distance_m(lat, lng, d["latitude"], d["longitude"])
+        if d["latitude"] is not None and d["longitude"] is not None else float("inf"),
+    )
+    missing = sorted(place_ids - set(known))
+    logger.debug(
+        f"[local_search] nearby {lat},{lng} r={radius} → {len(dojos)} dojos, "
+        f"{len(missing)} missing ({len(tiles)} tiles)"
+    )
+    return {"dojos": dojos, "source": "local", "missing": missing}
@@ -1,21 +1,86 @@
 from celery import shared_task
+from django.utils.timezone import now
 from .models import Dojo
-#from .services import get_open_mat_info
+from .services import get_open_mat_info
 import logging
 
 logger = logging.getLogger(__name__)
 
+OPEN_MAT_CHUNK_SIZE = 500
+
+
 @shared_task
-def update_open_mat_info_task():
+def update_open_mat_info_task(dojo_ids=None, full=False):
     """
     Open Mat情報を更新するタスク。
+
+    dojo_ids を渡せばその道場だけ、省略時は未計算・内容が変わった道場 (open_mat_checked_at が NULL) だけ、
+    full=True なら全件を対象にする。OPEN_MAT_CHUNK_SIZE 件ずつ読み、値が変わった行だけ bulk_update する。
     """
-    dojos = Dojo.objects.all()
-    for dojo in dojos:
+    if isinstance(dojo_ids, int):  # 旧形式 .delay(instance.id)
+        dojo_ids = [dojo_ids]
+    if dojo_ids is not None:
+        qs = Dojo.objects.filter(id__in=dojo_ids)
+    elif full:
+        qs = Dojo.objects.all()
+    else:
+        qs = Dojo.objects.filter(open_mat_checked_at__isnull=True)
+    qs = qs.only("id", "name", "website", "has_open_mat").order_by("id")
+
+    checked = changed = 0
+    chunk_ids, changed_rows = [], []
+
+    def flush():
+        nonlocal checked, changed
+        if changed_rows:
+            Dojo.objects.bulk_update(changed_rows, ["has_open_mat"])
+        Dojo.objects.filter(id__in=chunk_ids).update(open_mat_checked_at=now())
+        checked += len(chunk_ids)
+        changed += len(changed_rows)
+        chunk_ids.clear()
+        changed_rows.clear()
+
+    for dojo in qs.iterator(chunk_size=OPEN_MAT_CHUNK_SIZE):
         try:
             has_open_mat = get_open_mat_info(dojo.name, dojo.website)
-            dojo.has_open_mat = has_open_mat  # モデルにフィールドがあれば更新
-            dojo.save()
-            logger.info(f"Updated Open Mat info for dojo: {dojo.name}")
         except Exception as e:
             logger.error(f"Failed to update Open Mat info for dojo: {dojo.name}. Error: {e}")
+            continue
+        chunk_ids.append(dojo.id)
+        if dojo.has_open_mat != has_open_mat:
+            dojo.has_open_mat = has_open_mat
+            changed_rows.append(dojo)
+        if len(chunk_ids) >= OPEN_MAT_CHUNK_SIZE:
+            flush()
+    if chunk_ids:
+        flush()
+    logger.info(f"Updated Open Mat info: checked={checked} changed={changed}")
+    return {"checked": checked, "changed": changed}
+
+
+@shared_task
+def enrich_dojo_task(dojo_id):
+    """
+    お気に入り追加時の道場情報の補完 (ENRICHMENT_USE_CELERY=True のとき)。
+    再試行は enrichment.run_enrichment が countdown 付きで依頼し直す。
+    """
+    from .enrichment import run_enrichment
+    return run_enrichment(dojo_id)
+
+
+@shared_task
+def refresh_popular_dojos_task():
+    """
+    人気度 × 経過時間の高い道場から、1 時間あたりの予算内で Place Details を取り直す。
+    """
+    from .scheduler import refresh_popular_dojos
+    return refresh_popular_dojos()
+
+
+@shared_task
+def resume_enrichment_jobs_task():
+    """
+    再起動などで止まった補完ジョブを実行し直す (CELERY_BEAT_SCHEDULE で定期実行)。
+    """
+    from .enrichment import resume_stale_jobs
+    return resume_stale_jobs()
@@ -2,6 +2,46 @@ from django.test import TestCase
 from .models import Dojo, OpenMat
 from unittest.mock import patch
 
+
+class QueryBudgetMixin:
+    """
+    一覧エンドポイントのクエリ数が行数に依存しないことを確かめる (N+1 の検出)。
+    """
+
+    def assertQueryBudget(self, url, budget, add_rows, extra=20):
+        """
+        url を取得してクエリ数が budget 以下であることを確かめ、add_rows(extra) で行を増やして
+        もう一度取得し、クエリ数が増えていないことを確かめる。
+        """
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        counts = []
+        for step in range(2):
+            if step:
+                add_rows(extra)
+            with CaptureQueriesContext(connection) as ctx:
+                res = self.client.get(url)
+            self.assertEqual(res.status_code, 200)
+            queries = "\n".join(q["sql"] for q in ctx.captured_queries)
+            self.assertLessEqual(len(ctx), budget, f"{url} ran {len(ctx)} queries:\n{queries}")
+            counts.append(len(ctx))
+        self.assertEqual(counts[0], counts[1], f"{url} query count grows with rows: {counts}")
+
+
+class OwnerClientMixin:
+    """
+    Dojo.user の既定値 (id=1) のユーザーを self.user に作り、そのユーザーで認証した APIClient を self.client にする。
+    """
+
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+        from rest_framework.test import APIClient
+        super().setUp()
+        self.user = get_user_model().objects.create_user(id=1, username="owner", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
 class DojoSignalTest(TestCase):
     @patch('dojo.tasks.fetch_open_mat_info_from_website')
     @patch('dojo.tasks.fetch_open_mat_info_via_google_search')
@@ -42,3 +82,1057 @@ class DojoSignalTest(TestCase):
 
         self.assertFalse(dojo.has_open_mat())
         self.assertEqual(dojo.open_mats.count(), 0)
+
+
+class GeohashTest(TestCase):
+    def test_encode_known_value(self):
+        from . import geohash
+        self.assertEqual(geohash.encode(57.64911, 10.40744, 11), "u4pruydqqvj")
+
+    def test_covering_cells_contain_circle(self):
+        from . import geohash
+        lat, lng, radius = 49.2827, -123.1207, 5000
+        cells = geohash.covering_cells(lat, lng, radius)
+        # 円周上の点はいずれかのセルに入る
+        for dlat, dlng in ((0.044, 0), (-0.044, 0), (0, 0.068), (0, -0.068)):
+            point = geohash.encode(lat + dlat, lng + dlng)
+            self.assertTrue(any(point.startswith(c) for c in cells))
+
+
+class LocalSearchTest(TestCase):
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+        self.user = get_user_model().objects.create_user(username="owner", password="x")
+
+    def _dojo(self, place_id, lat, lng):
+        return Dojo.objects.create(
+            user=self.user, name=place_id, address="", latitude=lat, longitude=lng, place_id=place_id
+        )
+
+    def test_dojos_near_sorted_by_distance(self):
+        from .spatial import dojos_near
+        self._dojo("far", 49.30, -123.12)
+        self._dojo("near", 49.283, -123.121)
+        self._dojo("out", 49.60, -123.12)
+        names = [d.place_id for d in dojos_near(49.2827, -123.1207, 5000)]
+        self.assertEqual(names, ["near", "far"])
+
+    def test_local_search_requires_fresh_area(self):
+        from .spatial import local_search_by_query, record_search_area
+        self._dojo("a", 49.2827, -123.1207)
+        self.assertIsNone(local_search_by_query("Vancouver"))
+        record_search_area("vancouver", [{"latitude": 49.2827, "longitude": -123.1207}])
+        result = local_search_by_query("  VANCOUVER ")
+        self.assertEqual([d["place_id"] for d in result["dojos"]], ["a"])
+
+    def test_local_nearby_reports_crawled_places_without_rows(self):
+        from . import geohash
+        from .spatial import local_search_nearby, record_tile
+        lat, lng = 49.2827, -123.1207
+        self.assertIsNone(local_search_nearby(lat, lng, 1000))
+        places = {"far": [lat + 0.005, lng], "near": [lat, lng], "unsaved": [lat, lng + 0.001], "out": [10.0, 10.0]}
+        for tile in geohash.tiles_for_circle(lat, lng, 1000):
+            record_tile(tile, places)
+        self._dojo("far", lat + 0.005, lng)
+        self._dojo("near", lat, lng)
+
+        result = local_search_nearby(lat, lng, 1000)
+        self.assertEqual([d["place_id"] for d in result["dojos"]], ["near", "far"])
+        self.assertEqual(result["missing"], ["unsaved"])
+
+    def test_nearby_view_fetches_missing_details(self):
+        from rest_framework.test import APIRequestFactory
+        from . import geohash
+        from .views import FetchDojoDataNearbyView
+        from .spatial import record_tile
+        lat, lng = 49.2827, -123.1207
+        for tile in geohash.tiles_for_circle(lat, lng, 1000):
+            record_tile(tile, {"near": [lat, lng], "unsaved": [lat, lng + 0.001]})
+        self._dojo("near", lat, lng)
+
+        async def fake_details(place_ids, api_key):
+            return [{"place_id": pid, "name": pid, "address": "", "latitude": lat, "longitude": lng + 0.001}
+                    for pid in place_ids]
+
+        with self.settings(GOOGLE_API_KEY="k", LOCAL_FIRST_SEARCH=True), \
+                patch("dojo.views.fetch_details_for", side_effect=fake_details) as fetch:
+            request = APIRequestFactory().get("/", {"lat": lat, "lng": lng, "radius": 1000})
+            res = FetchDojoDataNearbyView.as_view()(request)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([d["place_id"] for d in res.data["dojos"]], ["near", "unsaved"])
+        self.assertNotIn("missing", res.data)
+        self.assertEqual(fetch.call_args[0][0], {"unsaved"})
+        self.assertTrue(Dojo.objects.filter(place_id="unsaved").exists())
+
+
+class NearbyTileCacheTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_nearby_searches_share_tiles(self):
+        from asgiref.sync import async_to_sync
+        from .models import CrawledTile
+        from .utils import fetch_dojo_data_nearby_async
+
+        async def fake_places(lat, lng, radius, api_key, session, keywords, max_pages=3):
+            return {"bjj": {"p1": [49.2827, -123.1207], "far": [10.0, 10.0]}}, True
+
+        async def fake_details(pid, api_key, session):
+            return {"place_id": pid}
+
+        with patch("dojo.utils.fetch_nearby_places", side_effect=fake_places) as crawl, \
+                patch("dojo.utils.fetch_place_details_async", side_effect=fake_details):
+            first = async_to_sync(fetch_dojo_data_nearby_async)(49.2827, -123.1207, 1000, "key")
+            calls = crawl.call_count
+            second = async_to_sync(fetch_dojo_data_nearby_async)(49.2829, -123.1209, 1000, "key")
+
+        self.assertEqual([d["place_id"] for d in first["dojos"]], ["p1"])
+        self.assertNotIn("stats", first)  # リミッタの統計はログにだけ出す
+        self.assertEqual(second["dojos"], first["dojos"])
+        self.assertEqual(crawl.call_count, calls)
+        self.assertTrue(CrawledTile.objects.exists())
+
+
+class SingleFlightTest(TestCase):
+    def test_concurrent_callers_share_one_call(self):
+        import asyncio
+        from .singleflight import single_flight
+        calls = []
+
+        async def upstream():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"dojos": ["a"]}
+
+        async def run():
+            return await asyncio.gather(*[single_flight("search:x", upstream) for _ in range(5)])
+
+        results = asyncio.run(run())
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(r == {"dojos": ["a"]} for r in results))
+
+
+class SearchResponseCacheTest(OwnerClientMixin, TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        super().setUp()
+        cache.clear()
+
+    def test_fresh_stale_and_miss(self):
+        from . import utils
+
+        async def upstream(query, api_key, max_pages=5):
+            return {"dojos": [{"place_id": "p1"}]}
+
+        with patch("dojo.utils.fetch_dojo_data_async", side_effect=upstream) as fetch, \
+                patch("dojo.utils._refresh_in_background") as refresh, \
+                patch("dojo.utils.time.time") as clock:
+            clock.return_value = 1000.0
+            self.assertEqual(utils.fetch_dojo_data_cached("Vancouver", "key")[1], "miss")
+            self.assertEqual(utils.fetch_dojo_data_cached("vancouver ", "key")[1], "fresh")
+            clock.return_value = 1000.0 + utils.SEARCH_SOFT_TTL_SEC + 1
+            data, state = utils.fetch_dojo_data_cached("Vancouver", "key")
+
+        self.assertEqual(state, "stale")
+        self.assertEqual(data, {"dojos": [{"place_id": "p1"}]})
+        self.assertEqual(fetch.call_count, 1)
+        refresh.assert_called_once()
+
+    def test_stale_local_area_serves_and_revalidates(self):
+        from datetime import timedelta
+        from django.utils.timezone import now
+        from .models import SearchArea
+        from .spatial import LOCAL_REVALIDATE_SEC, record_search_area
+        from . import utils
+        self.client.logout()  # 無料ユーザーの検索回数制限に掛からないよう匿名で呼ぶ
+        Dojo.objects.create(user=self.user, name="A", address="", latitude=49.2827, longitude=-123.1207, place_id="a")
+        record_search_area("vancouver", [{"latitude": 49.2827, "longitude": -123.1207}])
+
+        with self.settings(GOOGLE_API_KEY="k", LOCAL_FIRST_SEARCH=True), \
+                patch("dojo.utils._refresh_in_background") as refresh:
+            res = self.client.get("/api/fetch_dojo_data/?query=Vancouver")
+            self.assertEqual(res.data["source"], "local")
+            # 応答キャッシュの soft TTL を過ぎても、範囲の期限が近づくまでは取り直さない
+            SearchArea.objects.update(crawled_at=now() - timedelta(seconds=utils.SEARCH_SOFT_TTL_SEC + 1))
+            res = self.client.get("/api/fetch_dojo_data/?query=Vancouver")
+            refresh.assert_not_called()
+
+            SearchArea.objects.update(crawled_at=now() - timedelta(seconds=LOCAL_REVALIDATE_SEC + 1))
+            res = self.client.get("/api/fetch_dojo_data/?query=Vancouver")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([d["place_id"] for d in res.data["dojos"]], ["a"])
+        self.assertNotIn("crawled_at", res.data)
+        refresh.assert_called_once()
+        self.assertEqual(refresh.call_args[0][:3], ("Vancouver", "k", 5))
+
+
+class SeenPlaceStoreTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from django.contrib.auth import get_user_model
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username="owner", password="x")
+
+    def test_seen_places_stay_in_results(self):
+        from asgiref.sync import async_to_sync
+        from .seen import seen_places
+        from .utils import fetch_details_for
+
+        Dojo.objects.create(user=self.user, name="Known", address="", place_id="known")
+        seen_places.mark(["known"])
+
+        async def fake_details(pid, api_key, session):
+            return {"place_id": pid}
+
+        with patch("dojo.utils.fetch_place_details_async", side_effect=fake_details) as fetch:
+            details = async_to_sync(fetch_details_for)({"known", "new"}, "key", None)
+
+        self.assertEqual(sorted(d["place_id"] for d in details), ["known", "new"])
+        fetch.assert_called_once_with("new", "key", None)
+        self.assertEqual(seen_places.seen(["known", "new", "other"]), {"known", "new"})
+
+
+class TokenBucketTest(TestCase):
+    def test_burst_then_wait(self):
+        from .ratelimit import TokenBucket
+        bucket = TokenBucket("test", rate=10, capacity=2)
+        self.assertEqual(bucket._reserve(), 0.0)
+        self.assertEqual(bucket._reserve(), 0.0)
+        self.assertAlmostEqual(bucket._reserve(), 0.1, places=2)
+        self.assertAlmostEqual(bucket._reserve(), 0.2, places=2)
+
+    def test_rates_come_from_settings(self):
+        from .ratelimit import places_rate_limits
+        with self.settings(PLACES_DETAILS_QPS=40):
+            self.assertEqual(places_rate_limits()["details"], (40, 80))
+
+
+class KeywordPlannerTest(TestCase):
+    def test_low_yield_keyword_is_skipped_then_explored(self):
+        from .planner import EXPLORE_EVERY, MIN_RUNS, plan_keywords, record_yields
+        keywords = ["bjj", "grappling"]
+        for _ in range(MIN_RUNS):
+            planned = plan_keywords("q:test", keywords)
+            record_yields("q:test", planned, {"bjj": {"a", "b"}, "grappling": {"a"}})
+
+        for _ in range(EXPLORE_EVERY):
+            self.assertEqual(plan_keywords("q:test", keywords), ["bjj"])
+        self.assertEqual(plan_keywords("q:test", keywords), ["bjj", "grappling"])
+
+    def test_force_keywords_are_scoped_to_region(self):
+        from .utils import force_keywords_for_point
+        self.assertIn("Spartacus Gym", force_keywords_for_point(49.17, -123.14))  # Richmond, BC
+        self.assertEqual(force_keywords_for_point(37.54, -77.44), [])  # Richmond, VA
+        self.assertEqual(force_keywords_for_point(51.31, -0.56), [])   # Surrey, UK
+        self.assertEqual(force_keywords_for_point(35.68, 139.69), [])
+
+    def test_forced_keywords_follow_result_coordinates(self):
+        from asgiref.sync import async_to_sync
+        from .utils import FORCE_KEYWORDS, fetch_dojo_data_async
+        coords = {"va": (37.54, -77.44), "bc": (49.17, -123.14)}
+        searched = []
+
+        async def fake_textsearch(kw, query, api_key, session, max_pages, lat=None, lng=None, on_page=None):
+            searched.append(kw)
+            return {f"{query}-{kw}"}
+
+        async def fake_details(pid, api_key, session):
+            lat, lng = coords[pid.split()[1].split("-")[0]]  # "Richmond bc-bjj" → "bc"
+            return {"place_id": pid, "latitude": lat, "longitude": lng}
+
+        with patch("dojo.utils.fetch_textsearch_place_ids", side_effect=fake_textsearch), \
+                patch("dojo.utils.fetch_place_details_async", side_effect=fake_details):
+            async_to_sync(fetch_dojo_data_async)("Richmond va", "key")
+            self.assertFalse(set(searched) & set(FORCE_KEYWORDS))
+            data = async_to_sync(fetch_dojo_data_async)("Richmond bc", "key")
+        self.assertIn("Spartacus Gym", searched)
+        self.assertIn("Richmond bc-Spartacus Gym", {d["place_id"] for d in data["dojos"]})
+
+
+class StreamingSearchTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_frames_then_summary(self):
+        from asgiref.sync import async_to_sync
+        from .utils import iter_dojo_data_async
+
+        async def fake_textsearch(kw, query, api_key, session, max_pages, on_page=None):
+            ids = {"p1", "p2"} if kw == "bjj" else set()
+            if ids:
+                on_page(ids)
+            return ids
+
+        async def fake_details(pid, api_key, session):
+            return {"place_id": pid}
+
+        async def collect():
+            return [frame async for frame in iter_dojo_data_async("Tokyo", "key")]
+
+        with patch("dojo.utils.fetch_textsearch_place_ids", side_effect=fake_textsearch), \
+                patch("dojo.utils.fetch_place_details_async", side_effect=fake_details):
+            frames = async_to_sync(collect)()
+
+        self.assertEqual(sorted(f["dojo"]["place_id"] for f in frames[:-1]), ["p1", "p2"])
+        self.assertEqual(frames[-1]["type"], "summary")
+        self.assertEqual(frames[-1]["count"], 2)
+
+
+class OutboundRunDbTest(TestCase):
+    def test_db_calls_leave_the_background_loop(self):
+        import threading
+        from asgiref.sync import async_to_sync
+        from .outbound import run_async, run_db
+
+        def thread_name():
+            return threading.current_thread().name
+
+        with patch("dojo.outbound.close_old_connections") as close:
+            name = run_async(run_db(thread_name))
+        self.assertTrue(name.startswith("dojo-outbound-db"))
+        self.assertEqual(close.call_count, 2)
+        # async_to_sync の内側では呼び出し元のスレッド (テストのトランザクション) のまま
+        self.assertEqual(async_to_sync(run_db)(thread_name), threading.current_thread().name)
+
+
+class AdaptiveLimiterTest(TestCase):
+    def test_limit_bounds_in_flight_and_halves_on_errors(self):
+        import asyncio
+        from .concurrency import AdaptiveLimiter, observe_call
+        limiter = AdaptiveLimiter(initial=4, minimum=2, maximum=8)
+
+        async def ok():
+            with observe_call() as call:
+                await asyncio.sleep(0.01)
+                call.record(200, "OK")
+            return {}
+
+        async def over_quota():
+            with observe_call() as call:
+                call.record(200, "OVER_QUERY_LIMIT")
+            return None
+
+        async def run():
+            await asyncio.gather(*[limiter.run(ok) for _ in range(20)])
+            self.assertLessEqual(limiter.stats()["max_in_flight"], 8)
+            before = limiter.limit
+            await limiter.run(over_quota)
+            return before
+
+        before = asyncio.run(run())
+        self.assertGreater(before, 4)
+        self.assertEqual(limiter.limit, max(2, before // 2))
+        self.assertEqual(limiter.stats()["errors"], 1)
+
+    def test_ignores_rate_limit_waits_and_not_found(self):
+        import asyncio
+        from .concurrency import AdaptiveLimiter, observe_call
+        limiter = AdaptiveLimiter(initial=4, minimum=2, maximum=8, target_latency=0.05)
+
+        async def throttled_not_found():
+            await asyncio.sleep(0.1)  # トークンバケットの待ち (測らない)
+            with observe_call() as call:
+                call.record(200, "NOT_FOUND")
+            return None
+
+        async def server_error():
+            with observe_call() as call:
+                call.record(503)
+            return None
+
+        async def run():
+            await asyncio.gather(*[limiter.run(throttled_not_found) for _ in range(4)])
+            self.assertEqual(limiter.limit, 5)
+            await limiter.run(server_error)
+
+        asyncio.run(run())
+        self.assertEqual(limiter.limit, 2)
+        self.assertEqual(limiter.stats()["errors"], 1)
+        self.assertEqual(limiter.stats()["calls"], 5)
+
+
+class UpsertDojosTest(OwnerClientMixin, TestCase):
+    def test_insert_update_and_skip_unchanged(self):
+        from .ingest import upsert_dojos
+        a = {"place_id": "a", "name": "A", "latitude": 49.28, "longitude": -123.12}
+        b = {"place_id": "b", "name": "B"}
+        self.assertEqual(upsert_dojos([a, b]), {"inserted": 2, "updated": 0, "unchanged": 0})
+        self.assertEqual(
+            upsert_dojos([a, dict(b, rating=4.5)]), {"inserted": 0, "updated": 1, "unchanged": 1}
+        )
+        self.assertEqual(Dojo.objects.get(place_id="b").rating, 4.5)
+        self.assertEqual(Dojo.objects.get(place_id="a").geohash, Dojo.compute_geohash(49.28, -123.12))
+
+    def test_unchanged_rows_advance_hours_refreshed_at(self):
+        from datetime import timedelta
+        from django.utils.timezone import now
+        from .ingest import upsert_dojos
+        a = {"place_id": "a", "name": "A"}
+        upsert_dojos([a])
+        old = now() - timedelta(days=10)
+        Dojo.objects.update(hours_refreshed_at=old)
+        self.assertEqual(upsert_dojos([a])["unchanged"], 1)
+        self.assertGreater(Dojo.objects.get(place_id="a").hours_refreshed_at, old)
+
+    def test_rows_lost_to_a_concurrent_insert_are_not_counted(self):
+        from .ingest import upsert_dojos
+        real_bulk_create = Dojo.objects.bulk_create
+
+        def racing_bulk_create(objs, **kwargs):
+            # 既存行を調べた後、挿入の前に別のワーカーが "a" を挿入した
+            Dojo.objects.create(place_id="a", name="Other worker", address="")
+            return real_bulk_create(objs, **kwargs)
+
+        with patch.object(Dojo.objects, "bulk_create", side_effect=racing_bulk_create):
+            counts = upsert_dojos([{"place_id": "a", "name": "A"}, {"place_id": "b", "name": "B"}])
+        self.assertEqual(counts, {"inserted": 1, "updated": 0, "unchanged": 1})
+        self.assertEqual(Dojo.objects.get(place_id="a").name, "Other worker")
+
+    def test_has_open_mat_precomputed_and_serialized_without_cache(self):
+        from .ingest import upsert_dojos
+        from .serializers import DojoSerializer
+        upsert_dojos([{"place_id": "a", "name": "Open Mat Club"}, {"place_id": "b", "name": "B"}])
+        a = Dojo.objects.get(place_id="a")
+        self.assertTrue(a.has_open_mat)
+        self.assertIsNotNone(a.open_mat_checked_at)
+        upsert_dojos([{"place_id": "a", "name": "Renamed Club"}])
+        with patch("dojo.serializers.get_open_mat_info") as compute, patch("django.core.cache.cache.get") as get:
+            data = DojoSerializer(Dojo.objects.order_by("place_id"), many=True).data
+        self.assertEqual([d["has_open_mat"] for d in data], [False, False])
+        compute.assert_not_called()
+        get.assert_not_called()
+
+
+class WriteBehindQueueTest(OwnerClientMixin, TestCase):
+    def setUp(self):
+        import tempfile
+        super().setUp()
+        self.spool = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.spool, ignore_errors=True)
+
+    def test_coalesces_batches_and_clears_spool(self):
+        import os
+        from .models import SearchArea
+        from .writebehind import WriteBehindQueue
+
+        q = WriteBehindQueue(self.spool, autostart=False)
+        q.enqueue([{"place_id": "a", "name": "A", "latitude": 35.68, "longitude": 139.76}], query="Tokyo")
+        q.enqueue([{"place_id": "a", "name": "A2"}, {"place_id": "b", "name": "B"}])
+        self.assertEqual(q.pending(), 2)
+        self.assertEqual(Dojo.objects.count(), 0)
+
+        self.assertEqual(q.flush()["inserted"], 2)
+        self.assertEqual(Dojo.objects.get(place_id="a").name, "A2")
+        self.assertTrue(SearchArea.objects.filter(query="tokyo").exists())
+        self.assertEqual(os.listdir(self.spool), [])
+
+    def test_recovers_spool_left_by_dead_process(self):
+        from .writebehind import WriteBehindQueue
+
+        crashed = WriteBehindQueue(self.spool, autostart=False)
+        crashed.enqueue([{"place_id": "a", "name": "A"}])
+        crashed._spool_path().rename(crashed.spool_dir / "wb-12345.ndjson")
+
+        q = WriteBehindQueue(self.spool, autostart=False)
+        with patch("dojo.writebehind._pid_alive", return_value=False):
+            self.assertEqual(q.recover(), 1)
+        q.flush()
+        self.assertTrue(Dojo.objects.filter(place_id="a").exists())
+
+    def test_recovers_spool_of_dead_process_with_reused_pid(self):
+        import os
+        from .writebehind import WriteBehindQueue
+
+        # 同じ PID で開始時刻が違う (= 再起動前の) プロセスのスプール
+        crashed = WriteBehindQueue(self.spool, autostart=False)
+        crashed.enqueue([{"place_id": "a", "name": "A"}])
+        crashed._spool_path().rename(crashed.spool_dir / f"wb-{os.getpid()}-1-deadbeef.ndjson")
+
+        q = WriteBehindQueue(self.spool, autostart=False)
+        q.enqueue([{"place_id": "b", "name": "B"}])
+        self.assertEqual(q.recover(), 1)
+        self.assertEqual(q.recover(), 0)  # 自分のスプールは引き取らない
+        self.assertEqual(q.flush()["inserted"], 2)
+        self.assertEqual(os.listdir(self.spool), [])
+
+
+class FavoriteEnrichmentTest(OwnerClientMixin, TestCase):
+    def test_create_responds_without_fetching_details(self):
+        from .models import EnrichmentJob
+        with patch("dojo.enrichment.fetch_place_details") as details:
+            res = self.client.post("/api/favorites/", {"place_id": "p1", "name": "A"}, format="json")
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.data["enrichment_status"], "pending")
+        details.assert_not_called()
+        self.assertEqual(EnrichmentJob.objects.get(dojo__place_id="p1").status, "pending")
+
+    def test_run_enrichment_and_dedupe(self):
+        from .enrichment import needs_enrichment, request_enrichment, run_enrichment
+        dojo = Dojo.objects.create(place_id="p1", name="A", address="")
+        self.assertTrue(needs_enrichment(dojo))
+        job = request_enrichment(dojo)
+        self.assertEqual(request_enrichment(dojo).pk, job.pk)  # 待機中の依頼はまとめる
+
+        detail = {"rating": 4.8, "reviews": [{"text": "good"}], "website": "https://a.example"}
+        with patch("dojo.enrichment.fetch_place_details", return_value=detail), \
+                patch("dojo.enrichment.fetch_instagram_link", return_value="https://instagram.com/a"):
+            self.assertEqual(run_enrichment(dojo.pk), "done")
+        self.assertIsNone(run_enrichment(dojo.pk))
+        dojo.refresh_from_db()
+        self.assertEqual(dojo.rating, 4.8)
+        self.assertEqual(dojo.instagram, "https://instagram.com/a")
+        self.assertEqual(dojo.place_reviews.reviews, [{"text": "good"}])
+        self.assertFalse(needs_enrichment(dojo))
+
+    def test_failure_schedules_retry(self):
+        from .enrichment import request_enrichment, run_enrichment
+        dojo = Dojo.objects.create(place_id="p1", name="A", address="")
+        request_enrichment(dojo)
+        with patch("dojo.enrichment.fetch_place_details", return_value=None), \
+                patch("dojo.enrichment.dispatch") as dispatch:
+            self.assertEqual(run_enrichment(dojo.pk), "pending")
+        dispatch.assert_called_once_with(dojo.pk, countdown=30)
+        dojo.enrichment.refresh_from_db()
+        self.assertEqual(dojo.enrichment.attempts, 1)
+
+    def test_stale_pending_job_is_dispatched_again(self):
+        from datetime import timedelta
+        from django.utils.timezone import now
+        from .enrichment import STALE_PENDING_SEC, request_enrichment, resume_stale_jobs
+        from .models import EnrichmentJob
+        dojo = Dojo.objects.create(place_id="p1", name="A", address="")
+        old = now() - timedelta(seconds=STALE_PENDING_SEC + 1)
+        with patch("dojo.enrichment.dispatch") as dispatch:
+            with self.captureOnCommitCallbacks(execute=True):
+                request_enrichment(dojo)
+                request_enrichment(dojo)  # 待機中 (新しい) ならまとめる
+            self.assertEqual(dispatch.call_count, 1)
+            # 再試行を予約したプロセスが落ちた
+            EnrichmentJob.objects.update(updated_at=old)
+            with self.captureOnCommitCallbacks(execute=True):
+                request_enrichment(dojo)
+            self.assertEqual(dispatch.call_count, 2)
+
+            EnrichmentJob.objects.update(updated_at=old)
+            self.assertEqual(resume_stale_jobs(), 1)
+            self.assertEqual(resume_stale_jobs(), 0)
+        dispatch.assert_called_with(dojo.pk)
+
+
+class BrowserPoolTest(TestCase):
+    def test_reuses_browser_and_recycles_after_n_pages(self):
+        import asyncio
+        from asgiref.sync import async_to_sync
+        from .browser import BrowserPool
+
+        launched = []
+
+        class FakePage:
+            async def close(self):
+                pass
+
+        class FakeContext:
+            async def new_page(self):
+                return FakePage()
+
+            async def route(self, pattern, handler):
+                pass
+
+            async def clear_cookies(self):
+                pass
+
+            async def close(self):
+                pass
+
+        class FakeBrowser:
+            def __init__(self):
+                self.connected = True
+                launched.append(self)
+
+            def is_connected(self):
+                return self.connected
+
+            async def new_context(self, **kwargs):
+                return FakeContext()
+
+            async def close(self):
+                self.connected = False
+
+        class FakePlaywright:
+            class chromium:
+                @staticmethod
+                async def launch(**kwargs):
+                    return FakeBrowser()
+
+            async def stop(self):
+                pass
+
+        class FakeStarter:
+            async def start(self):
+                return FakePlaywright()
+
+        pool = BrowserPool(max_pages=2, pages_per_browser=3)
+        in_flight, peak = 0, 0
+
+        async def visit():
+            nonlocal in_flight, peak
+            async with pool.page():
+                in_flight += 1
+                peak = max(peak, in_flight)
+                await asyncio.sleep(0.01)
+                in_flight -= 1
+
+        async def run():
+            await asyncio.gather(*(visit() for _ in range(6)))
+            await pool.close()
+
+        with patch("dojo.browser.async_playwright", return_value=FakeStarter()):
+            async_to_sync(run)()
+
+        self.assertEqual(peak, 2)
+        self.assertEqual(len(launched), 2)
+        self.assertFalse(any(b.connected for b in launched))
+
+
+class InstagramLinkScanTest(TestCase):
+    def _chunks(self, data, size):
+        return (data[i:i + size] for i in range(0, len(data), size))
+
+    def test_finds_link_split_across_chunks(self):
+        from .htmlscan import scan_chunks
+        page = b"<html>" + b"x" * 5000 + b'<a class="s" href="https://instagram.com/a?x=1&amp;y=2">IG</a>'
+        self.assertEqual(scan_chunks(self._chunks(page, 7)), "https://instagram.com/a?x=1&y=2")
+
+    def test_stops_at_byte_cap(self):
+        from .htmlscan import scan_chunks
+        page = b"x" * 10000 + b'<a href="https://instagram.com/late">IG</a>'
+        self.assertIsNone(scan_chunks(self._chunks(page, 1000), max_bytes=5000))
+
+    def test_falls_back_to_parser_only_when_hinted(self):
+        from .htmlscan import scan_chunks
+        odd = b'<a title="a>b" href="https://instagram.com/odd">IG</a>'  # 属性値の中に >
+        self.assertEqual(scan_chunks([odd]), "https://instagram.com/odd")
+        with patch("dojo.htmlscan.BeautifulSoup") as soup:
+            self.assertIsNone(scan_chunks([b'<a href="https://facebook.com/x">FB</a>']))
+        soup.assert_not_called()
+
+
+class RenderGateTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def _scanner(self, page):
+        from .htmlscan import InstagramLinkScanner
+        scanner = InstagramLinkScanner()
+        scanner.feed(page)
+        return scanner
+
+    def test_static_page_without_instagram_is_not_rendered(self):
+        from .rendergate import should_render
+        page = b"<html><body>" + b'<p>Classes</p><a href="/x">x</a>' * 200 + b"</body></html>"
+        self.assertFalse(should_render("https://dojo.example/", self._scanner(page), 200))
+        self.assertFalse(should_render("https://dojo.example/", None, None))
+
+    def test_spa_shell_is_rendered_until_it_keeps_missing(self):
+        from .rendergate import record_render, should_render
+        shell = b'<html><body><div id="root"></div><script src="/app.js"></script>' + b" " * 4000 + b"</body></html>"
+        url = "https://www.spa.example/home"
+        self.assertTrue(should_render(url, self._scanner(shell), 200))
+        record_render(url, helped=False)
+        record_render("https://spa.example/", helped=False)
+        self.assertFalse(should_render(url, self._scanner(shell), 200))
+
+    def test_domain_where_rendering_helped_is_always_rendered(self):
+        from .rendergate import record_render, should_render
+        record_render("https://wix.example/", helped=True)
+        self.assertTrue(should_render("https://wix.example/about", None, None))
+
+
+class WebsiteCrawlCacheTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def _session(self, responses, sent):
+        class FakeContent:
+            def __init__(self, body):
+                self.body = body
+
+            async def iter_chunked(self, size):
+                yield self.body
+
+        class FakeResponse:
+            def __init__(self, status, body=b"", headers=None):
+                self.status = status
+                self.headers = headers or {}
+                self.content = FakeContent(body)
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                return False
+
+        class FakeSession:
+            def get(self, url, headers=None, timeout=None):
+                sent.append(headers)
+                return FakeResponse(*responses.pop(0))
+
+        return FakeSession()
+
+    def _fetch(self, session):
+        from asgiref.sync import async_to_sync
+        from django.core.cache import cache
+        from .utils import fetch_instagram_link_async
+        cache.clear()  # 24h の結果キャッシュが切れた状態
+        return async_to_sync(fetch_instagram_link_async)("https://dojo.example/", session)
+
+    def test_revalidates_with_etag_and_reuses_result_on_304(self):
+        page = b'<html><a href="https://instagram.com/dojo">IG</a></html>'
+        sent = []
+        session = self._session([(200, page, {"ETag": '"v1"'}), (304,)], sent)
+        self.assertEqual(self._fetch(session), "https://instagram.com/dojo")
+        self.assertEqual(self._fetch(session), "https://instagram.com/dojo")
+        self.assertEqual(sent[1]["If-None-Match"], '"v1"')
+
+    def test_identical_body_skips_rendering(self):
+        page = b"<html><body>" + b'<p>Classes</p><a href="/x">x</a>' * 200 + b"</body></html>"
+        sent = []
+        session = self._session([(200, page), (200, page)], sent)
+        with patch("dojo.utils.should_render", return_value=False) as gate:
+            self.assertIsNone(self._fetch(session))
+            self.assertIsNone(self._fetch(session))
+        self.assertEqual(gate.call_count, 1)
+
+
+class OpenMatTaskTest(OwnerClientMixin, TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        super().setUp()
+        cache.clear()
+
+    def test_processes_only_unchecked_rows_and_writes_changes(self):
+        from .tasks import update_open_mat_info_task
+        Dojo.objects.create(place_id="a", name="Sunday Open Mat BJJ", address="")
+        Dojo.objects.create(place_id="b", name="Plain BJJ", address="")
+
+        self.assertEqual(update_open_mat_info_task(), {"checked": 2, "changed": 2})
+        self.assertTrue(Dojo.objects.get(place_id="a").has_open_mat)
+        self.assertEqual(update_open_mat_info_task(), {"checked": 0, "changed": 0})
+        self.assertEqual(update_open_mat_info_task(full=True), {"checked": 2, "changed": 0})
+
+    def test_signal_enqueues_one_batch_task(self):
+        from .signals import update_open_mat_info
+        with patch("dojo.signals.update_open_mat_info_task") as task, \
+                self.captureOnCommitCallbacks(execute=True):
+            for pid in ("a", "b", "c"):
+                dojo = Dojo(place_id=pid, name=pid, address="")
+                update_open_mat_info(Dojo, dojo, created=True)
+        task.apply_async.assert_called_once_with(countdown=30)
+
+    def test_rolled_back_create_does_not_suppress_the_next_schedule(self):
+        from django.db import transaction
+        from .signals import update_open_mat_info
+        with patch("dojo.signals.update_open_mat_info_task") as task:
+            with self.captureOnCommitCallbacks(execute=True):
+                try:
+                    with transaction.atomic():
+                        update_open_mat_info(Dojo, Dojo(place_id="a", name="a", address=""), created=True)
+                        raise RuntimeError("rollback")
+                except RuntimeError:
+                    pass
+            task.apply_async.assert_not_called()
+            with self.captureOnCommitCallbacks(execute=True):
+                update_open_mat_info(Dojo, Dojo(place_id="b", name="b", address=""), created=True)
+        task.apply_async.assert_called_once_with(countdown=30)
+
+
+class UpdateDojoHoursCommandTest(OwnerClientMixin, TestCase):
+    def setUp(self):
+        import os
+        import tempfile
+        super().setUp()
+        self.a = Dojo.objects.create(place_id="a", name="A", address="")
+        self.b = Dojo.objects.create(place_id="b", name="B", address="")
+        self.tmp = tempfile.TemporaryDirectory()
+        self.checkpoint = os.path.join(self.tmp.name, "checkpoint.json")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _run(self, *args):
+        async def fake_details(place_id, api_key, use_cache=True):
+            return {"place_id": place_id, "hours": [f"Mon: {place_id}"]}
+
+        with patch("dojo.management.commands.update_dojo_hours.fetch_place_details_async",
+                   side_effect=fake_details) as details:
+            self._run_with_details(*args)
+        return details
+
+    def _run_with_details(self, *args):
+        from io import StringIO
+        from django.core.management import call_command
+        from django.test import override_settings
+        with override_settings(GOOGLE_API_KEY="key"):
+            call_command("update_dojo_hours", "--checkpoint", self.checkpoint, *args,
+                         stdout=StringIO(), stderr=StringIO())
+
+    def test_refreshes_and_skips_fresh_rows(self):
+        import os
+        details = self._run("--stale-after", "7")
+        self.assertEqual(details.call_count, 2)
+        self.assertTrue(all(c.kwargs == {"use_cache": False} for c in details.call_args_list))
+        self.assertEqual(Dojo.objects.get(place_id="a").hours, ["Mon: a"])
+        self.assertIsNotNone(Dojo.objects.get(place_id="b").hours_refreshed_at)
+        self.assertFalse(os.path.exists(self.checkpoint))
+        self.assertEqual(self._run("--stale-after", "7").call_count, 0)
+
+    def test_resumes_from_checkpoint(self):
+        import json
+        from django.utils.timezone import now
+        with open(self.checkpoint, "w") as f:
+            json.dump({"started_at": now().isoformat(), "stale_after": None, "last_id": self.a.id}, f)
+        details = self._run()
+        self.assertEqual([c.args[0] for c in details.call_args_list], ["b"])
+
+    def test_failed_rows_stay_in_checkpoint_and_are_retried(self):
+        import json
+        from django.utils.timezone import now
+        from dojo.management.commands.update_dojo_hours import Command
+        saved = []
+        real_save = Command._save_checkpoint
+
+        def save(path, state):
+            saved.append(state)
+            real_save(path, state)
+
+        async def failing_a(place_id, api_key, use_cache=True):
+            return None if place_id == "a" else {"place_id": place_id, "hours": ["Mon"]}
+
+        with patch.object(Command, "_save_checkpoint", side_effect=save), \
+                patch("dojo.management.commands.update_dojo_hours.fetch_place_details_async",
+                      side_effect=failing_a):
+            self._run_with_details("--batch-size", "1")
+        self.assertEqual(saved[-1]["last_id"], self.b.id)
+        self.assertEqual(saved[-1]["failed_ids"], [self.a.id])
+
+        # 中断したとみなして最後のチェックポイントから再開すると、失敗した a だけを取り直す
+        with open(self.checkpoint, "w") as f:
+            json.dump(dict(saved[-1], started_at=now().isoformat()), f)
+        details = self._run()
+        self.assertEqual([c.args[0] for c in details.call_args_list], ["a"])
+        self.assertEqual(Dojo.objects.get(place_id="a").hours, ["Mon: a"])
+
+
+class RefreshSchedulerTest(OwnerClientMixin, TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        super().setUp()
+        cache.clear()
+
+    def test_priority_prefers_popular_and_stale_rows(self):
+        from datetime import timedelta
+        from django.utils.timezone import now
+        from .models import Favorite
+        from .scheduler import pick_refresh_batch
+        at = now()
+        Dojo.objects.create(place_id="fresh", name="F", address="", hours_refreshed_at=at - timedelta(hours=1))
+        Dojo.objects.create(place_id="quiet", name="Q", address="", hours_refreshed_at=at - timedelta(days=10))
+        hot = Dojo.objects.create(place_id="hot", name="H", address="", search_hits=50,
+                                  hours_refreshed_at=at - timedelta(days=10))
+        Favorite.objects.create(user=self.user, dojo=hot)
+
+        batch = pick_refresh_batch(10, at)
+        self.assertEqual([p for _, _, p in batch], ["hot", "quiet"])
+        self.assertAlmostEqual(batch[1][0], 10.0, places=3)  # 人気度 1 × 10 日
+
+    def test_hourly_budget_caps_calls(self):
+        from django.test import override_settings
+        from .scheduler import refresh_popular_dojos
+        for pid in ("a", "b", "c"):
+            Dojo.objects.create(place_id=pid, name=pid, address="")
+
+        async def fake_details(place_id, api_key, use_cache=True):
+            return {"place_id": place_id, "name": place_id.upper(), "rating": 4.0}
+
+        # 予算 2 回/時、30 分間隔 → 1 回の実行で 1 件ずつ
+        with override_settings(GOOGLE_API_KEY="key", PLACES_REFRESH_BUDGET_PER_HOUR=2,
+                               PLACES_REFRESH_INTERVAL_SEC=30 * 60), \
+                patch("dojo.scheduler.fetch_place_details_async", side_effect=fake_details):
+            self.assertEqual(refresh_popular_dojos()["refreshed"], 1)
+            self.assertEqual(refresh_popular_dojos()["refreshed"], 1)
+            self.assertEqual(refresh_popular_dojos()["picked"], 0)
+        self.assertEqual(Dojo.objects.filter(hours_refreshed_at__isnull=False).count(), 2)
+
+    def test_budget_is_shared_across_processes(self):
+        from django.core.cache import cache
+        from django.test import override_settings
+        from django.utils.timezone import now
+        from .scheduler import refresh_popular_dojos, release_budget, reserve_budget
+        for pid in ("a", "b", "c"):
+            Dojo.objects.create(place_id=pid, name=pid, address="")
+
+        async def fake_details(place_id, api_key, use_cache=True):
+            return {"place_id": place_id, "name": place_id.upper()}
+
+        at = now()
+        with override_settings(GOOGLE_API_KEY="key", PLACES_REFRESH_BUDGET_PER_HOUR=2,
+                               PLACES_REFRESH_INTERVAL_SEC=60 * 60), \
+                patch("dojo.scheduler.fetch_place_details_async", side_effect=fake_details):
+            self.assertEqual(reserve_budget(5, at), 2)
+            self.assertEqual(reserve_budget(1, at), 0)
+            release_budget(2, at)
+            self.assertEqual(refresh_popular_dojos()["refreshed"], 2)
+            cache.clear()  # 別プロセス (キャッシュは共有されない) からの実行
+            self.assertEqual(refresh_popular_dojos()["picked"], 0)
+
+    def test_search_hits_are_counted_in_one_flush(self):
+        import tempfile
+        from .writebehind import WriteBehindQueue
+        Dojo.objects.create(place_id="a", name="A", address="")
+        with tempfile.TemporaryDirectory() as spool:
+            q = WriteBehindQueue(spool, autostart=False)
+            q.add_hits(["a", "a", "zzz"])
+            q.add_hits(["a"])
+            q.flush()
+        self.assertEqual(Dojo.objects.get(place_id="a").search_hits, 3)
+
+    def test_search_views_count_hits_without_the_global_queue(self):
+        from . import writebehind
+        from .spatial import record_search_area
+        Dojo.objects.create(place_id="a", name="A", address="", latitude=49.2827, longitude=-123.1207)
+        record_search_area("vancouver", [{"latitude": 49.2827, "longitude": -123.1207}])
+        self.client.logout()  # 無料ユーザーの検索回数制限に掛からないよう匿名で呼ぶ
+
+        with self.settings(LOCAL_FIRST_SEARCH=True):
+            self.client.get("/api/fetch_dojo_data/?query=Vancouver")
+            b"".join(self.client.get("/api/fetch_dojo_data/stream/?query=Vancouver").streaming_content)
+
+        # テスト中はその場で書き込み、プロセス共通のキュー (終了時に本番 DB へ書く) を作らない
+        self.assertEqual(Dojo.objects.get(place_id="a").search_hits, 2)
+        self.assertIsNone(writebehind._queue)
+
+
+class DojoListPaginationTest(OwnerClientMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # バンクーバー中心から東へ 0.01 度ずつ
+        for i in range(5):
+            Dojo.objects.create(place_id=f"p{i}", name=f"D{i}", address="", latitude=49.28, longitude=-123.12 + 0.01 * (4 - i))
+
+    def _walk(self, url):
+        seen = []
+        while url:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, 200)
+            seen += [d["name"] for d in res.data["results"]]
+            url = res.data["next"]
+        return seen
+
+    def test_cursor_pages_by_id_with_sparse_fields(self):
+        res = self.client.get("/api/dojos/?page_size=2&fields=id,name,lat,lng")
+        self.assertEqual(set(res.data["results"][0]), {"id", "name", "latitude", "longitude"})
+        self.assertEqual(self._walk("/api/dojos/?page_size=2"), ["D0", "D1", "D2", "D3", "D4"])
+
+    def test_cursor_pages_by_distance(self):
+        names = self._walk("/api/dojos/?lat=49.28&lng=-123.12&radius=5000&page_size=2&fields=name")
+        self.assertEqual(names, ["D4", "D3", "D2", "D1", "D0"])
+
+
+class DojoFullTextSearchTest(OwnerClientMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        Dojo.objects.create(place_id="a", name="Gracie Barra Vancouver", address="1 Main St")
+        Dojo.objects.create(place_id="b", name="Vancouver Judo Club", address="2 Gracie Ave")
+        Dojo.objects.create(place_id="c", name="Toronto BJJ", address="3 King St")
+
+    def _names(self, query):
+        res = self.client.get(f"/api/dojos/?search={query}&fields=name")
+        self.assertEqual(res.status_code, 200)
+        return [d["name"] for d in res.data["results"]]
+
+    def test_substring_and_prefix_match(self):
+        self.assertEqual(set(self._names("couv")), {"Gracie Barra Vancouver", "Vancouver Judo Club"})
+        self.assertEqual(self._names("gracie barra"), ["Gracie Barra Vancouver"])
+        # 2 文字以下は従来の icontains
+        self.assertEqual(self._names("BJ"), ["Toronto BJJ"])
+
+    def test_pages_through_every_match(self):
+        for i in range(7):
+            Dojo.objects.create(place_id=f"k{i}", name=f"Karate {'Dojo ' * i}{i}", address="")
+        url, names = "/api/dojos/?search=karate&page_size=3&fields=name", []
+        while url:
+            res = self.client.get(url)
+            names += [d["name"] for d in res.data["results"]]
+            url = res.data["next"]
+        self.assertEqual(len(names), 7)
+        self.assertEqual(len(set(names)), 7)
+        self.assertEqual(names[0], "Karate 0")  # 短い (語の密度が高い) 名前ほど上位
+
+    def test_index_follows_insert_update_delete(self):
+        dojo = Dojo.objects.get(place_id="c")
+        dojo.name = "Toronto Karate"
+        dojo.save()
+        self.assertEqual(self._names("karate"), ["Toronto Karate"])
+        self.assertEqual(self._names("bjj"), [])
+        dojo.delete()
+        self.assertEqual(self._names("karate"), [])
+        Dojo.objects.create(place_id="d", name="Montreal Karate")
+        self.assertEqual(self._names("karate"), ["Montreal Karate"])
+
+    def test_rebuilds_missing_triggers(self):
+        from django.db import connection
+        from .search import FTS_TABLE, ensure_search_index
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TRIGGER {FTS_TABLE}_ai")
+        Dojo.objects.create(place_id="d", name="Calgary Aikido")
+        ensure_search_index()
+        self.assertEqual(self._names("aikido"), ["Calgary Aikido"])
+
+
+class ListQueryCountTest(QueryBudgetMixin, OwnerClientMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.open_mat = OpenMat.objects.create(name="Sunday")
+        self.n = 0
+        self._add_rows(2)
+
+    def _add_rows(self, count):
+        from .models import EnrichmentJob, Favorite
+        for _ in range(count):
+            self.n += 1
+            dojo = Dojo.objects.create(place_id=f"p{self.n}", name=f"D{self.n}", address="")
+            dojo.open_mats.add(self.open_mat)
+            Favorite.objects.create(user=self.user, dojo=dojo)
+            EnrichmentJob.objects.create(dojo=dojo)
+
+    def test_dojo_list(self):
+        self.assertQueryBudget("/api/dojos/", 2, self._add_rows)
+
+    def test_favorite_list(self):
+        self.assertQueryBudget("/api/favorites/", 2, self._add_rows)
+
+
+class PlaceReviewsTest(OwnerClientMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.dojo = Dojo.objects.create(place_id="p1", name="A", address="")
+
+    def test_list_omits_reviews_and_detail_fetches_once(self):
+        res = self.client.get("/api/dojos/")
+        self.assertNotIn("reviews", res.data["results"][0])
+
+        detail = {"rating": 4.5, "reviews": [{"text": "great"}]}
+        with self.settings(GOOGLE_API_KEY="k"), \
+                patch("dojo.views.fetch_place_details", return_value=detail) as fetch:
+            for _ in range(2):
+                res = self.client.get(f"/api/dojos/{self.dojo.pk}/reviews/")
+                self.assertEqual(res.data, {"place_id": "p1", "reviews": [{"text": "great"}]})
+        fetch.assert_called_once_with("p1", "k")
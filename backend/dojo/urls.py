@@ -4,6 +4,7 @@ from django.urls import path
 from rest_framework.routers import DefaultRouter
 from .views import (
     FetchDojoDataView,
+    StreamDojoDataView,
     DojoViewSet,
     FetchInstagramLinkView,
     SubmitFeedbackView,
@@ -33,6 +34,7 @@ urlpatterns = [
    
      path("stripe/create-subscription-with-elements/", create_subscription_with_elements, name="create_subscription_with_elements" ),
     path('fetch_dojo_data/', FetchDojoDataView.as_view(), name='fetch_dojo_data'),
+    path('fetch_dojo_data/stream/', StreamDojoDataView.as_view(), name='fetch_dojo_data_stream'),
     path('fetch_instagram_link/', FetchInstagramLinkView.as_view(), name='fetch_instagram_link'),
     path('submit_feedback/', SubmitFeedbackView.as_view(), name='submit_feedback'),
     path('test_sync/', TestSyncView.as_view(), name='test_sync'),
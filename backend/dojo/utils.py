@@ -5,25 +5,58 @@ remove unnecessary Playwright, and ensure backend search works correctly.
 import asyncio
 import hashlib
 import logging
+import threading
 import time
-from typing import Dict, List, Optional, Set
+from datetime import datetime
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
 
 from aiohttp import ClientSession, ClientTimeout
-from asgiref.sync import async_to_sync
-from bs4 import BeautifulSoup
 from django.core.cache import cache
 from django.conf import settings
-from playwright.async_api import async_playwright
+from django.db import close_old_connections
+from django.utils.timezone import now as dj_now
+
+from . import browser
+from . import crawlcache
+from . import geohash as gh
+from . import outbound
+from . import writebehind
+from .browser import get_pool as get_browser_pool
+from .concurrency import AdaptiveLimiter, observe_call
+from .htmlscan import InstagramLinkScanner, scan_response, scan_text_async
+from .outbound import get_session, run_async, run_db
+from .planner import plan_keywords, query_region, record_yields, tile_region
+from .ratelimit import rate_limit
+from .rendergate import record_render, should_render
+from .seen import seen_places
+from .singleflight import single_flight
+from .spatial import (
+    LOCAL_REVALIDATE_SEC,
+    fresh_tiles,
+    known_details,
+    median_center,
+    normalize_query,
+    places_in_circle,
+    record_tile,
+)
 
 GOOGLE_API_KEY = settings.GOOGLE_API_KEY
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG)
 logger.debug(f"Loaded GOOGLE_API_KEY: {GOOGLE_API_KEY}")
 
-# Rate limiting and cache durations
-RATE_LIMIT_MS = 400            # Google recommends ~2.5 QPS
+# Cache durations (rate limits live in ratelimit.places_rate_limits)
 SHORT_CACHE_SEC = 30           # TextSearch/NearbySearch caching window
 DETAIL_CACHE_SEC = 60 * 60 * 24  # 24h for PlaceDetails
+TILE_CACHE_SEC = 60 * 60 * 24    # 24h for NearbySearch tiles (DB keeps the crawl record)
+SEARCH_SOFT_TTL_SEC = 60 * 10      # full search responses: serve as-is
+SEARCH_HARD_TTL_SEC = 60 * 60 * 24 # full search responses: serve stale + refresh in background
+SEARCH_REFRESH_LOCK_SEC = 60 * 2
+
+INSTAGRAM_TIMEOUT = ClientTimeout(total=10)
+
+NEARBY_URL = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
+MAX_NEARBY_RADIUS_M = 50000
 
 # ----------------------------------------------------------------------------
 # Keyword lists
@@ -35,11 +68,28 @@ KEYWORDS_LIST = [
     "jiujitsu",
     "柔術",
 ]
-FORCE_KEYWORDS = [
-    "Spartacus Gym",
-    "Advantage Fitness",
-    "West Vancouver Martial Arts",
+# 地域限定の強制キーワード: その地域の検索でだけ使う。
+# 地名は他の国・州にもある (Richmond VA、Surrey UK など) ので、地域は名前ではなく座標 (中心と半径) で判定する
+FORCE_KEYWORD_REGIONS = [
+    {
+        "center": (49.2827, -123.1207),  # バンクーバー都市圏
+        "radius_m": 40000,
+        "keywords": [
+            "Spartacus Gym",
+            "Advantage Fitness",
+            "West Vancouver Martial Arts",
+        ],
+    },
 ]
+FORCE_KEYWORDS = [kw for region in FORCE_KEYWORD_REGIONS for kw in region["keywords"]]
+
+def force_keywords_for_point(lat: float, lng: float) -> List[str]:
+    return [
+        kw
+        for region in FORCE_KEYWORD_REGIONS
+        if gh.distance_m(lat, lng, *region["center"]) <= region["radius_m"]
+        for kw in region["keywords"]
+    ]
 
 # ----------------------------------------------------------------------------
 # Helper for cache keys: include HTTP method to avoid collisions (#1)
@@ -60,6 +110,7 @@ async def fetch_textsearch_place_ids(
     lat: Optional[float] = None,
     lng: Optional[float] = None,
     radius: int = 30000,
+    on_page: Optional[Callable[[Set[str]], None]] = None,
 ) -> Set[str]:
     place_ids: Set[str] = set()
     base_url = "https://maps.googleapis.com/maps/api/place/textsearch/json"
@@ -69,6 +120,7 @@ async def fetch_textsearch_place_ids(
 
     page = 0
     while page < max_pages:
+        await rate_limit("textsearch")
         async with session.get(base_url, params=params) as resp:
             url = str(resp.url)
             data = await resp.json()
@@ -81,10 +133,10 @@ async def fetch_textsearch_place_ids(
                 logger.error(f"TextSearch API error: status={status}, url={url}")
                 break
 
-            for r in data.get("results", []):
-                pid = r.get("place_id")
-                if pid:
-                    place_ids.add(pid)
+            page_ids = {r["place_id"] for r in data.get("results", []) if r.get("place_id")}
+            place_ids.update(page_ids)
+            if on_page and page_ids:
+                on_page(page_ids)  # ストリーミング検索: ページ単位で Details を先に始める
 
             token = data.get("next_page_token")
             if not token:
@@ -92,8 +144,7 @@ async def fetch_textsearch_place_ids(
 
             params = {"pagetoken": token, "key": api_key}
             page += 1
-            await asyncio.sleep(2)
-            await asyncio.sleep(RATE_LIMIT_MS / 1000)
+            await asyncio.sleep(2)  # next_page_token が有効になるまでの待ち
 
     logger.debug(f"[TextSearch] キーワード『{keyword}』→ 見つかった place_ids: {place_ids}")
     return place_ids
@@ -104,92 +155,198 @@ async def fetch_textsearch_place_ids(
 async def fetch_place_details_async(
     place_id: str,
     api_key: str,
-    session: ClientSession,
+    session: Optional[ClientSession] = None,
+    use_cache: bool = True,
 ) -> Optional[Dict]:
+    session = session or get_session()
     cache_key = generate_cache_key("details", "GET", place_id)
-    cached = cache.get(cache_key)
+    cached = cache.get(cache_key) if use_cache else None
     if cached:
         return cached
+    # 同じ place_id の同時取得は 1 回の API 呼び出しにまとめる
+    return await single_flight(
+        f"details:{place_id}",
+        lambda: _fetch_place_details(place_id, api_key, session, cache_key),
+    )
+
+async def _fetch_place_details(
+    place_id: str,
+    api_key: str,
+    session: ClientSession,
+    cache_key: str,
+) -> Optional[Dict]:
     fields = \
         "name,formatted_address,geometry/location,opening_hours,website,rating,user_ratings_total,reviews"
     url = (
         f"https://maps.googleapis.com/maps/api/place/details/json"
         f"?place_id={place_id}&fields={fields}&key={api_key}"
     )
-    async with session.get(url) as resp:
-        data = await resp.json()
-        if data.get("status") != "OK":
-            logger.error(f"PlaceDetails error: {data.get('status')} for {place_id}")
-            return None
-        result = data.get("result", {})
-        loc = result.get("geometry", {}).get("location", {})
-        detail = {
-            "name": result.get("name"),
-            "address": result.get("formatted_address"),
-            "latitude": loc.get("lat"),
-            "longitude": loc.get("lng"),
-            "hours": result.get("opening_hours", {}).get("weekday_text", []),
-            "website": result.get("website"),
-            "place_id": place_id,
-            "rating": result.get("rating"),
-            "user_ratings_total": result.get("user_ratings_total"),
-            "reviews": result.get("reviews", []),
-        }
-        cache.set(cache_key, detail, DETAIL_CACHE_SEC)
-        return detail
+    await rate_limit("details")
+    with observe_call() as call:  # レート制限の待ちを含めず、HTTP 呼び出しだけを測る
+        async with session.get(url) as resp:
+            data = await resp.json()
+        call.record(resp.status, data.get("status"))
+    if data.get("status") != "OK":
+        logger.error(f"PlaceDetails error: {data.get('status')} for {place_id}")
+        return None
+    result = data.get("result", {})
+    loc = result.get("geometry", {}).get("location", {})
+    detail = {
+        "name": result.get("name"),
+        "address": result.get("formatted_address"),
+        "latitude": loc.get("lat"),
+        "longitude": loc.get("lng"),
+        "hours": result.get("opening_hours", {}).get("weekday_text", []),
+        "website": result.get("website"),
+        "place_id": place_id,
+        "rating": result.get("rating"),
+        "user_ratings_total": result.get("user_ratings_total"),
+        "reviews": result.get("reviews", []),
+    }
+    cache.set(cache_key, detail, DETAIL_CACHE_SEC)
+    return detail
+
+async def iter_details_for(
+    place_ids: Set[str],
+    api_key: str,
+    session: Optional[ClientSession] = None,
+    limiter: Optional[AdaptiveLimiter] = None,
+) -> AsyncIterator[Dict]:
+    """
+    最近取得済み (seen) の place_id は DB の行をすぐに返し、残りは Place Details が
+    届いた順に返す。既出の道場も結果から落とさない。
+    同時実行数は limiter (AIMD) で制限する。
+    """
+    limiter = limiter or AdaptiveLimiter()
+    seen = seen_places.seen(place_ids)
+    known = await run_db(known_details, seen) if seen else {}
+    for detail in known.values():
+        yield detail
+
+    async def fetch_one(pid: str):
+        try:
+            return pid, await limiter.run(lambda: fetch_place_details_async(pid, api_key, session))
+        except Exception as e:
+            logger.error(f"[iter_details_for] PlaceDetails error for {pid}: {e}")
+            return pid, None
+
+    pending = [pid for pid in place_ids if pid not in known]
+    fetched = []
+    try:
+        for next_done in asyncio.as_completed([fetch_one(pid) for pid in pending]):
+            pid, detail = await next_done
+            if isinstance(detail, dict):
+                fetched.append(pid)
+                yield detail
+    finally:
+        seen_places.mark(fetched)
+        logger.debug(f"[iter_details_for] known={len(known)} fetched={len(fetched)}/{len(pending)}")
+
+async def fetch_details_for(
+    place_ids: Set[str],
+    api_key: str,
+    session: Optional[ClientSession] = None,
+    limiter: Optional[AdaptiveLimiter] = None,
+) -> List[Dict]:
+    return [d async for d in iter_details_for(place_ids, api_key, session, limiter)]
 
 # ----------------------------------------------------------------------------
 # Instagram Link: support both static fetch and Playwright dynamic fetch (#2)
 # ----------------------------------------------------------------------------
 async def fetch_instagram_link_async(
     website: str,
-    session: ClientSession,
+    session: Optional[ClientSession] = None,
 ) -> Optional[str]:
     if not website:
         return None
+    session = session or get_session()
     cache_key = generate_cache_key("insta", "GET", website)
     cached = cache.get(cache_key)
     if cached is not None:
-        return cached
+        return cached or None  # "" = 見つからなかった
 
-    # 1) Try static fetch via aiohttp + BeautifulSoup
+    # 1) Conditional static fetch via aiohttp, scanning the body as it streams in
+    crawl = await run_db(crawlcache.load, website)
+    headers = {"User-Agent": "Mozilla/5.0", **crawlcache.conditional_headers(crawl)}
+    scanner, status, page_validators = InstagramLinkScanner(), None, None
     try:
-        async with session.get(website, headers={"User-Agent": "Mozilla/5.0"}) as resp:
+        async with session.get(website, headers=headers, timeout=INSTAGRAM_TIMEOUT) as resp:
+            status = resp.status
+            if resp.status == 304 and crawl is not None:
+                await run_db(crawlcache.touch, crawl)
+                return _remember_instagram(cache_key, crawl.instagram)
             if resp.status == 200:
-                text = await resp.text()
-                soup = BeautifulSoup(text, 'html.parser')
-                for a in soup.find_all('a', href=True):
-                    href = a['href']
-                    if 'instagram.com' in href:
-                        cache.set(cache_key, href, DETAIL_CACHE_SEC)
-                        return href
+                href = await scan_response(resp, scanner=scanner)
+                page_validators = crawlcache.validators(resp.headers)
+                if href:
+                    await run_db(crawlcache.store, website, page_validators, "", href)
+                    return _remember_instagram(cache_key, href)
     except Exception as e:
-        logger.debug(f"Static fetch failed, will try Playwright: {e}")
-
-    # 2) Fallback to Playwright for dynamic pages
-    try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            page = await browser.new_page()
-            await page.goto(website, timeout=10000)
-            content = await page.content()
-            await browser.close()
-            soup = BeautifulSoup(content, 'html.parser')
-            for a in soup.find_all('a', href=True):
-                href = a['href']
-                if 'instagram.com' in href:
-                    cache.set(cache_key, href, DETAIL_CACHE_SEC)
-                    return href
-    except Exception as e:
-        logger.error(f"Playwright dynamic fetch failed for {website}: {e}")
-
-    # No link found
-    cache.set(cache_key, None, DETAIL_CACHE_SEC)
-    return None
+        logger.debug(f"Static fetch failed for {website}: {e}")
+
+    # Same body as last time: reuse the previous result (including one found by Playwright)
+    if page_validators is not None and crawl is not None and crawl.content_hash == scanner.content_hash:
+        await run_db(crawlcache.touch, crawl)
+        return _remember_instagram(cache_key, crawl.instagram)
+
+    # 2) Fallback to Playwright only when the page looks JS-rendered (or rendering helped before)
+    href = None
+    if should_render(website, scanner, status):
+        try:
+            async with get_browser_pool().page() as page:
+                await page.goto(website, timeout=10000)
+                content = await page.content()
+            href = await scan_text_async(content)
+            record_render(website, helped=bool(href))
+        except Exception as e:
+            logger.error(f"Playwright dynamic fetch failed for {website}: {e}")
+
+    if page_validators is not None:
+        await run_db(crawlcache.store, website, page_validators, scanner.content_hash, href)
+    return _remember_instagram(cache_key, href)
+
+
+def _remember_instagram(cache_key: str, href: Optional[str]) -> Optional[str]:
+    cache.set(cache_key, href or "", DETAIL_CACHE_SEC)  # "" = 見つからなかった
+    return href or None
 
 # ----------------------------------------------------------------------------
 # Main TextSearch to fetch dojo data
 # ----------------------------------------------------------------------------
+async def search_forced_keywords(
+    query: str,
+    api_key: str,
+    session: ClientSession,
+    region: str,
+    details: List[Dict],
+    max_pages: int,
+    on_page: Optional[Callable[[Set[str]], None]] = None,
+) -> Tuple[List[str], Dict[str, Set[str]]]:
+    """
+    通常のキーワードの結果の中心 (中央値) が FORCE_KEYWORD_REGIONS の地域内なら、
+    その地域の強制キーワードで TextSearch する。(実行したキーワード, {keyword: place_ids}) を返す。
+    """
+    center = median_center(details)
+    keywords = force_keywords_for_point(*center) if center else []
+    if not keywords:
+        return [], {}
+    forced = await run_db(plan_keywords, region, keywords)
+    lat, lng = center
+    results = await asyncio.gather(
+        *[
+            fetch_textsearch_place_ids(kw, query, api_key, session, max_pages, lat=lat, lng=lng, on_page=on_page)
+            for kw in forced
+        ],
+        return_exceptions=True,
+    )
+    found: Dict[str, Set[str]] = {}
+    for kw, r in zip(forced, results):
+        if isinstance(r, set):
+            found[kw] = r
+        else:
+            logger.error(f"[search_forced_keywords] TextSearch error ({kw}): {r}")
+    return forced, found
+
 async def fetch_dojo_data_async(
     query: str,
     api_key: str,
@@ -201,64 +358,242 @@ async def fetch_dojo_data_async(
     if not api_key:
         raise RuntimeError("GOOGLE_API_KEY is missing")
 
+    # 同じ検索が実行中ならその結果を待つ (リンク共有時の同時アクセス対策)
+    return await single_flight(
+        f"search:{normalize_query(query)}:{max_pages}",
+        lambda: _fetch_dojo_data(query, api_key, max_pages),
+        shared=settings.SEARCH_SINGLE_FLIGHT_SHARED,
+    )
+
+async def _fetch_dojo_data(
+    query: str,
+    api_key: str,
+    max_pages: int,
+) -> Dict[str, List[Dict]]:
     place_ids: Set[str] = set()
-    timeout = ClientTimeout(total=15)
-
-    async with ClientSession(timeout=timeout) as session:
-        # 1. 通常キーワードでの TextSearch
-        tasks = [
-            fetch_textsearch_place_ids(kw, query, api_key, session, max_pages)
-            for kw in KEYWORDS_LIST
-        ]
-        normal_results = await asyncio.gather(*tasks, return_exceptions=True)
-        for r in normal_results:
-            if isinstance(r, set):
-                place_ids.update(r)
-            else:
-                logger.error(f"[fetch_dojo_data_async] TextSearch error (normal): {r}")
-
-        # 2. 強制キーワードでの TextSearch
-        tasks = [
-            fetch_textsearch_place_ids(fkw, query, api_key, session, max_pages)
-            for fkw in FORCE_KEYWORDS
-        ]
-        force_results = await asyncio.gather(*tasks, return_exceptions=True)
-        for r in force_results:
-            if isinstance(r, set):
-                place_ids.update(r)
-            else:
-                logger.error(f"[fetch_dojo_data_async] TextSearch error (force): {r}")
-
-        # 集まった place_ids をログ
-        logger.debug(f"[fetch_dojo_data_async] 全キーワードで集まった place_ids = {place_ids!r}")
-
-        # 3. Place Details を非同期で取得
-        details: List[Dict] = []
-        fetched = cache.get("fetched_pids", set())
-        detail_tasks = []
-
-        for pid in place_ids:
-            if pid not in fetched:
-                detail_tasks.append(fetch_place_details_async(pid, api_key, session))
-                fetched.add(pid)
-
-        cache.set("fetched_pids", fetched, DETAIL_CACHE_SEC)
-        detail_results = await asyncio.gather(*detail_tasks, return_exceptions=True)
-
-        # 取得した詳細オブジェクト数をログ
-        logger.debug(f"[fetch_dojo_data_async] 取得した詳細オブジェクト数 = {len(detail_results)}")
-
-        for d in detail_results:
-            if isinstance(d, dict):
-                details.append(d)
-            else:
-                logger.error(f"[fetch_dojo_data_async] PlaceDetails error: {d}")
+    session = get_session()
+    # 1. 地域に合ったキーワードを収穫の多い順に選ぶ
+    region = query_region(normalize_query(query))
+    planned = await run_db(plan_keywords, region, KEYWORDS_LIST)
+
+    # 2. TextSearch
+    tasks = [
+        fetch_textsearch_place_ids(kw, query, api_key, session, max_pages)
+        for kw in planned
+    ]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    found: Dict[str, Set[str]] = {}
+    for kw, r in zip(planned, results):
+        if isinstance(r, set):
+            found[kw] = r
+            place_ids.update(r)
+        else:
+            logger.error(f"[fetch_dojo_data_async] TextSearch error ({kw}): {r}")
+
+    # 集まった place_ids をログ
+    logger.debug(f"[fetch_dojo_data_async] 全キーワードで集まった place_ids = {place_ids!r}")
+
+    # 3. Place Details を非同期で取得 (同時実行数は AIMD で調整)
+    limiter = AdaptiveLimiter()
+    details = await fetch_details_for(place_ids, api_key, session, limiter)
+
+    # 4. 結果の中心が強制キーワードの地域内なら、そのキーワードでも検索して足す
+    forced, forced_found = await search_forced_keywords(query, api_key, session, region, details, max_pages)
+    forced_ids = set().union(*forced_found.values()) - place_ids
+    if forced_ids:
+        details += await fetch_details_for(forced_ids, api_key, session, limiter)
+    found.update(forced_found)
+    await run_db(record_yields, region, planned + forced, found)
+
+    # 取得した詳細オブジェクト数をログ
+    logger.debug(f"[fetch_dojo_data_async] 取得した詳細オブジェクト数 = {len(details)}, stats = {limiter.stats()}")
 
     return {"dojos": details}
 
 # ----------------------------------------------------------------------------
-# NearbySearch variant
+# Streaming TextSearch: emit each dojo as soon as its details resolve
 # ----------------------------------------------------------------------------
+async def iter_dojo_data_async(
+    query: str,
+    api_key: str,
+    max_pages: int = 5,
+) -> AsyncIterator[Dict]:
+    """
+    {"type": "dojo", "dojo": {...}} を Details が届いた順に返し、最後に
+    {"type": "summary", ...} を 1 つ返す。TextSearch の各ページが届いた時点で
+    そのページの Place Details を始めるので、next_page_token の待ちを待たずに最初の結果が出る。
+    """
+    if not api_key:
+        raise RuntimeError("GOOGLE_API_KEY is missing")
+
+    session = get_session()
+    region = query_region(normalize_query(query))
+    planned = await run_db(plan_keywords, region, KEYWORDS_LIST)
+    out: asyncio.Queue = asyncio.Queue()
+    scheduled: Set[str] = set()
+    detail_tasks: List[asyncio.Future] = []
+    emitted: List[Dict] = []
+    limiter = AdaptiveLimiter()  # ページごとの Details 取得で共有する
+
+    async def emit_details(ids: Set[str]):
+        async for detail in iter_details_for(ids, api_key, session, limiter):
+            emitted.append(detail)
+            await out.put(detail)
+
+    def on_page(ids: Set[str]):
+        new_ids = ids - scheduled
+        if new_ids:
+            scheduled.update(new_ids)
+            detail_tasks.append(asyncio.ensure_future(emit_details(new_ids)))
+
+    async def run():
+        try:
+            results = await asyncio.gather(
+                *[
+                    fetch_textsearch_place_ids(kw, query, api_key, session, max_pages, on_page=on_page)
+                    for kw in planned
+                ],
+                return_exceptions=True,
+            )
+            found = {kw: r for kw, r in zip(planned, results) if isinstance(r, set)}
+            for kw, r in zip(planned, results):
+                if not isinstance(r, set):
+                    logger.error(f"[iter_dojo_data_async] TextSearch error ({kw}): {r}")
+            await asyncio.gather(*detail_tasks, return_exceptions=True)
+            # 結果の中心が強制キーワードの地域内なら、そのキーワードでも検索して足す
+            forced, forced_found = await search_forced_keywords(
+                query, api_key, session, region, emitted, max_pages, on_page=on_page
+            )
+            found.update(forced_found)
+            await run_db(record_yields, region, planned + forced, found)
+            await asyncio.gather(*detail_tasks, return_exceptions=True)
+        finally:
+            await out.put(None)
+
+    runner = asyncio.ensure_future(run())
+    count = 0
+    try:
+        while True:
+            detail = await out.get()
+            if detail is None:
+                break
+            count += 1
+            yield {"type": "dojo", "dojo": detail}
+        logger.debug(f"[iter_dojo_data_async] {count} dojos, stats = {limiter.stats()}")
+        yield {"type": "summary", "count": count, "place_ids": len(scheduled), "source": "google"}
+    finally:
+        # クライアント切断などで途中終了した場合も上流の処理を残さない
+        if not runner.done():
+            runner.cancel()
+            for task in detail_tasks:
+                task.cancel()
+
+# ----------------------------------------------------------------------------
+# NearbySearch variant: fixed geohash tiles shared by every caller
+# ----------------------------------------------------------------------------
+def tile_cache_key(tile: str) -> str:
+    return f"nearby_tile_{tile}"
+
+async def _nearby_page(session: ClientSession, params: Dict) -> Dict:
+    await rate_limit("nearbysearch")
+    async with session.get(NEARBY_URL, params=params) as resp:
+        return await resp.json()
+
+async def fetch_nearby_places(
+    lat: float,
+    lng: float,
+    radius: int,
+    api_key: str,
+    session: ClientSession,
+    keywords: List[str],
+    max_pages: int = 3,
+) -> Tuple[Dict[str, Dict[str, List[Optional[float]]]], bool]:
+    """
+    キーワードごとに NearbySearch し {keyword: {place_id: [lat, lng]}} を返す。
+    2 つ目の値は全ページ正常に取得できたかどうか。
+    """
+    found: Dict[str, Dict[str, List[Optional[float]]]] = {kw: {} for kw in keywords}
+    complete = True
+    requests_ = [
+        (kw, {"location": f"{lat},{lng}", "radius": radius, "keyword": kw, "key": api_key})
+        for kw in keywords
+    ]
+    page = 0
+    while requests_ and page < max_pages:
+        responses = await asyncio.gather(
+            *[_nearby_page(session, p) for _, p in requests_], return_exceptions=True
+        )
+        next_requests = []
+        for (kw, _), data in zip(requests_, responses):
+            if isinstance(data, Exception):
+                logger.error(f"[NearbySearch] request error ({kw}): {data}")
+                complete = False
+                found.pop(kw, None)
+                continue
+            status = data.get("status")
+            if status not in ("OK", "ZERO_RESULTS"):
+                logger.error(f"[NearbySearch] API error ({kw}): status={status}")
+                complete = False
+                found.pop(kw, None)
+                continue
+            if kw not in found:
+                continue
+            for r in data.get("results", []):
+                pid = r.get("place_id")
+                if pid:
+                    loc = r.get("geometry", {}).get("location", {})
+                    found[kw][pid] = [loc.get("lat"), loc.get("lng")]
+            token = data.get("next_page_token")
+            if token:
+                next_requests.append((kw, {"pagetoken": token, "key": api_key}))
+        requests_ = next_requests
+        page += 1
+        if requests_ and page < max_pages:
+            await asyncio.sleep(2)
+    return found, complete
+
+async def load_tiles(tiles: Set[str]) -> Dict[str, Dict]:
+    """
+    キャッシュ → CrawledTile (DB) の順に取得済みタイルを集める。
+    """
+    keys = {tile_cache_key(t): t for t in tiles}
+    found = {keys[k]: v for k, v in cache.get_many(list(keys)).items()}
+    missing = [t for t in tiles if t not in found]
+    if missing:
+        stored = await run_db(fresh_tiles, missing)
+        if stored:
+            cache.set_many({tile_cache_key(t): p for t, p in stored.items()}, TILE_CACHE_SEC)
+        found.update(stored)
+    return found
+
+async def crawl_tile(
+    tile: str,
+    api_key: str,
+    session: ClientSession,
+    max_pages: int = 3,
+) -> Dict[str, List[Optional[float]]]:
+    """
+    タイル全体を覆う円で NearbySearch し、結果をキャッシュと DB に保存する。
+    一部失敗したタイルは DB に記録せず SHORT_CACHE_SEC だけキャッシュする。
+    """
+    lat, lng = gh.center(tile)
+    radius = int(min(gh.tile_radius_m(tile), MAX_NEARBY_RADIUS_M))
+    region = tile_region(tile)
+    planned = await run_db(
+        plan_keywords, region, KEYWORDS_LIST + force_keywords_for_point(lat, lng)
+    )
+    found, complete = await fetch_nearby_places(lat, lng, radius, api_key, session, planned, max_pages)
+    await run_db(record_yields, region, planned, {kw: set(p) for kw, p in found.items()})
+    places: Dict[str, List[Optional[float]]] = {}
+    for kw_places in found.values():
+        places.update(kw_places)
+    if complete:
+        cache.set(tile_cache_key(tile), places, TILE_CACHE_SEC)
+        await run_db(record_tile, tile, places)
+    else:
+        cache.set(tile_cache_key(tile), places, SHORT_CACHE_SEC)
+    return places
+
 async def fetch_dojo_data_nearby_async(
     lat: float,
     lng: float,
@@ -269,77 +604,164 @@ async def fetch_dojo_data_nearby_async(
     logger.debug(f"NearbySearch fetch for: {lat},{lng} r={radius}")
     if not api_key:
         return {"dojos": []}
-    place_ids: Set[str] = set()
-    timeout = ClientTimeout(total=15)
-    async with ClientSession(timeout=timeout) as session:
-        # all keywords
-        tasks = [
-            session.get(
-                "https://maps.googleapis.com/maps/api/place/nearbysearch/json",
-                params={"location":f"{lat},{lng}","radius":radius,"keyword":kw,"key":api_key}
-            ) for kw in KEYWORDS_LIST + FORCE_KEYWORDS
-        ]
-        page = 0
-        while page < max_pages:
-            responses = await asyncio.gather(*tasks, return_exceptions=True)
-            tasks = []
-            for resp in responses:
-                if isinstance(resp, Exception):
-                    continue
-                data = await resp.json()
-                if data.get("status") != "OK":
-                    continue
-                for r in data.get("results", []):
-                    pid = r.get("place_id")
-                    if pid:
-                        place_ids.add(pid)
-                token = data.get("next_page_token")
-                if token:
-                    tasks.append(
-                        session.get(
-                            "https://maps.googleapis.com/maps/api/place/nearbysearch/json",
-                            params={"pagetoken":token,"key":api_key}
-                        )
-                    )
-            if not tasks:
-                break
-            page += 1
-            await asyncio.sleep(2)
-
-        # details
-        details: List[Dict] = []
-        detail_tasks = [fetch_place_details_async(pid, api_key, session) for pid in place_ids]
-        detail_results = await asyncio.gather(*detail_tasks, return_exceptions=True)
-        for d in detail_results:
-            if isinstance(d, dict):
-                details.append(d)
+    tiles = gh.tiles_for_circle(lat, lng, radius)
+    session = get_session()
+    places_by_tile = await load_tiles(tiles)
+    stale = [t for t in tiles if t not in places_by_tile]
+    logger.debug(f"[NearbySearch] tiles={len(tiles)} cached={len(places_by_tile)} crawl={len(stale)}")
+    crawled = await asyncio.gather(
+        *[crawl_tile(t, api_key, session, max_pages) for t in stale], return_exceptions=True
+    )
+    for tile, r in zip(stale, crawled):
+        if isinstance(r, dict):
+            places_by_tile[tile] = r
+        else:
+            logger.error(f"[NearbySearch] tile {tile} error: {r}")
+
+    # タイルの和集合から要求された円の内側だけを残す
+    place_ids = places_in_circle(places_by_tile.values(), lat, lng, radius)
+
+    # details
+    limiter = AdaptiveLimiter()
+    details = await fetch_details_for(place_ids, api_key, session, limiter)
+    logger.debug(f"[NearbySearch] {len(details)} dojos, stats = {limiter.stats()}")
     return {"dojos": details}
 
+# ----------------------------------------------------------------------------
+# Full search responses: stale-while-revalidate cache
+# ----------------------------------------------------------------------------
+def search_cache_key(query: str, max_pages: int) -> str:
+    return generate_cache_key("search", "GET", f"{normalize_query(query)}:{max_pages}")
+
+def refresh_search_cache(query: str, api_key: str, max_pages: int = 5) -> Dict[str, List[Dict]]:
+    """
+    Google から取り直してレスポンスキャッシュを更新する（空の結果はキャッシュしない）。
+    """
+    data = run_async(fetch_dojo_data_async(query, api_key, max_pages=max_pages))
+    if data.get("dojos"):
+        cache.set(
+            search_cache_key(query, max_pages),
+            {"data": data, "fetched_at": time.time()},
+            SEARCH_HARD_TTL_SEC,
+        )
+    return data
+
+def fetch_dojo_data_cached(
+    query: str,
+    api_key: str,
+    max_pages: int = 5,
+    on_refresh: Optional[Callable[[List[Dict]], None]] = None,
+) -> Tuple[Dict[str, List[Dict]], str]:
+    """
+    検索結果全体をキャッシュから返す。戻り値の 2 つ目は "fresh" / "stale" / "miss"。
+      - SEARCH_SOFT_TTL_SEC 以内   → そのまま返す
+      - SEARCH_HARD_TTL_SEC 以内   → 古い結果を即返し、裏で取り直す (完了時に on_refresh)
+      - それ以降 / キャッシュ無し  → 取得完了までブロック
+    """
+    entry = cache.get(search_cache_key(query, max_pages))
+    if entry is None:
+        return refresh_search_cache(query, api_key, max_pages), "miss"
+    if time.time() - entry["fetched_at"] < SEARCH_SOFT_TTL_SEC:
+        return entry["data"], "fresh"
+    _refresh_in_background(query, api_key, max_pages, on_refresh)
+    return entry["data"], "stale"
+
+def revalidate_local_search(
+    query: str,
+    api_key: str,
+    crawled_at: datetime,
+    max_pages: int = 5,
+    on_refresh: Optional[Callable[[List[Dict]], None]] = None,
+) -> bool:
+    """
+    ローカル検索で応答した範囲が期限 (LOCAL_SEARCH_FRESH_SEC) に近づいていれば
+    (LOCAL_REVALIDATE_SEC を過ぎていれば)、期限切れで Google 待ちになる前に裏で取り直す。
+    (取り直した結果を on_refresh で保存すれば SearchArea の crawled_at も新しくなる)
+    """
+    if not api_key or (dj_now() - crawled_at).total_seconds() < LOCAL_REVALIDATE_SEC:
+        return False
+    _refresh_in_background(query, api_key, max_pages, on_refresh)
+    return True
+
+def _refresh_in_background(
+    query: str,
+    api_key: str,
+    max_pages: int,
+    on_refresh: Optional[Callable[[List[Dict]], None]],
+) -> None:
+    lock_key = f"{search_cache_key(query, max_pages)}_refreshing"
+    if not cache.add(lock_key, 1, SEARCH_REFRESH_LOCK_SEC):
+        return  # 別のリクエストが更新中
+
+    def run():
+        try:
+            data = refresh_search_cache(query, api_key, max_pages)
+            if on_refresh and data.get("dojos"):
+                on_refresh(data["dojos"])
+        except Exception as e:
+            logger.error(f"[search cache] background refresh failed for {query!r}: {e}", exc_info=True)
+        finally:
+            cache.delete(lock_key)
+            close_old_connections()
+
+    threading.Thread(target=run, daemon=True).start()
+
 # ----------------------------------------------------------------------------
 # Sync wrappers
 # ----------------------------------------------------------------------------
 def fetch_dojo_data(query: str, api_key: str) -> Dict[str, List[Dict]]:
     try:
-        return async_to_sync(fetch_dojo_data_async)(query, api_key)
+        return run_async(fetch_dojo_data_async(query, api_key))
     except Exception as e:
         logger.error(f"Error in fetch_dojo_data sync: {e}")
         return {"dojos": []}
 
 def fetch_dojo_data_nearby(lat: float, lng: float, radius: int, api_key: str) -> Dict[str, List[Dict]]:
     try:
-        return async_to_sync(fetch_dojo_data_nearby_async)(lat, lng, radius, api_key)
+        return run_async(fetch_dojo_data_nearby_async(lat, lng, radius, api_key))
     except Exception as e:
         logger.error(f"Error in fetch_dojo_data_nearby sync: {e}")
         return {"dojos": []}
 
-async def fetch_instagram_link(website: str) -> Optional[str]:
-    async with ClientSession(timeout=ClientTimeout(total=10)) as session:
-        return await fetch_instagram_link_async(website, session)
-
-from asgiref.sync import async_to_sync
+def fetch_instagram_link(website: str) -> Optional[str]:
+    """
+    同期コンテキストから呼び出せるラッパー。
+    """
+    return run_async(fetch_instagram_link_async(website))
 
 def fetch_place_details(place_id: str, api_key: str) -> Optional[Dict]:
     """
     同期コンテキストから呼び出せるラッパー。
     """
-    return async_to_sync(fetch_place_details_async)(place_id, api_key)
+    return run_async(fetch_place_details_async(place_id, api_key))
+
+# ----------------------------------------------------------------------------
+# Process lifecycle (DojoConfig.ready registers shutdown with atexit)
+# ----------------------------------------------------------------------------
+def prewarm_browser() -> None:
+    """
+    Playwright のブラウザを先に起動しておく (PLAYWRIGHT_PREWARM=True のときだけ)。
+    gunicorn.conf.py の post_worker_init から、fork 後のワーカーで呼ばれる。
+    celery や管理コマンドでは呼ばないので、使わないブラウザを起動しない。
+    """
+    if not settings.PLAYWRIGHT_PREWARM:
+        return
+
+    def warm():
+        try:
+            run_async(browser.warm_pool())
+            logger.debug("[browser] pool warmed up")
+        except Exception as e:
+            logger.warning(f"Playwright warm-up failed (will retry on first use): {e}")
+
+    threading.Thread(target=warm, name="dojo-browser-prewarm", daemon=True).start()
+
+
+def shutdown() -> None:
+    writebehind.shutdown()  # 未書き込みの検索結果を先に保存
+    if outbound.loop_running():
+        try:
+            run_async(browser.close_pool(), timeout=outbound.SHUTDOWN_TIMEOUT_SEC)
+        except Exception as e:
+            logger.warning(f"[browser] failed to close pool: {e}")
+    outbound.shutdown()
@@ -2,20 +2,20 @@
 # -------------------------------------------------------------
 from __future__ import annotations
 
+import json
 import logging
 import os
 from datetime import datetime, timedelta
 
 import stripe
-from asgiref.sync import async_to_sync
 from django.conf import settings
 from django.core.cache import cache
 from django.db import transaction
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.utils.timezone import localtime
 from django.views.decorators.csrf import csrf_exempt
-from rest_framework import filters, permissions, status, viewsets
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework import permissions, status, viewsets
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -39,6 +39,7 @@ from .models import (
     Dojo,
     Feedback,
     Favorite,
+    PlaceReviews,
     PracticeDay,
     StripeCustomer,
     Subscription,
@@ -50,16 +51,27 @@ from .serializers import (
     UserSerializer,
     FavoriteSerializer,
     PracticeDaySerializer,
+    requested_fields,
 )
 from .utils import (
-    fetch_dojo_data_async,
-    fetch_place_details_async,
     fetch_instagram_link_async,
     fetch_place_details,
     fetch_instagram_link,
     fetch_dojo_data_nearby_async,
+    fetch_dojo_data_cached,
+    fetch_details_for,
+    iter_dojo_data_async,
+    refresh_search_cache,
+    revalidate_local_search,
 )
+from .enrichment import needs_enrichment, request_enrichment
+from .ingest import save_reviews
+from .outbound import iterate_async, run_async
+from .pagination import DistanceCursorPagination, DojoCursorPagination, wants_distance_order
+from .search import DojoSearchFilter
 from .services import get_open_mat_info
+from .spatial import local_search_by_query, local_search_nearby
+from .writebehind import persist_results, record_hits
 
 User = get_user_model()
 stripe.api_key = settings.STRIPE_SECRET_KEY
@@ -322,6 +334,10 @@ def _throttle_message(days: int, lang: str = "en") -> str:
 # =============================================================
 #   検索系ビュー (回数制限を追加)
 # =============================================================
+def _wants_refresh(request) -> bool:
+    """?refresh=1 でローカル検索をスキップし Google から取り直す"""
+    return request.query_params.get("refresh", "").lower() in ("1", "true", "yes")
+
 
 # ────────────────────────────────────────────────────
 # FetchDojoDataView.get （修正版）
@@ -341,30 +357,103 @@ class FetchDojoDataView(APIView):
                 status=status.HTTP_429_TOO_MANY_REQUESTS,
             )
 
-        api_key = settings.GOOGLE_API_KEY
-        dojo_data = async_to_sync(fetch_dojo_data_async)(query, api_key, max_pages=5)
-        if dojo_data and "dojos" in dojo_data:
-            self._save_dojos(dojo_data["dojos"])
+        # ローカル優先: 取得済みの範囲なら Google を呼ばずに DB から応答
+        dojo_data = None
+        if settings.LOCAL_FIRST_SEARCH and not _wants_refresh(request):
+            dojo_data = local_search_by_query(query)
+            if dojo_data is not None:
+                self._revalidate_local(query, dojo_data)
+
+        if dojo_data is None:
+            api_key = settings.GOOGLE_API_KEY
+            if _wants_refresh(request):
+                dojo_data, cache_state = refresh_search_cache(query, api_key, max_pages=5), "miss"
+            else:
+                # 検索結果キャッシュ (stale-while-revalidate)。裏で更新した結果も DB に保存する
+                dojo_data, cache_state = fetch_dojo_data_cached(
+                    query, api_key, max_pages=5,
+                    on_refresh=lambda dojos: self._store_results(query, dojos),
+                )
+            if cache_state == "miss" and dojo_data.get("dojos"):
+                self._store_results(query, dojo_data["dojos"])
+        record_hits(dojo_data.get("dojos") or [])
         _mark_search_performed(request.user)
         return Response(dojo_data, status=200)
 
+    def _revalidate_local(self, query, local):
+        # 範囲の期限が近づいていれば応答はローカルのまま、裏で Google から取り直して保存する
+        revalidate_local_search(
+            query, settings.GOOGLE_API_KEY, local.pop("crawled_at"), max_pages=5,
+            on_refresh=lambda dojos: self._store_results(query, dojos),
+        )
+
+    def _store_results(self, query, dojos):
+        # DB への書き込みは write-behind キューに任せ、応答を待たせない
+        persist_results(dojos, query=query)
+
     # ★必ず定義しておく
     def _save_dojos(self, dojos):
-        for d in dojos:
-            Dojo.objects.update_or_create(
-                place_id=d["place_id"],
-                defaults={
-                    "name": d.get("name", "Unknown"),
-                    "address": d.get("address", ""),
-                    "latitude": d.get("latitude"),
-                    "longitude": d.get("longitude"),
-                    "website": d.get("website", ""),
-                    "hours": d.get("hours", []),
-                    "rating": d.get("rating"),
-                    "user_ratings_total": d.get("user_ratings_total"),
-                },
+        persist_results(dojos)
+
+
+# ────────────────────────────────────────────────────
+# StreamDojoDataView.get : 結果を NDJSON で 1 件ずつ返す
+# ────────────────────────────────────────────────────
+class StreamDojoDataView(FetchDojoDataView):
+    """
+    1 行 1 JSON (application/x-ndjson):
+      {"type": "dojo", "dojo": {...}}   … Place Details が届いた順
+      {"type": "summary", "count": n, ...}  … 最後に 1 行
+    """
+
+    def get(self, request):
+        query = request.query_params.get("query", "").strip()
+        if not query:
+            return Response({"error": "Query 'query' is required."}, status=400)
+
+        lang = request.query_params.get("lang", "en")
+        if not _user_can_search(request.user):
+            return Response(
+                {"error": _throttle_message(FREE_THROTTLE_DAYS, lang)},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
             )
 
+        local = None
+        if settings.LOCAL_FIRST_SEARCH and not _wants_refresh(request):
+            local = local_search_by_query(query)
+            if local is not None:
+                self._revalidate_local(query, local)
+        _mark_search_performed(request.user)
+
+        if local is not None:
+            frames = self._local_frames(local["dojos"])
+        else:
+            frames = self._google_frames(query, settings.GOOGLE_API_KEY)
+        response = StreamingHttpResponse(
+            (json.dumps(frame, ensure_ascii=False) + "\n" for frame in frames),
+            content_type="application/x-ndjson",
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # プロキシでのバッファリングを無効化
+        return response
+
+    def _local_frames(self, dojos):
+        record_hits(dojos)
+        for d in dojos:
+            yield {"type": "dojo", "dojo": d}
+        yield {"type": "summary", "count": len(dojos), "source": "local"}
+
+    def _google_frames(self, query, api_key):
+        dojos = []
+        for frame in iterate_async(iter_dojo_data_async(query, api_key, max_pages=5)):
+            if frame["type"] == "dojo":
+                dojos.append(frame["dojo"])
+            yield frame
+        # 全件送り終えてからキューに積む
+        if dojos:
+            self._store_results(query, dojos)
+            record_hits(dojos)
+
 
 # ────────────────────────────────────────────────────
 # FetchDojoDataNearbyView.get （修正版）
@@ -388,34 +477,38 @@ class FetchDojoDataNearbyView(APIView):
         radius = int(request.query_params.get("radius", 30000))
         api_key = settings.GOOGLE_API_KEY
 
-        dojos_data = async_to_sync(fetch_dojo_data_nearby_async)(
-            lat=lat, lng=lng, radius=radius, api_key=api_key, max_pages=3
-        )
-        if dojos_data and "dojos" in dojos_data:
-            self._save_dojos(dojos_data["dojos"])
+        dojos_data = None
+        if settings.LOCAL_FIRST_SEARCH and not _wants_refresh(request):
+            dojos_data = local_search_nearby(lat, lng, radius)
+            if dojos_data is not None:
+                self._fill_missing(dojos_data, api_key)
+
+        if dojos_data is None:
+            dojos_data = run_async(fetch_dojo_data_nearby_async(
+                lat=lat, lng=lng, radius=radius, api_key=api_key, max_pages=3
+            ))
+            if dojos_data and dojos_data.get("dojos"):
+                self._save_dojos(dojos_data["dojos"])
+        record_hits((dojos_data or {}).get("dojos") or [])
         _mark_search_performed(request.user)
         return Response(dojos_data, status=200)
 
+    def _fill_missing(self, local, api_key):
+        # タイルには載っているが DB にまだ行が無い道場は Details を取って補い、保存する
+        missing = local.pop("missing")
+        if not missing or not api_key:
+            return
+        fetched = run_async(fetch_details_for(set(missing), api_key))
+        local["dojos"].extend(fetched)
+        self._save_dojos(fetched)
+
     def _save_dojos(self, dojos):
-        for d in dojos:
-            Dojo.objects.update_or_create(
-                place_id=d["place_id"],
-                defaults={
-                    "name": d.get("name", "Unknown"),
-                    "address": d.get("address", ""),
-                    "latitude": d.get("latitude"),
-                    "longitude": d.get("longitude"),
-                    "website": d.get("website", ""),
-                    "hours": d.get("hours", []),
-                    "rating": d.get("rating"),
-                    "user_ratings_total": d.get("user_ratings_total"),
-                },
-            )
+        persist_results(dojos)
 
 class FetchPlaceDetailsView(APIView):
     permission_classes = [AllowAny]
 
-    async def get(self, request, *args, **kwargs):
+    def get(self, request, *args, **kwargs):
         place_id = request.query_params.get('place_id')
         if not place_id:
             return Response({"error": "place_id is required."}, status=status.HTTP_400_BAD_REQUEST)
@@ -425,7 +518,7 @@ class FetchPlaceDetailsView(APIView):
             return Response({"error": "Google API key is not configured."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         try:
-            detail = await fetch_place_details_async(place_id, api_key)
+            detail = fetch_place_details(place_id, api_key)
             if not detail:
                 return Response({"error": "Failed to fetch place details."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
             return Response(detail, status=status.HTTP_200_OK)
@@ -567,10 +660,57 @@ def simple_view(request):
 
 
 class DojoViewSet(viewsets.ModelViewSet):
+    """
+    一覧はカーソルページネーション (id 順、?lat=&lng= なら距離順、?search= なら関連度順)。
+    ?fields=id,name,lat,lng で返すフィールドを絞れる。Google レビューは /api/dojos/{id}/reviews/ で別に取る。
+    """
     queryset = Dojo.objects.all()
     serializer_class = DojoSerializer
-    filter_backends = [filters.SearchFilter]
+    filter_backends = [DojoSearchFilter]
     search_fields = ['address', 'name']
+    pagination_class = DojoCursorPagination
+
+    # シリアライザのメソッドフィールドが読むモデルのフィールド
+    FIELD_DEPENDENCIES = {'has_open_mat': ['has_open_mat', 'name', 'website']}
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.action == 'list' and wants_distance_order(self.request):
+                self._paginator = DistanceCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_queryset(self):
+        qs = Dojo.objects.all()
+        if self.action == 'reviews':
+            return qs.only('id', 'place_id')
+        fields = requested_fields(self.request)
+        if fields is None:
+            return qs.prefetch_related('open_mats')
+        if 'open_mats' in fields:
+            qs = qs.prefetch_related('open_mats')
+        model_fields = {f.name for f in Dojo._meta.concrete_fields}
+        columns = {'id', 'latitude', 'longitude'}  # 距離順のページネーションに必要
+        for name in fields:
+            columns.update(self.FIELD_DEPENDENCIES.get(name, [name] if name in model_fields else []))
+        return qs.only(*columns)
+
+    @action(detail=True, methods=['get'])
+    def reviews(self, request, pk=None):
+        """Google レビュー。未取得なら Place Details から取って保存する"""
+        dojo = self.get_object()
+        stored = PlaceReviews.objects.filter(dojo=dojo).first()
+        if stored is not None:
+            reviews = stored.reviews
+        else:
+            api_key = settings.GOOGLE_API_KEY
+            detail = fetch_place_details(dojo.place_id, api_key) if api_key else None
+            reviews = detail.get("reviews", []) if detail else []
+            if detail:
+                save_reviews(dojo, reviews)
+        return Response({"place_id": dojo.place_id, "reviews": reviews})
 
 
 class FavoriteViewSet(viewsets.ModelViewSet):
@@ -579,7 +719,12 @@ class FavoriteViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Favorite.objects.filter(user=self.request.user)
+        # dojo と補完ジョブは JOIN、open_mats は 1 クエリでまとめて取る (行数によらずクエリ数一定)
+        return (
+            Favorite.objects.filter(user=self.request.user)
+            .select_related("dojo__enrichment")
+            .prefetch_related("dojo__open_mats")
+        )
 
     def create(self, request, *args, **kwargs):
         place_id = request.data.get("place_id")
@@ -587,7 +732,6 @@ class FavoriteViewSet(viewsets.ModelViewSet):
             return Response({"error": "place_id is required"}, status=400)
         try:
             with transaction.atomic():
-                api_key = settings.GOOGLE_API_KEY
                 dojo_obj, created = Dojo.objects.get_or_create(
                     place_id=place_id,
                     defaults={
@@ -599,28 +743,31 @@ class FavoriteViewSet(viewsets.ModelViewSet):
                         "hours": request.data.get("hours", []),
                     }
                 )
-                if created or not dojo_obj.reviews:
-                    detail_data = fetch_place_details(place_id, api_key)
-                    if detail_data:
-                        dojo_obj.rating = detail_data.get("rating")
-                        dojo_obj.reviews = detail_data.get("reviews", [])
-                        if detail_data.get("hours"):
-                            dojo_obj.hours = detail_data["hours"]
-                        if detail_data.get("website"):
-                            dojo_obj.website = detail_data["website"]
-                        if dojo_obj.website:
-                            instagram_link = fetch_instagram_link(dojo_obj.website)
-                            dojo_obj.instagram = instagram_link
-                        dojo_obj.save()
                 favorite, fav_created = Favorite.objects.get_or_create(user=request.user, dojo=dojo_obj)
                 if not fav_created:
                     return Response({"error": "Favorite already exists."}, status=400)
-                serializer = self.get_serializer(favorite)
-                return Response(serializer.data, status=201)
+                # 詳細・Instagram の取得はバックグラウンドで (コミット後に開始)
+                if created or needs_enrichment(dojo_obj):
+                    request_enrichment(dojo_obj)
+            serializer = self.get_serializer(favorite)
+            return Response(serializer.data, status=201)
         except Exception as e:
             logger.error(f"Error creating Favorite with place_id={place_id}: {e}", exc_info=True)
             return Response({"error": "Failed to create Favorite"}, status=500)
 
+    @action(detail=True, methods=["get"])
+    def enrichment(self, request, pk=None):
+        """補完ジョブの状態 (ジョブが無ければ status は null)"""
+        favorite = self.get_object()
+        job = getattr(favorite.dojo, "enrichment", None)
+        return Response({
+            "place_id": favorite.dojo.place_id,
+            "status": job.status if job else None,
+            "attempts": job.attempts if job else 0,
+            "last_error": job.last_error if job else "",
+            "completed_at": job.completed_at if job else None,
+        })
+
 
 class PracticeDayViewSet(viewsets.ModelViewSet):
     queryset = PracticeDay.objects.all()
@@ -0,0 +1,337 @@
+"""
+writebehind.py – 検索結果の DB 書き込みを応答から切り離す write-behind キュー。
+
+検索ビューは結果を enqueue() するだけで応答を返し、プロセスごとに 1 本のワーカースレッドが
+複数リクエスト分を place_id 単位でまとめて upsert_dojos() / record_search_area() する。
+書き込みが 1 本のスレッドに集まるので、同時検索どうしの SQLite の書き込みロック待ちも起きない。
+
+enqueue 時にバッチをスプールファイル (NDJSON) に追記しておき、DB への書き込みが成功してから消す。
+プロセスが落ちて残ったスプールは、次に起動したワーカーが引き取って書き込む。
+スプール名は wb-<pid>-<プロセス開始時刻>-<キューごとの乱数>。コンテナの再起動で PID が
+再利用されても、開始時刻が違えば持ち主は終了済みと判断できる。
+"""
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .ingest import add_search_hits, upsert_dojos
+from .spatial import normalize_query, record_search_area
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_SEC = 2
+FLUSH_MAX_ROWS = 500       # これ以上たまったら間隔を待たずに書き込む
+SHUTDOWN_TIMEOUT_SEC = 10
+SPOOL_PREFIX = "wb-"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _process_start(pid: int) -> str:
+    """
+    プロセスの開始時刻 (/proc/<pid>/stat の starttime)。取れなければ "0"。
+    """
+    try:
+        with open(f"/proc/{pid}/stat", encoding="ascii") as f:
+            return f.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return "0"
+
+
+def _owner_alive(pid: int, started: str) -> bool:
+    if not _pid_alive(pid):
+        return False
+    if started == "0":  # 開始時刻が分からないときは生きているものとして扱う
+        return True
+    return _process_start(pid) == started
+
+
+class WriteBehindQueue:
+    def __init__(
+        self,
+        spool_dir,
+        flush_interval: float = FLUSH_INTERVAL_SEC,
+        max_rows: int = FLUSH_MAX_ROWS,
+        autostart: bool = True,
+    ):
+        self.spool_dir = Path(spool_dir)
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.autostart = autostart
+        self._lock = threading.Lock()         # バッファとスプールの入れ替え
+        self._flush_lock = threading.Lock()   # flush は同時に 1 つだけ
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self._dojos: Dict[str, Dict] = {}      # place_id -> 最新の dict
+        self._areas: Dict[str, List[Dict]] = {}  # 正規化済みクエリ -> 結果
+        self._hits: Counter = Counter()        # place_id -> 検索結果に出た回数 (スプールしない)
+        self._claimed: List[Path] = []         # 書き込み待ちのスプールファイル
+        self._seq = 0
+        self._pid = os.getpid()
+        self._owner = f"{self._pid}-{_process_start(self._pid)}-{uuid.uuid4().hex[:8]}"
+        self._spool_opened = False
+
+    # ----------------------------------------------
+    # スプール
+    # ----------------------------------------------
+    def _spool_path(self) -> Path:
+        return self.spool_dir / f"{SPOOL_PREFIX}{self._owner}.ndjson"
+
+    def _append_spool(self, batch: Dict) -> None:
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        if not self._spool_opened:
+            # 同名のファイルが既にあれば (普通は無い) 中身を先にバッファへ取り込む
+            self._spool_opened = True
+            self._load(self._spool_path())
+        with open(self._spool_path(), "a", encoding="utf-8") as f:
+            f.write(json.dumps(batch, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _claim(self, path: Path) -> Optional[Path]:
+        """
+        スプールファイルを自プロセスの書き込み待ちとして改名する (他プロセスと取り合いにならない)。
+        """
+        self._seq += 1
+        claimed = self.spool_dir / f"{SPOOL_PREFIX}{self._owner}-{self._seq}.claimed"
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return None
+        self._claimed.append(claimed)
+        return claimed
+
+    def _load(self, path: Path) -> int:
+        """
+        スプールファイルの各行をバッファに戻し、戻したバッチ数を返す。
+        """
+        batches = 0
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._merge(json.loads(line))
+                    except ValueError:  # 書きかけの行
+                        continue
+                    batches += 1
+        except FileNotFoundError:
+            pass
+        return batches
+
+    def _is_orphan(self, path: Path) -> bool:
+        parts = path.name[len(SPOOL_PREFIX):].split(".")[0].split("-")
+        if not parts[0].isdigit():
+            return False
+        if len(parts) < 3:  # 旧形式 (wb-<pid>) は以前のバージョンが残したもの
+            return True
+        owner = "-".join(parts[:3])
+        return owner != self._owner and not _owner_alive(int(parts[0]), parts[1])
+
+    def recover(self) -> int:
+        """
+        終了済みプロセスが残したスプールを引き取ってバッファに戻す。戻したバッチ数を返す。
+        """
+        if not self.spool_dir.is_dir():
+            return 0
+        batches = 0
+        with self._lock:
+            for path in sorted(self.spool_dir.glob(f"{SPOOL_PREFIX}*")):
+                if not self._is_orphan(path):
+                    continue
+                claimed = self._claim(path)
+                if claimed is None:
+                    continue
+                batches += self._load(claimed)
+        if batches:
+            logger.info(f"[writebehind] recovered {batches} batch(es) from spool")
+        return batches
+
+    # ----------------------------------------------
+    # キュー
+    # ----------------------------------------------
+    def _merge(self, batch: Dict) -> None:
+        for d in batch.get("dojos") or []:
+            if d.get("place_id"):
+                self._dojos[d["place_id"]] = d
+        if batch.get("query"):
+            self._areas[batch["query"]] = batch["dojos"]
+
+    def enqueue(self, dojos: Iterable[Dict], query: Optional[str] = None) -> None:
+        """
+        結果をバッファに積む。query を渡すと SearchArea も記録する。
+        """
+        batch = {"dojos": list(dojos), "query": normalize_query(query) if query else None}
+        if not batch["dojos"]:
+            return
+        with self._lock:
+            self._check_fork()
+            self._append_spool(batch)
+            self._merge(batch)
+            full = len(self._dojos) >= self.max_rows
+        if self.autostart:
+            self._ensure_worker()
+        if full:
+            self._wake.set()
+
+    def _check_fork(self) -> None:
+        # lock を取った状態で呼ぶ。fork 後は親のバッファを引き継がない
+        if self._pid != os.getpid():
+            self._reset()
+            self._thread = None
+
+    def add_hits(self, place_ids: Iterable[str]) -> None:
+        """
+        検索結果に出た place_id を数える (refresh スケジューラの人気度に使う)。
+        """
+        with self._lock:
+            self._check_fork()
+            self._hits.update(place_ids)
+        if self.autostart:
+            self._ensure_worker()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._dojos)
+
+    def flush(self) -> Dict[str, int]:
+        """
+        バッファをまとめて書き込む。失敗したらバッファに戻し、スプールも残す。
+        """
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+        with self._flush_lock:
+            with self._lock:
+                dojos, areas, hits = self._dojos, self._areas, self._hits
+                self._dojos, self._areas, self._hits = {}, {}, Counter()
+                if self._spool_path().exists():
+                    self._claim(self._spool_path())
+                claimed, self._claimed = self._claimed, []
+            if not dojos and not areas and not hits:
+                self._remove(claimed)
+                return counts
+            try:
+                counts = upsert_dojos(dojos.values())
+                for key, area_dojos in areas.items():
+                    record_search_area(key, area_dojos)
+                add_search_hits(hits)
+            except Exception as e:
+                logger.error(f"[writebehind] flush failed, will retry: {e}")
+                with self._lock:
+                    dojos.update(self._dojos)  # 後から積まれたものを優先
+                    areas.update(self._areas)
+                    hits.update(self._hits)
+                    self._dojos, self._areas, self._hits = dojos, areas, hits
+                    self._claimed = claimed + self._claimed
+                return counts
+            finally:
+                if threading.current_thread() is not threading.main_thread():
+                    close_old_connections()
+            self._remove(claimed)
+        logger.debug(f"[writebehind] flushed {len(dojos)} dojos, {len(areas)} areas: {counts}")
+        return counts
+
+    @staticmethod
+    def _remove(paths: List[Path]) -> None:
+        for path in paths:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    # ----------------------------------------------
+    # ワーカースレッド
+    # ----------------------------------------------
+    def _ensure_worker(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="dojo-writebehind", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        try:
+            self.recover()
+        except Exception as e:
+            logger.warning(f"[writebehind] recover failed: {e}")
+        while not self._stopping:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def shutdown(self, timeout: float = SHUTDOWN_TIMEOUT_SEC) -> None:
+        """
+        ワーカーを止めて残りを書き込む。書けなかった分はスプールに残り、次回起動時に書き込まれる。
+        """
+        self._stopping = True
+        self._wake.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        self._thread = None
+        if self._pid == os.getpid():
+            self.flush()
+
+
+_queue: Optional[WriteBehindQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> WriteBehindQueue:
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = WriteBehindQueue(settings.WRITE_BEHIND_SPOOL_DIR)
+        return _queue
+
+
+def persist_results(dojos: List[Dict], query: Optional[str] = None) -> None:
+    """
+    検索結果を保存する。WRITE_BEHIND_PERSIST=False のときはその場で書き込む。
+    """
+    if not dojos:
+        return
+    if settings.WRITE_BEHIND_PERSIST:
+        get_queue().enqueue(dojos, query=query)
+        return
+    upsert_dojos(dojos)
+    if query:
+        record_search_area(normalize_query(query), dojos)
+
+
+def record_hits(dojos: List[Dict]) -> None:
+    """
+    検索で返した道場の出現回数を記録する (ローカル応答も含む)。
+    """
+    place_ids = [d["place_id"] for d in dojos if d.get("place_id")]
+    if not place_ids:
+        return
+    if settings.WRITE_BEHIND_PERSIST:
+        get_queue().add_hits(place_ids)
+    else:
+        add_search_hits(Counter(place_ids))
+
+
+def shutdown() -> None:
+    if _queue is not None:
+        _queue.shutdown()
@@ -0,0 +1,10 @@
+"""
+gunicorn の設定。gunicorn は起動したディレクトリの gunicorn.conf.py を自動で読み込む。
+"""
+
+
+def post_worker_init(worker):
+    # fork 後のワーカーごとに Playwright のブラウザを起動しておく (PLAYWRIGHT_PREWARM=True のときだけ)。
+    # --preload のマスターや celery では起動しない
+    from dojo.utils import prewarm_browser
+    prewarm_browser()
@@ -4,6 +4,7 @@
 # ===============================================
 
 import os
+import sys
 from pathlib import Path
 from datetime import timedelta
 from corsheaders.defaults import default_headers
@@ -36,6 +37,32 @@ CHROME_DRIVER_PATH           = config('CHROME_DRIVER_PATH', default='')
 GOOGLE_APPLICATION_CREDENTIALS = config('GOOGLE_APPLICATION_CREDENTIALS', default='')
 REACT_APP_CHATBOT_API_URL    = config('REACT_APP_CHATBOT_API_URL', default='https://jiujitsu-samurai.com/api/chat/')
 
+# ---------------------------------------------------
+#  道場検索
+# ---------------------------------------------------
+LOCAL_FIRST_SEARCH = config('LOCAL_FIRST_SEARCH', default=True, cast=bool)  # 取得済み範囲は DB から応答
+# Places API の 1 秒あたりの呼び出し上限 (既定の割り当ては 1 メソッドあたり 6,000 QPM = 100 QPS)。
+# 300 件の Place Details でも待ちが (300 - 100) / 50 = 4 秒程度に収まる値にしてある
+PLACES_TEXTSEARCH_QPS = config('PLACES_TEXTSEARCH_QPS', default=5, cast=float)
+PLACES_NEARBYSEARCH_QPS = config('PLACES_NEARBYSEARCH_QPS', default=5, cast=float)
+PLACES_DETAILS_QPS = config('PLACES_DETAILS_QPS', default=50, cast=float)
+PLACES_RATE_LIMIT_SHARED = config('PLACES_RATE_LIMIT_SHARED', default=False, cast=bool)  # 共有キャッシュで全ワーカー共通のレート制限
+SEARCH_SINGLE_FLIGHT_SHARED = config('SEARCH_SINGLE_FLIGHT_SHARED', default=False, cast=bool)  # 共有キャッシュでプロセス間も同時検索をまとめる
+# 検索結果の保存を応答後にまとめて行う。テスト (manage.py test) ではその場で書き込む:
+# プロセス共通のキューは終了時 (テスト DB の削除後) に書き込むので、本番の DB に書いてしまう
+TESTING = sys.argv[1:2] == ['test']
+WRITE_BEHIND_PERSIST = config('WRITE_BEHIND_PERSIST', default=not TESTING, cast=bool)
+WRITE_BEHIND_SPOOL_DIR = config('WRITE_BEHIND_SPOOL_DIR', default=str(BASE_DIR / 'var' / 'writebehind'))  # 未書き込みバッチの退避先
+ENRICHMENT_USE_CELERY = config('ENRICHMENT_USE_CELERY', default=False, cast=bool)  # お気に入りの情報補完を Celery で実行 (False ならプロセス内スレッド)
+PLAYWRIGHT_PREWARM = config('PLAYWRIGHT_PREWARM', default=False, cast=bool)  # gunicorn のワーカー起動時に Instagram 抽出用の Chromium を立ち上げておく (gunicorn.conf.py)
+PLACES_REFRESH_BUDGET_PER_HOUR = config('PLACES_REFRESH_BUDGET_PER_HOUR', default=100, cast=int)  # 定期更新で使う Place Details 呼び出し数/時
+PLACES_REFRESH_INTERVAL_SEC = config('PLACES_REFRESH_INTERVAL_SEC', default=10 * 60, cast=int)  # 定期更新の間隔
+CELERY_BEAT_SCHEDULE = {
+    # 1 回の実行は 1 時間の予算 × 間隔 / 1 時間 だけ使う (更新が時間内に分散される)
+    'refresh-popular-dojos': {'task': 'dojo.tasks.refresh_popular_dojos_task', 'schedule': PLACES_REFRESH_INTERVAL_SEC},
+    'resume-enrichment-jobs': {'task': 'dojo.tasks.resume_enrichment_jobs_task', 'schedule': 5 * 60},
+}
+
 # ---------------------------------------------------
 #  Stripe サブスクリプション設定  ★追加★
 # ---------------------------------------------------